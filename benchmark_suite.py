@@ -0,0 +1,560 @@
+# benchmark_suite.py
+"""Charging profile engine benchmarks and differential correctness checks
+
+Usage:
+    python benchmark_suite.py diff   [--seed N] [--cases N] [--window SECONDS]
+    python benchmark_suite.py bench  [--seed N] [--sizes 10,100,10000]
+    python benchmark_suite.py config [--count 10000]
+    python benchmark_suite.py loop   [--clients 200] [--messages 50] [--loops asyncio,uvloop] [--max-lag 0.05]
+
+'diff' installs randomized profile sets into both engines (charging_profiles.py
+and charging_profile_handler.py) and compares their limit lookup and
+GetCompositeSchedule output, second by second, against a brute-force reference
+evaluator. 'bench' measures Set/Clear/limit-lookup/GetCompositeSchedule
+throughput at different numbers of installed profiles per charger. 'config'
+measures construction time and memory of many ConfigurationManagers. 'loop'
+runs the same loopback OCPP-J request/response scenario (simulators sending
+CALLs over websockets to a local server) on each event loop implementation
+and compares throughput and round-trip latency. A run whose event loop lag
+exceeded --max-lag is marked INVALID: its round trips are dominated by local
+scheduling delay rather than the code under test.
+
+The reference implements the simulator's stacking model: of all active
+profiles that have a period at the given time, the one with the highest
+stackLevel sets the limit. A profile is active inside its validFrom/validTo
+window, while its schedule duration has not elapsed and, for TxProfiles with a
+transactionId, while that transaction is running.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Tuple
+
+import event_loop
+from configuration_keys import ConfigurationManager
+from loop_monitor import LoopMonitor
+from charging_profiles import ChargingProfilesManager
+from charging_profile_handler import ChargingProfileHandler
+
+RECURRENCY_SECONDS = {"Daily": 86400, "Weekly": 604800}
+TRANSACTION_ID = 1001
+
+
+class BenchmarkSimulator:
+    """Minimal stand-in for EVChargerSimulator, exposing what the profile engines use"""
+
+    def __init__(self, number_of_connectors: int = 2, max_stack_level: int = 10):
+        self.number_of_connectors = number_of_connectors
+        self.max_power = 22000
+        self.max_current = 48
+
+        self.config_manager = ConfigurationManager(number_of_connectors=number_of_connectors)
+        self.config_manager.load_custom_config_keys([
+            {"key": "ChargeProfileMaxStackLevel", "readonly": True, "value": str(max_stack_level)},
+            {"key": "MaxChargingProfilesInstalled", "readonly": True, "value": str(max_stack_level + 1)},
+        ])
+
+        self.connector_transactions: Dict[int, Optional[int]] = {
+            i: None for i in range(1, number_of_connectors + 1)
+        }
+        self.transaction_connectors: Dict[int, int] = {}
+
+    def start_transaction(self, connector_id: int, transaction_id: int):
+        """Mark a transaction as running without any OCPP traffic"""
+        self.connector_transactions[connector_id] = transaction_id
+        self.transaction_connectors[transaction_id] = connector_id
+
+    def log(self, message: str, level: str = "INFO"):
+        pass
+
+
+class ManagerEngine:
+    """Adapter for ChargingProfilesManager (charging_profiles.py)"""
+    name = "charging_profiles"
+    includes_connector_zero = False
+
+    def __init__(self, simulator: BenchmarkSimulator):
+        self.simulator = simulator
+        self.engine = ChargingProfilesManager(simulator)
+
+    def set_profile(self, connector_id: int, profile_data: Dict[str, Any]) -> str:
+        return self.engine.handle_set_charging_profile(connector_id, profile_data)
+
+    def clear_profile(self, profile_id: int) -> str:
+        return self.engine.handle_clear_charging_profile({"id": profile_id})
+
+    def limit_at(self, connector_id: int, when: datetime) -> Optional[float]:
+        # Same selection as ChargingProfilesManager._update_current_limits, without side effects
+        naive_time = when.astimezone(timezone.utc).replace(tzinfo=None)
+        for profile in self.engine._get_active_profiles(connector_id, naive_time):
+            period = self.engine._get_applicable_period(profile, naive_time)
+            if period:
+                return min(period.get("limit", 0), self.simulator.max_current)
+        return None
+
+    def composite(self, connector_id: int, duration: int) -> Dict[str, Any]:
+        return self.engine.handle_get_composite_schedule(connector_id, duration)
+
+    def invalidate(self):
+        self.engine.invalidate_composite_cache()
+
+
+class HandlerEngine:
+    """Adapter for ChargingProfileHandler (charging_profile_handler.py)"""
+    name = "charging_profile_handler"
+    includes_connector_zero = True
+
+    def __init__(self, simulator: BenchmarkSimulator):
+        self.simulator = simulator
+        self.engine = ChargingProfileHandler(simulator)
+
+    def set_profile(self, connector_id: int, profile_data: Dict[str, Any]) -> str:
+        return self.engine.handle_set_charging_profile(connector_id, profile_data)
+
+    def clear_profile(self, profile_id: int) -> str:
+        return self.engine.handle_clear_charging_profile({"id": profile_id})
+
+    def limit_at(self, connector_id: int, when: datetime) -> Optional[float]:
+        return self.engine._calculate_effective_limits(connector_id, when)["current_limit"]
+
+    def composite(self, connector_id: int, duration: int) -> Dict[str, Any]:
+        return self.engine.get_composite_schedule(connector_id, duration)
+
+    def invalidate(self):
+        self.engine.invalidate_composite_cache()
+
+
+ENGINES = [ManagerEngine, HandlerEngine]
+
+
+def to_iso(when: datetime) -> str:
+    """Format a UTC datetime the way OCPP messages carry it"""
+    return when.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def parse_iso(value: str) -> datetime:
+    """Parse an OCPP timestamp into an aware UTC datetime"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def random_profile(rng: random.Random, profile_id: int, stack_level: int, connector_id: int,
+                   base_time: datetime, window: int) -> Dict[str, Any]:
+    """Generate a random csChargingProfiles payload that both engines accept"""
+    kind = rng.choice(["Absolute", "Recurring", "Relative"])
+
+    if connector_id == 0:
+        purpose = rng.choice(["ChargePointMaxProfile", "TxDefaultProfile"])
+    elif connector_id == 1:
+        # Connector 1 carries the running transaction in every generated scenario
+        purpose = rng.choice(["TxDefaultProfile", "TxProfile"])
+    else:
+        purpose = "TxDefaultProfile"
+
+    # Bounds are clamped so short windows still give valid ranges; long windows draw the same values
+    first_start = rng.choice([0, 0, 0, rng.randrange(60, max(window // 2, 120), 60)])
+    start_choices = range(first_start + 60, window, 60)
+    later_starts = rng.sample(start_choices, min(rng.randint(0, 4), len(start_choices)))
+    periods = [
+        {"startPeriod": start, "limit": rng.randint(6, 30)}
+        for start in [first_start] + sorted(later_starts)
+    ]
+
+    schedule: Dict[str, Any] = {"chargingRateUnit": "A", "chargingSchedulePeriod": periods}
+    profile: Dict[str, Any] = {
+        "chargingProfileId": profile_id,
+        "stackLevel": stack_level,
+        "chargingProfilePurpose": purpose,
+        "chargingProfileKind": kind,
+        "chargingSchedule": schedule
+    }
+
+    if kind == "Absolute":
+        schedule["startSchedule"] = to_iso(base_time + timedelta(seconds=rng.randint(-window // 2, window // 2)))
+    elif kind == "Recurring":
+        recurrency_kind = rng.choice(["Daily", "Weekly"])
+        profile["recurrencyKind"] = recurrency_kind
+        # Started some recurrences ago, so the check window lands on the scheduled periods
+        recurrences = rng.randint(1, 3)
+        offset = recurrences * RECURRENCY_SECONDS[recurrency_kind] + rng.randint(0, window // 2)
+        schedule["startSchedule"] = to_iso(base_time - timedelta(seconds=offset))
+
+    if rng.random() < 0.3:
+        schedule["duration"] = rng.randrange(600, max(2 * window, 660), 60)
+    if rng.random() < 0.3:
+        profile["validFrom"] = to_iso(base_time + timedelta(seconds=rng.randint(-window, window)))
+    if rng.random() < 0.3:
+        profile["validTo"] = to_iso(base_time + timedelta(seconds=rng.randint(0, 2 * window)))
+    if purpose == "TxProfile" and rng.random() < 0.7:
+        profile["transactionId"] = TRANSACTION_ID
+
+    return profile
+
+
+class ReferenceEvaluator:
+    """Brute-force evaluator of the stacking model, independent of both engines"""
+
+    def __init__(self, includes_connector_zero: bool, max_current: float):
+        self.includes_connector_zero = includes_connector_zero
+        self.max_current = max_current
+        self.installed: Dict[int, List[Tuple[Dict[str, Any], datetime]]] = {}
+
+    def set_profile(self, connector_id: int, profile_data: Dict[str, Any], installed_at: datetime):
+        profiles = self.installed.setdefault(connector_id, [])
+        profiles[:] = [
+            (data, at) for data, at in profiles
+            if data["chargingProfileId"] != profile_data["chargingProfileId"] and
+            not (data["stackLevel"] == profile_data["stackLevel"] and
+                 data["chargingProfilePurpose"] == profile_data["chargingProfilePurpose"])
+        ]
+        profiles.append((profile_data, installed_at))
+
+    def clear_profile(self, profile_id: int):
+        for connector_id, profiles in self.installed.items():
+            profiles[:] = [(data, at) for data, at in profiles if data["chargingProfileId"] != profile_id]
+
+    def limit_at(self, connector_id: int, when: datetime, transactions: Dict[int, int]) -> Optional[float]:
+        candidates = list(self.installed.get(connector_id, []))
+        if self.includes_connector_zero and connector_id > 0:
+            candidates += self.installed.get(0, [])
+
+        best: Optional[Tuple[int, float]] = None
+        for profile_data, installed_at in candidates:
+            limit = self._profile_limit(profile_data, installed_at, when, transactions)
+            if limit is not None and (best is None or profile_data["stackLevel"] > best[0]):
+                best = (profile_data["stackLevel"], limit)
+
+        return min(best[1], self.max_current) if best else None
+
+    @staticmethod
+    def _profile_limit(profile_data: Dict[str, Any], installed_at: datetime, when: datetime,
+                       transactions: Dict[int, int]) -> Optional[float]:
+        if "validFrom" in profile_data and when < parse_iso(profile_data["validFrom"]):
+            return None
+        if "validTo" in profile_data and when > parse_iso(profile_data["validTo"]):
+            return None
+        if "transactionId" in profile_data and profile_data["transactionId"] not in transactions:
+            return None
+
+        schedule = profile_data["chargingSchedule"]
+        if "startSchedule" in schedule:
+            start = parse_iso(schedule["startSchedule"])
+        elif profile_data["chargingProfileKind"] == "Relative":
+            start = installed_at
+        else:
+            start = when
+
+        elapsed = (when - start).total_seconds()
+        if profile_data["chargingProfileKind"] == "Recurring":
+            elapsed %= RECURRENCY_SECONDS[profile_data["recurrencyKind"]]
+        if elapsed < 0:
+            return None
+        if "duration" in schedule and elapsed >= schedule["duration"]:
+            return None
+
+        limit = None
+        for period in schedule["chargingSchedulePeriod"]:
+            if elapsed >= period["startPeriod"]:
+                limit = period["limit"]
+        return limit
+
+
+def expand_composite(response: Dict[str, Any], offset: float) -> Optional[float]:
+    """Limit the composite schedule gives at offset seconds after scheduleStart"""
+    schedule = response.get("chargingSchedule")
+    if not schedule:
+        return None
+    if schedule.get("duration") is not None and offset >= schedule["duration"]:
+        return None
+
+    limit = None
+    for period in schedule["chargingSchedulePeriod"]:
+        if offset >= period["startPeriod"]:
+            limit = period["limit"]
+    return limit
+
+
+def run_differential(seed: int, cases: int, window: int) -> int:
+    """Compare both engines against the reference; returns the number of failing cases"""
+    rng = random.Random(seed)
+    failures = 0
+
+    for engine_class in ENGINES:
+        mismatches = {"limit": 0, "composite": 0}
+        failing_cases = 0
+        examples: List[str] = []
+
+        for case in range(cases):
+            simulator = BenchmarkSimulator(number_of_connectors=2)
+            simulator.start_transaction(1, TRANSACTION_ID)
+            engine = engine_class(simulator)
+            reference = ReferenceEvaluator(engine.includes_connector_zero, simulator.max_current)
+
+            base_time = datetime.now(timezone.utc).replace(microsecond=0)
+            stack_levels = rng.sample(range(0, 11), rng.randint(1, 10))
+            for profile_id, stack_level in enumerate(stack_levels, start=1):
+                connector_id = rng.choice([0, 1, 2])
+                profile_data = random_profile(rng, profile_id, stack_level, connector_id, base_time, window)
+                installed_at = datetime.now(timezone.utc)
+                if engine.set_profile(connector_id, profile_data) == "Accepted":
+                    reference.set_profile(connector_id, profile_data, installed_at)
+
+            case_failed = False
+            for connector_id in (1, 2):
+                # Limit lookups, once per second (sampled mid-second)
+                for second in range(window):
+                    when = base_time + timedelta(seconds=second + 0.5)
+                    expected = reference.limit_at(connector_id, when, simulator.transaction_connectors)
+                    actual = engine.limit_at(connector_id, when)
+                    if expected != actual:
+                        mismatches["limit"] += 1
+                        if not case_failed and len(examples) < 5:
+                            examples.append(f"case {case} connector {connector_id} limit at +{second}s: "
+                                            f"expected {expected}, got {actual}")
+                        case_failed = True
+
+                # GetCompositeSchedule, expanded back to one limit per second
+                response = engine.composite(connector_id, window)
+                schedule_start = parse_iso(response["scheduleStart"]) if "scheduleStart" in response else base_time
+                for second in range(window):
+                    expected = reference.limit_at(connector_id, schedule_start + timedelta(seconds=second + 0.5),
+                                                  simulator.transaction_connectors)
+                    actual = expand_composite(response, second + 0.5)
+                    if expected != actual:
+                        mismatches["composite"] += 1
+                        if not case_failed and len(examples) < 5:
+                            examples.append(f"case {case} connector {connector_id} composite at +{second}s: "
+                                            f"expected {expected}, got {actual}")
+                        case_failed = True
+
+            if case_failed:
+                failing_cases += 1
+
+        checked = cases * 2 * window
+        print(f"{engine_class.name}: {failing_cases}/{cases} cases differ from the reference "
+              f"(limit lookups: {mismatches['limit']}/{checked} seconds, "
+              f"composite: {mismatches['composite']}/{checked} seconds)")
+        for example in examples:
+            print(f"    {example}")
+        failures += failing_cases
+
+    return failures
+
+
+def _rate(operations: int, seconds: float) -> str:
+    return f"{operations / seconds:>12,.0f}/s" if seconds > 0 else f"{'inf':>12}/s"
+
+
+def run_benchmark(seed: int, sizes: List[int]):
+    """Measure engine throughput with the given numbers of installed profiles per charger"""
+    print(f"{'engine':<26}{'profiles':>9}{'set':>15}{'limit lookup':>15}"
+          f"{'composite':>15}{'composite hit':>15}{'clear':>15}")
+
+    for engine_class in ENGINES:
+        for size in sizes:
+            rng = random.Random(seed)
+            simulator = BenchmarkSimulator(number_of_connectors=1, max_stack_level=size)
+            engine = engine_class(simulator)
+            base_time = datetime.now(timezone.utc).replace(microsecond=0)
+
+            profiles = []
+            for profile_id in range(1, size + 1):
+                profile_data = random_profile(rng, profile_id, profile_id - 1, 1, base_time, 3600)
+                profile_data["chargingProfilePurpose"] = "TxDefaultProfile"
+                profile_data.pop("transactionId", None)
+                profiles.append(profile_data)
+
+            start = time.perf_counter()
+            for profile_data in profiles:
+                engine.set_profile(1, profile_data)
+            set_seconds = time.perf_counter() - start
+
+            lookups = max(10, min(1000, 100000 // size))
+            start = time.perf_counter()
+            for second in range(lookups):
+                engine.limit_at(1, base_time + timedelta(seconds=second))
+            lookup_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(lookups):
+                engine.invalidate()
+                engine.composite(1, 86400)
+            composite_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(lookups):
+                engine.composite(1, 86400)
+            composite_hit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for profile_data in profiles:
+                engine.clear_profile(profile_data["chargingProfileId"])
+            clear_seconds = time.perf_counter() - start
+
+            print(f"{engine_class.name:<26}{size:>9}{_rate(size, set_seconds)}{_rate(lookups, lookup_seconds)}"
+                  f"{_rate(lookups, composite_seconds)}{_rate(lookups, composite_hit_seconds)}"
+                  f"{_rate(size, clear_seconds)}")
+
+
+def _private_defaults_manager() -> ConfigurationManager:
+    """Manager holding its own copy of every default key, as each charger did before defaults were shared"""
+    manager = ConfigurationManager()
+    manager.overrides.update(manager._initialize_default_config_keys())
+    return manager
+
+
+def run_config_benchmark(count: int):
+    """Measure construction time and memory of count configuration managers"""
+    print(f"{'defaults':<18}{'managers':>9}{'build time':>14}{'memory':>16}{'per manager':>14}")
+
+    for label, factory in (("shared", ConfigurationManager), ("private copy", _private_defaults_manager)):
+        factory()  # Build the shared default table outside the measurement
+
+        gc.collect()
+        start = time.perf_counter()
+        managers = [factory() for _ in range(count)]
+        build_seconds = time.perf_counter() - start
+        del managers
+
+        gc.collect()
+        tracemalloc.start()
+        managers = [factory() for _ in range(count)]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del managers
+
+        print(f"{label:<18}{count:>9}{build_seconds * 1000:>11.1f} ms{memory / 1024 / 1024:>13.1f} MB"
+              f"{memory / count:>12,.0f} B")
+
+
+async def _read_frames(simulator):
+    """Feed every frame from the simulator's websocket to its handle_message"""
+    async for frame in simulator.websocket:
+        await simulator.handle_message(frame)
+
+
+async def _loop_scenario(clients: int, messages: int, monitor: LoopMonitor) -> Tuple[float, List[float]]:
+    """Simulators send MeterValues CALLs over loopback websockets, one outstanding each, through their own
+    send_call/handle_message path, and a server answers them. Returns the elapsed seconds and every round-trip time"""
+    import websockets
+    from ev_charger_simulator import EVChargerSimulator
+
+    async def answer(websocket, *_):
+        async for frame in websocket:
+            message_id = json.loads(frame)[1]
+            await websocket.send(json.dumps([3, message_id, {}]))
+
+    server = await websockets.serve(answer, "127.0.0.1", 0, subprotocols=["ocpp1.6"], ping_interval=None)
+    port = server.sockets[0].getsockname()[1]
+    round_trips: List[float] = []
+    payload = {
+        "connectorId": 1,
+        "transactionId": TRANSACTION_ID,
+        "meterValue": [{"timestamp": "2024-01-01T00:00:00Z",
+                        "sampledValue": [{"value": "7400", "measurand": "Power.Active.Import", "unit": "W"}]}]
+    }
+
+    async def client(client_id: int):
+        simulator = EVChargerSimulator({"charge_point_id": f"BENCH{client_id:05d}",
+                                        "central_system_url": f"ws://127.0.0.1:{port}"})
+        await simulator._connect_basic()
+        simulator._start_outbound_queue()
+        reader = asyncio.create_task(_read_frames(simulator), name=f"reader:{simulator.charge_point_id}")
+        for _ in range(messages):
+            sent_at = time.perf_counter()
+            await simulator.send_call("MeterValues", payload)
+            round_trips.append(time.perf_counter() - sent_at)
+        reader.cancel()
+        await simulator.disconnect()
+
+    # Per-frame simulator logging would dominate the measurement
+    logging.disable(logging.INFO)
+    monitor.start()
+    monitor.reset()
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(client(client_id) for client_id in range(clients)))
+    finally:
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        logging.disable(logging.NOTSET)
+
+    server.close()
+    await server.wait_closed()
+    return elapsed, round_trips
+
+
+def run_loop_benchmark(clients: int, messages: int, loop_names: List[str], max_lag: float) -> int:
+    """Run the loopback CALL scenario on each event loop implementation. Returns the number of invalid runs"""
+    print(f"{'loop':<10}{'clients':>9}{'messages':>10}{'elapsed':>12}{'throughput':>15}{'p50 rtt':>12}{'p99 rtt':>12}"
+          f"{'max lag':>12}  result")
+    invalid_runs = 0
+
+    for loop_name in loop_names:
+        resolved = event_loop.resolve_loop_name(loop_name)
+        if resolved != loop_name:
+            print(f"{loop_name:<10} not available, skipped")
+            continue
+
+        monitor = LoopMonitor(interval=0.01, lag_threshold=max_lag)
+        elapsed, round_trips = event_loop.run(_loop_scenario(clients, messages, monitor), loop_name)
+        round_trips.sort()
+        p50 = round_trips[len(round_trips) // 2]
+        p99 = round_trips[min(len(round_trips) - 1, int(len(round_trips) * 0.99))]
+        result = "ok" if monitor.valid() else "INVALID (local loop lag over --max-lag)"
+        invalid_runs += 0 if monitor.valid() else 1
+        print(f"{loop_name:<10}{clients:>9}{len(round_trips):>10}{elapsed:>10.2f} s{_rate(len(round_trips), elapsed)}"
+              f"{p50 * 1000:>9.2f} ms{p99 * 1000:>9.2f} ms{monitor.max_lag * 1000:>9.2f} ms  {result}")
+
+    return invalid_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Charging profile engine benchmarks and differential checks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    diff_parser = subparsers.add_parser("diff", help="Compare engines against the brute-force reference")
+    diff_parser.add_argument("--seed", type=int, default=1)
+    diff_parser.add_argument("--cases", type=int, default=200)
+    diff_parser.add_argument("--window", type=int, default=3600, help="Seconds evaluated per connector")
+
+    bench_parser = subparsers.add_parser("bench", help="Measure profile engine throughput")
+    bench_parser.add_argument("--seed", type=int, default=1)
+    bench_parser.add_argument("--sizes", default="10,100,10000", help="Comma separated profile counts")
+
+    config_parser = subparsers.add_parser("config", help="Measure configuration manager construction cost")
+    config_parser.add_argument("--count", type=int, default=10000)
+
+    loop_parser = subparsers.add_parser("loop", help="Compare event loop implementations on one scenario")
+    loop_parser.add_argument("--clients", type=int, default=200, help="Concurrent connections")
+    loop_parser.add_argument("--messages", type=int, default=50, help="CALLs per connection")
+    loop_parser.add_argument("--loops", default="asyncio,uvloop", help="Comma separated: asyncio, uvloop")
+    loop_parser.add_argument("--max-lag", type=float, default=0.05,
+                             help="Event loop lag in seconds above which a run is marked invalid")
+
+    args = parser.parse_args()
+    if args.command == "diff" and args.window < 60:
+        diff_parser.error("--window must be at least 60 seconds")
+
+    if args.command == "diff":
+        failures = run_differential(args.seed, args.cases, args.window)
+        sys.exit(1 if failures else 0)
+    elif args.command == "bench":
+        run_benchmark(args.seed, [int(size) for size in args.sizes.split(",")])
+    elif args.command == "config":
+        run_config_benchmark(args.count)
+    elif args.command == "loop":
+        invalid_runs = run_loop_benchmark(args.clients, args.messages, args.loops.split(","), args.max_lag)
+        sys.exit(1 if invalid_runs else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# call_pipeline.py
+"""Admission of outgoing CALLs: one outstanding CALL per charger, as OCPP-J requires"""
+
+import asyncio
+import heapq
+import itertools
+from typing import List, Tuple
+
+from metrics import registry, LATENCY_BUCKETS
+
+CALL_QUEUE_DELAY_SECONDS = registry.histogram(
+    "ocpp_call_queue_delay_seconds", "Time a CALL waited for the charger's call slot, by action", LATENCY_BUCKETS)
+CALL_RESPONSE_SECONDS = registry.histogram(
+    "ocpp_call_response_seconds", "Time from sending a CALL to its CALLRESULT/CALLERROR, by action", LATENCY_BUCKETS)
+
+
+class CallPipeline:
+    """Grants call slots in priority order (FIFO within a priority).
+
+    max_outstanding is 1 for spec-compliant behaviour; stress tests can raise
+    it, or set it to 0 for no limit at all.
+    """
+
+    def __init__(self, max_outstanding: int = 1):
+        self.max_outstanding = max_outstanding
+        self.outstanding = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+
+    def _has_free_slot(self) -> bool:
+        return self.max_outstanding <= 0 or self.outstanding < self.max_outstanding
+
+    async def acquire(self, priority: int):
+        """Wait for a call slot. Every acquire must be paired with release()"""
+        if self._has_free_slot() and not self.waiters:
+            self.outstanding += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Slot was granted just before the cancellation
+            raise
+
+    def release(self):
+        """Return a call slot and hand it to the next waiter"""
+        self.outstanding -= 1
+        while self.waiters and self._has_free_slot():
+            _, _, future = heapq.heappop(self.waiters)
+            if future.cancelled():
+                continue
+            self.outstanding += 1
+            future.set_result(None)
@@ -1,10 +1,14 @@
 # charging_profile_handler.py
 """OCPP 1.6 SetChargingProfile Handler Module"""
 
+from bisect import bisect_right
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from enum import Enum
+import json
 import logging
+import time
+import weakref
 
 logger = logging.getLogger(__name__)
 
@@ -33,27 +37,73 @@ class ChargingRateUnit(Enum):
 
 class ChargingSchedulePeriod:
     """Represents a charging schedule period"""
+    __slots__ = ("start_period", "limit", "number_phases")
+    
     def __init__(self, period_data: Dict[str, Any]):
         self.start_period = period_data.get("startPeriod", 0)  # seconds from start
         self.limit = period_data.get("limit", 0)  # W or A
         self.number_phases = period_data.get("numberPhases")  # optional
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the OCPP ChargingSchedulePeriod structure"""
+        period_data = {"startPeriod": self.start_period, "limit": self.limit}
+        if self.number_phases is not None:
+            period_data["numberPhases"] = self.number_phases
+        return period_data
 
 
 class ChargingSchedule:
-    """Represents a charging schedule"""
+    """Represents a charging schedule.
+    
+    Schedules are immutable once compiled and interned by content (see intern()),
+    so identical schedules pushed to many chargers share one instance.
+    """
+    __slots__ = ("duration", "start_schedule", "charging_rate_unit", "min_charging_rate",
+                 "periods", "start_periods", "__weakref__")
+    
+    _interned: "weakref.WeakValueDictionary[str, ChargingSchedule]" = weakref.WeakValueDictionary()
+    
     def __init__(self, schedule_data: Dict[str, Any]):
         self.duration = schedule_data.get("duration")  # seconds
         self.start_schedule = schedule_data.get("startSchedule")  # ISO8601
         self.charging_rate_unit = schedule_data.get("chargingRateUnit", "W")
         self.min_charging_rate = schedule_data.get("minChargingRate")
         
-        # Parse charging schedule periods
-        self.periods = []
-        for period_data in schedule_data.get("chargingSchedulePeriod", []):
-            self.periods.append(ChargingSchedulePeriod(period_data))
-        
-        # Sort periods by start time
-        self.periods.sort(key=lambda p: p.start_period)
+        # Parse charging schedule periods, sorted by start time
+        periods = [ChargingSchedulePeriod(period_data)
+                   for period_data in schedule_data.get("chargingSchedulePeriod", [])]
+        periods.sort(key=lambda p: p.start_period)
+        self.periods: Tuple[ChargingSchedulePeriod, ...] = tuple(periods)
+        self.start_periods: Tuple[float, ...] = tuple(p.start_period for p in periods)
+    
+    @classmethod
+    def intern(cls, schedule_data: Dict[str, Any]) -> "ChargingSchedule":
+        """Get the shared schedule for this content, compiling it on first use"""
+        content_key = json.dumps(schedule_data, sort_keys=True, separators=(",", ":"))
+        schedule = cls._interned.get(content_key)
+        if schedule is None:
+            schedule = cls(schedule_data)
+            cls._interned[content_key] = schedule
+        return schedule
+    
+    def period_at(self, elapsed_seconds: float) -> Optional[ChargingSchedulePeriod]:
+        """Get the period active after elapsed_seconds from schedule start"""
+        index = bisect_right(self.start_periods, elapsed_seconds) - 1
+        return self.periods[index] if index >= 0 else None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the OCPP ChargingSchedule structure"""
+        schedule_data = {
+            "chargingRateUnit": self.charging_rate_unit,
+            "chargingSchedulePeriod": [period.to_dict() for period in self.periods]
+        }
+        if self.duration is not None:
+            schedule_data["duration"] = self.duration
+        if self.start_schedule is not None:
+            schedule_data["startSchedule"] = self.start_schedule
+        if self.min_charging_rate is not None:
+            schedule_data["minChargingRate"] = self.min_charging_rate
+        return schedule_data
 
 
 class ChargingProfile:
@@ -68,12 +118,32 @@ class ChargingProfile:
         self.valid_from = profile_data.get("validFrom")
         self.valid_to = profile_data.get("validTo")
         
-        # Parse charging schedule
+        # Parse charging schedule (shared with identical profiles on other chargers)
         schedule_data = profile_data.get("chargingSchedule", {})
-        self.charging_schedule = ChargingSchedule(schedule_data)
+        self.charging_schedule = ChargingSchedule.intern(schedule_data)
         
         # Profile creation time
         self.created_at = datetime.now(timezone.utc)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the OCPP csChargingProfiles structure"""
+        profile_data = {
+            "chargingProfileId": self.charging_profile_id,
+            "stackLevel": self.stack_level,
+            "chargingProfilePurpose": self.charging_profile_purpose,
+            "chargingProfileKind": self.charging_profile_kind,
+            "chargingSchedule": self.charging_schedule.to_dict()
+        }
+        optional_fields = {
+            "transactionId": self.transaction_id,
+            "recurrencyKind": self.recurrency_kind,
+            "validFrom": self.valid_from,
+            "validTo": self.valid_to
+        }
+        for field, value in optional_fields.items():
+            if value is not None:
+                profile_data[field] = value
+        return profile_data
 
 
 class ChargingProfileHandler:
@@ -94,6 +164,30 @@ class ChargingProfileHandler:
                 "current_limit": None,  # in Amperes
                 "min_charging_rate": None  # minimum rate
             }
+        
+        # Bumped whenever installed profiles or transactions change; part of the composite cache key
+        self.profile_store_version = 0
+        self.composite_cache: Dict[tuple, Dict[str, Any]] = {}
+        self.composite_cache_bucket_seconds = 1.0
+        self.composite_cache_max_entries = 256
+        
+        # Profile limits, kept current by a configuration subscription
+        config_manager = self.simulator.config_manager
+        self.max_stack_level = config_manager.get_int_value("ChargeProfileMaxStackLevel", 10)
+        self.max_schedule_periods = config_manager.get_int_value("ChargingScheduleMaxPeriods", 6)
+        config_manager.subscribe(("ChargeProfileMaxStackLevel", "ChargingScheduleMaxPeriods"), self._on_profile_limits_changed)
+    
+    def _on_profile_limits_changed(self, key: str, value: Any):
+        """Pick up a changed ChargeProfileMaxStackLevel or ChargingScheduleMaxPeriods"""
+        if key == "ChargeProfileMaxStackLevel":
+            self.max_stack_level = value if value is not None else 10
+        else:
+            self.max_schedule_periods = value if value is not None else 6
+    
+    def invalidate_composite_cache(self):
+        """Invalidate cached composite schedules after a profile or transaction change"""
+        self.profile_store_version += 1
+        self.composite_cache.clear()
     
     def handle_set_charging_profile(self, connector_id: int, cs_charging_profiles: Dict[str, Any]) -> str:
         """
@@ -118,8 +212,7 @@ class ChargingProfileHandler:
                 return "Rejected"
             
             # Check if charging rate unit is supported
-            allowed_units = self.simulator.config_manager.get_value("ChargingScheduleAllowedChargingRateUnit", "Current,Power")
-            allowed_units_list = [u.strip() for u in allowed_units.split(",")]
+            allowed_units_list = self.simulator.config_manager.get_list_value("ChargingScheduleAllowedChargingRateUnit", ("Current", "Power"))
             
             if profile.charging_schedule.charging_rate_unit == "W" and "Power" not in allowed_units_list:
                 self.simulator.log("Power-based charging profiles not supported", "WARNING")
@@ -153,6 +246,7 @@ class ChargingProfileHandler:
             self.active_profiles[connector_id].sort(key=lambda p: p.stack_level, reverse=True)
             
             # Apply the profile limits immediately
+            self.invalidate_composite_cache()
             self._apply_charging_limits(connector_id)
             
             self.simulator.log(f"Charging profile {profile.charging_profile_id} accepted for connector {connector_id}", "INFO")
@@ -201,10 +295,75 @@ class ChargingProfileHandler:
             
             # Reapply limits after clearing profiles
             if profiles_to_remove:
+                self.invalidate_composite_cache()
                 self._apply_charging_limits(conn_id)
         
         return "Accepted" if profiles_cleared else "Unknown"
     
+    def purge_transaction_profiles(self, connector_id: int, transaction_id: int):
+        """Remove TxProfiles belonging to a transaction that has ended"""
+        for conn_id in (connector_id, 0):
+            if conn_id not in self.active_profiles:
+                continue
+            
+            profiles_to_remove = [
+                profile for profile in self.active_profiles[conn_id]
+                if profile.charging_profile_purpose == "TxProfile" and
+                (profile.transaction_id == transaction_id or
+                 (profile.transaction_id is None and conn_id == connector_id))
+            ]
+            
+            for profile in profiles_to_remove:
+                self.active_profiles[conn_id].remove(profile)
+                self.simulator.log(f"Removed TxProfile {profile.charging_profile_id} after transaction {transaction_id} ended", "INFO")
+            
+            if profiles_to_remove:
+                self.invalidate_composite_cache()
+                self._apply_charging_limits(conn_id)
+    
+    def get_composite_schedule(self, connector_id: int, duration: int,
+                               charging_rate_unit: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Build a GetCompositeSchedule response for a connector.
+        Results are cached per (connector, duration, unit, profile store version,
+        time bucket); the returned dict is shared and must not be modified.
+        """
+        time_bucket = int(time.time() // self.composite_cache_bucket_seconds)
+        cache_key = (connector_id, duration, charging_rate_unit, self.profile_store_version, time_bucket)
+        response = self.composite_cache.get(cache_key)
+        if response is None:
+            if len(self.composite_cache) >= self.composite_cache_max_entries:
+                self.composite_cache.clear()
+            response = self._build_composite_schedule(connector_id, duration, charging_rate_unit)
+            self.composite_cache[cache_key] = response
+        return response
+    
+    def _build_composite_schedule(self, connector_id: int, duration: int,
+                                  charging_rate_unit: Optional[str]) -> Dict[str, Any]:
+        """Build the composite schedule from the highest priority profile on the connector"""
+        connector_profiles = self.active_profiles.get(connector_id, [])
+        if not connector_profiles:
+            return {"status": "Accepted"}
+        
+        highest_priority = max(connector_profiles, key=lambda p: p.stack_level)
+        return {
+            "status": "Accepted",
+            "connectorId": connector_id,
+            "scheduleStart": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "chargingSchedule": {
+                "duration": duration,
+                "chargingRateUnit": charging_rate_unit or highest_priority.charging_schedule.charging_rate_unit,
+                "chargingSchedulePeriod": [
+                    {
+                        "startPeriod": period.start_period,
+                        "limit": period.limit,
+                        "numberPhases": period.number_phases
+                    }
+                    for period in highest_priority.charging_schedule.periods
+                ]
+            }
+        }
+    
     def get_current_charging_limit(self, connector_id: int) -> Dict[str, Optional[float]]:
         """Get current effective charging limits for a connector"""
         if connector_id not in self.current_limits:
@@ -215,12 +374,12 @@ class ChargingProfileHandler:
     def _validate_charging_profile(self, profile: ChargingProfile, connector_id: int) -> str:
         """Validate a charging profile"""
         # Check stack level
-        max_stack_level = self.simulator.config_manager.get_int_value("ChargeProfileMaxStackLevel", 10)
+        max_stack_level = self.max_stack_level
         if profile.stack_level > max_stack_level:
             return f"Stack level {profile.stack_level} exceeds maximum {max_stack_level}"
         
         # Check number of periods
-        max_periods = self.simulator.config_manager.get_int_value("ChargingScheduleMaxPeriods", 6)
+        max_periods = self.max_schedule_periods
         if len(profile.charging_schedule.periods) > max_periods:
             return f"Number of periods {len(profile.charging_schedule.periods)} exceeds maximum {max_periods}"
         
@@ -279,9 +438,11 @@ class ChargingProfileHandler:
         if effective_limits["current_limit"] is not None:
             self.simulator.log(f"Applied current limit {effective_limits['current_limit']}A to connector {connector_id}", "INFO")
     
-    def _calculate_effective_limits(self, connector_id: int) -> Dict[str, Optional[float]]:
+    def _calculate_effective_limits(self, connector_id: int,
+                                    current_time: Optional[datetime] = None) -> Dict[str, Optional[float]]:
         """Calculate effective charging limits based on active profiles"""
-        current_time = datetime.now(timezone.utc)
+        if current_time is None:
+            current_time = datetime.now(timezone.utc)
         
         # Get all active profiles for this connector (including connector 0 profiles)
         all_profiles = []
@@ -348,10 +509,7 @@ class ChargingProfileHandler:
         # Check transaction-specific profiles
         if profile.charging_profile_purpose == "TxProfile" and profile.transaction_id:
             # Check if transaction is still active
-            for conn_id, trans_id in self.simulator.connector_transactions.items():
-                if trans_id == profile.transaction_id:
-                    return True
-            return False
+            return profile.transaction_id in self.simulator.transaction_connectors
         
         return True
     
@@ -383,13 +541,7 @@ class ChargingProfileHandler:
                 elapsed_seconds = elapsed_seconds % 604800  # 7 days
         
         # Find the applicable period
-        applicable_period = None
-        for period in profile.charging_schedule.periods:
-            if elapsed_seconds >= period.start_period:
-                applicable_period = period
-            else:
-                break
-        
+        applicable_period = profile.charging_schedule.period_at(elapsed_seconds)
         return applicable_period.limit if applicable_period else None
     
     def _apply_limits_to_meter_values(self, connector_id: int, limits: Dict[str, Optional[float]]):
@@ -428,6 +580,14 @@ class ChargingProfileHandler:
             voltage = meter_vals["Power.Active.Import"] / meter_vals["Current.Import"] if meter_vals["Current.Import"] > 0 else 230.0
             meter_vals["Voltage"] = min(voltage, 250.0)  # Cap at reasonable voltage
     
+    def get_profiles_snapshot(self) -> Dict[int, List[Dict[str, Any]]]:
+        """Get installed profiles per connector in OCPP form, for persistence"""
+        return {
+            connector_id: [profile.to_dict() for profile in profiles]
+            for connector_id, profiles in self.active_profiles.items()
+            if profiles
+        }
+    
     def get_active_profiles_info(self) -> Dict[int, List[Dict[str, Any]]]:
         """Get information about all active charging profiles"""
         profiles_info = {}
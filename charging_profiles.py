@@ -1,13 +1,54 @@
 # charging_profiles.py
 """OCPP 1.6 Charging Profiles Management"""
 
+from bisect import bisect_right
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import json
 import logging
+import time
+import weakref
 
 logger = logging.getLogger(__name__)
 
 
+class ChargingScheduleBody:
+    """Immutable, compiled chargingSchedule shared by every profile with identical content.
+    
+    Instances are interned by their canonical JSON form, so a TxDefaultProfile pushed
+    to thousands of chargers is parsed and stored once. Period dicts are shared and
+    must never be mutated.
+    """
+    
+    __slots__ = ("duration", "start_schedule", "charging_rate_unit", "min_charging_rate",
+                 "periods", "start_periods", "__weakref__")
+    
+    _interned: "weakref.WeakValueDictionary[str, ChargingScheduleBody]" = weakref.WeakValueDictionary()
+    
+    def __init__(self, charging_schedule: Dict[str, Any]):
+        self.duration = charging_schedule.get("duration")
+        self.start_schedule = charging_schedule.get("startSchedule")
+        self.charging_rate_unit = charging_schedule.get("chargingRateUnit", "A")
+        self.min_charging_rate = charging_schedule.get("minChargingRate")
+        self.periods: Tuple[Dict[str, Any], ...] = tuple(charging_schedule.get("chargingSchedulePeriod", []))
+        # Period start offsets, for bisecting the active period
+        self.start_periods: Tuple[float, ...] = tuple(period.get("startPeriod", 0) for period in self.periods)
+    
+    @classmethod
+    def intern(cls, charging_schedule: Dict[str, Any]) -> "ChargingScheduleBody":
+        """Get the shared body for a chargingSchedule, compiling it on first use"""
+        content_key = json.dumps(charging_schedule, sort_keys=True, separators=(",", ":"))
+        body = cls._interned.get(content_key)
+        if body is None:
+            body = cls(charging_schedule)
+            cls._interned[content_key] = body
+        return body
+    
+    def period_index_at(self, elapsed_seconds: float) -> int:
+        """Index of the period active after elapsed_seconds, or -1 before the first period"""
+        return bisect_right(self.start_periods, elapsed_seconds) - 1
+
+
 class ChargingProfile:
     """Represents an OCPP 1.6 Charging Profile"""
     
@@ -21,13 +62,59 @@ class ChargingProfile:
         self.valid_from = profile_data.get("validFrom")
         self.valid_to = profile_data.get("validTo")
         
-        # Charging Schedule
-        charging_schedule = profile_data.get("chargingSchedule", {})
-        self.duration = charging_schedule.get("duration")
-        self.start_schedule = charging_schedule.get("startSchedule")
-        self.charging_rate_unit = charging_schedule.get("chargingRateUnit", "A")
-        self.charging_schedule_periods = charging_schedule.get("chargingSchedulePeriod", [])
-        self.min_charging_rate = charging_schedule.get("minChargingRate")
+        # Charging Schedule (shared across identical profiles; only the metadata above is per charger)
+        self.schedule = ChargingScheduleBody.intern(profile_data.get("chargingSchedule", {}))
+    
+    @property
+    def duration(self) -> Optional[int]:
+        return self.schedule.duration
+    
+    @property
+    def start_schedule(self) -> Optional[str]:
+        return self.schedule.start_schedule
+    
+    @property
+    def charging_rate_unit(self) -> str:
+        return self.schedule.charging_rate_unit
+    
+    @property
+    def charging_schedule_periods(self) -> Tuple[Dict[str, Any], ...]:
+        return self.schedule.periods
+    
+    @property
+    def min_charging_rate(self) -> Optional[float]:
+        return self.schedule.min_charging_rate
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the OCPP csChargingProfiles structure"""
+        charging_schedule = {
+            "chargingRateUnit": self.charging_rate_unit,
+            "chargingSchedulePeriod": list(self.charging_schedule_periods)
+        }
+        if self.duration is not None:
+            charging_schedule["duration"] = self.duration
+        if self.start_schedule is not None:
+            charging_schedule["startSchedule"] = self.start_schedule
+        if self.min_charging_rate is not None:
+            charging_schedule["minChargingRate"] = self.min_charging_rate
+        
+        profile_data = {
+            "chargingProfileId": self.charging_profile_id,
+            "stackLevel": self.stack_level,
+            "chargingProfilePurpose": self.charging_profile_purpose,
+            "chargingProfileKind": self.charging_profile_kind,
+            "chargingSchedule": charging_schedule
+        }
+        optional_fields = {
+            "transactionId": self.transaction_id,
+            "recurrencyKind": self.recurrency_kind,
+            "validFrom": self.valid_from,
+            "validTo": self.valid_to
+        }
+        for field, value in optional_fields.items():
+            if value is not None:
+                profile_data[field] = value
+        return profile_data
 
 
 class ChargingProfilesManager:
@@ -42,6 +129,30 @@ class ChargingProfilesManager:
         for i in range(self.simulator.number_of_connectors + 1):
             self.charging_profiles[i] = []
             self.current_limits[i] = {"power": None, "current": None}
+        
+        # Bumped whenever installed profiles or transactions change; part of the composite cache key
+        self.profile_store_version = 0
+        self.composite_cache: Dict[tuple, Dict[str, Any]] = {}
+        self.composite_cache_bucket_seconds = 1.0
+        self.composite_cache_max_entries = 256
+        
+        # Profile limits, kept current by a configuration subscription
+        config_manager = self.simulator.config_manager
+        self.max_stack_level = config_manager.get_int_value("ChargeProfileMaxStackLevel", 10)
+        self.max_schedule_periods = config_manager.get_int_value("ChargingScheduleMaxPeriods", 6)
+        config_manager.subscribe(("ChargeProfileMaxStackLevel", "ChargingScheduleMaxPeriods"), self._on_profile_limits_changed)
+    
+    def _on_profile_limits_changed(self, key: str, value: Any):
+        """Pick up a changed ChargeProfileMaxStackLevel or ChargingScheduleMaxPeriods"""
+        if key == "ChargeProfileMaxStackLevel":
+            self.max_stack_level = value if value is not None else 10
+        else:
+            self.max_schedule_periods = value if value is not None else 6
+    
+    def invalidate_composite_cache(self):
+        """Invalidate cached composite schedules after a profile or transaction change"""
+        self.profile_store_version += 1
+        self.composite_cache.clear()
     
     def handle_set_charging_profile(self, connector_id: int, cs_charging_profiles: Dict[str, Any]) -> str:
         """
@@ -64,8 +175,7 @@ class ChargingProfilesManager:
                 return "Rejected"
             
             # Check if we support the charging rate unit
-            allowed_units = self.simulator.config_manager.get_value("ChargingScheduleAllowedChargingRateUnit", "Current,Power")
-            allowed_units_list = [u.strip() for u in allowed_units.split(",")]
+            allowed_units_list = self.simulator.config_manager.get_list_value("ChargingScheduleAllowedChargingRateUnit", ("Current", "Power"))
             
             if profile.charging_rate_unit == "W" and "Power" not in allowed_units_list:
                 self.simulator.log("Power-based charging profiles not supported", "WARNING")
@@ -90,6 +200,7 @@ class ChargingProfilesManager:
             self.charging_profiles[connector_id].sort(key=lambda p: p.stack_level, reverse=True)
             
             # Update current limits based on active profiles
+            self.invalidate_composite_cache()
             self._update_current_limits(connector_id)
             
             self.simulator.log(f"Charging profile {profile.charging_profile_id} set for connector {connector_id}", "INFO")
@@ -156,19 +267,56 @@ class ChargingProfilesManager:
             
             # Update limits if profiles were removed
             if profiles_to_remove:
+                self.invalidate_composite_cache()
                 self._update_current_limits(conn_id)
         
         return "Accepted" if profiles_cleared else "Unknown"
     
+    def purge_transaction_profiles(self, connector_id: int, transaction_id: int):
+        """Remove TxProfiles belonging to a transaction that has ended"""
+        for conn_id in (connector_id, 0):
+            if conn_id not in self.charging_profiles:
+                continue
+            
+            profiles_to_remove = [
+                profile for profile in self.charging_profiles[conn_id]
+                if profile.charging_profile_purpose == "TxProfile" and
+                (profile.transaction_id == transaction_id or
+                 (profile.transaction_id is None and conn_id == connector_id))
+            ]
+            
+            for profile in profiles_to_remove:
+                self.charging_profiles[conn_id].remove(profile)
+                self.simulator.log(f"Removed TxProfile {profile.charging_profile_id} after transaction {transaction_id} ended", "INFO")
+            
+            if profiles_to_remove:
+                self.invalidate_composite_cache()
+                self._update_current_limits(conn_id)
+    
     def handle_get_composite_schedule(self, connector_id: int, duration: int, 
                                     charging_rate_unit: Optional[str] = None) -> Dict[str, Any]:
         """
         Handle GetCompositeSchedule request
-        Returns composite schedule for the connector
+        Returns composite schedule for the connector. Results are cached per
+        (connector, duration, unit, profile store version, time bucket); the
+        returned dict is shared and must not be modified.
         """
         if connector_id < 0 or connector_id > self.simulator.number_of_connectors:
             return {"status": "Rejected"}
         
+        time_bucket = int(time.time() // self.composite_cache_bucket_seconds)
+        cache_key = (connector_id, duration, charging_rate_unit, self.profile_store_version, time_bucket)
+        response = self.composite_cache.get(cache_key)
+        if response is None:
+            if len(self.composite_cache) >= self.composite_cache_max_entries:
+                self.composite_cache.clear()
+            response = self._build_composite_schedule_response(connector_id, duration, charging_rate_unit)
+            self.composite_cache[cache_key] = response
+        return response
+    
+    def _build_composite_schedule_response(self, connector_id: int, duration: int,
+                                           charging_rate_unit: Optional[str]) -> Dict[str, Any]:
+        """Build a GetCompositeSchedule response from the active profiles"""
         # Get active profiles for connector
         active_profiles = self._get_active_profiles(connector_id)
         
@@ -200,15 +348,23 @@ class ChargingProfilesManager:
         
         return self.current_limits[connector_id].copy()
     
+    def get_profiles_snapshot(self) -> Dict[int, List[Dict[str, Any]]]:
+        """Get installed profiles per connector in OCPP form, for persistence"""
+        return {
+            connector_id: [profile.to_dict() for profile in profiles]
+            for connector_id, profiles in self.charging_profiles.items()
+            if profiles
+        }
+    
     def _validate_charging_profile(self, profile: ChargingProfile, connector_id: int) -> str:
         """Validate a charging profile"""
         # Check stack level
-        max_stack_level = self.simulator.config_manager.get_int_value("ChargeProfileMaxStackLevel", 10)
+        max_stack_level = self.max_stack_level
         if profile.stack_level > max_stack_level:
             return f"Stack level {profile.stack_level} exceeds maximum {max_stack_level}"
         
         # Check number of periods
-        max_periods = self.simulator.config_manager.get_int_value("ChargingScheduleMaxPeriods", 6)
+        max_periods = self.max_schedule_periods
         if len(profile.charging_schedule_periods) > max_periods:
             return f"Number of periods {len(profile.charging_schedule_periods)} exceeds maximum {max_periods}"
         
@@ -304,12 +460,18 @@ class ChargingProfilesManager:
                                  f"Current={self.current_limits[connector_id]['current']}A", "INFO")
                 break
     
-    def _get_active_profiles(self, connector_id: int) -> List[ChargingProfile]:
+    def _get_active_profiles(self, connector_id: int, current_time: Optional[datetime] = None) -> List[ChargingProfile]:
         """Get active profiles for a connector"""
-        current_time = datetime.utcnow().replace(tzinfo=None)  # Ensure naive datetime
+        if current_time is None:
+            current_time = datetime.utcnow().replace(tzinfo=None)  # Ensure naive datetime
         active_profiles = []
         
         for profile in self.charging_profiles[connector_id]:
+            # Skip TxProfiles whose transaction is no longer running
+            if (profile.charging_profile_purpose == "TxProfile" and profile.transaction_id and
+                    profile.transaction_id not in self.simulator.transaction_connectors):
+                continue
+            
             # Check validity period
             if profile.valid_from:
                 try:
@@ -372,14 +534,8 @@ class ChargingProfilesManager:
                 elapsed_seconds = elapsed_seconds % 604800  # 7 days
         
         # Find applicable period
-        applicable_period = None
-        for period in profile.charging_schedule_periods:
-            if elapsed_seconds >= period.get("startPeriod", 0):
-                applicable_period = period
-            else:
-                break
-        
-        return applicable_period
+        period_index = profile.schedule.period_index_at(elapsed_seconds)
+        return profile.charging_schedule_periods[period_index] if period_index >= 0 else None
     
     def _generate_composite_schedule(self, profiles: List[ChargingProfile], 
                                    duration: int, charging_rate_unit: Optional[str]) -> Optional[Dict[str, Any]]:
@@ -398,5 +554,5 @@ class ChargingProfilesManager:
         return {
             "duration": min(duration, highest_profile.duration) if highest_profile.duration else duration,
             "chargingRateUnit": charging_rate_unit,
-            "chargingSchedulePeriod": highest_profile.charging_schedule_periods
+            "chargingSchedulePeriod": list(highest_profile.charging_schedule_periods)
         }
\ No newline at end of file
@@ -0,0 +1,80 @@
+# clock.py
+"""Shared wall clock for OCPP timestamps
+
+Every charger in the process takes its timestamps from the one `clock`. The
+ISO-8601 string is formatted once per resolution tick (1 s by default) and
+reused by every payload built within that tick. The clock follows the Central
+System's time: the offset is measured from the currentTime field of
+BootNotification and Heartbeat responses, and only applied when it moved by
+more than half a tick, so measurement jitter neither discards the cached
+string nor makes timestamps step back and forth.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+
+class Clock:
+    """UTC time shifted by the measured server offset, with cached timestamp strings"""
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+        self.server_offset = 0.0  # Seconds to add to local time to get Central System time
+        self._cached: Tuple[Optional[int], str] = (None, "")  # (tick, timestamp string)
+
+    def set_resolution(self, resolution: float):
+        """Set the timestamp resolution in seconds (e.g. 1.0 or 0.1)"""
+        if resolution <= 0:
+            raise ValueError("Timestamp resolution must be greater than 0")
+        self.resolution = resolution
+        self._cached = (None, "")
+
+    def set_server_offset(self, seconds: float):
+        self.server_offset = seconds
+        self._cached = (None, "")
+
+    def time(self) -> float:
+        """Central System time as a POSIX timestamp"""
+        return time.time() + self.server_offset
+
+    def now(self) -> datetime:
+        """Central System time as an aware UTC datetime"""
+        return datetime.fromtimestamp(self.time(), tz=timezone.utc)
+
+    def timestamp(self) -> str:
+        """Current time as an OCPP timestamp string, e.g. 2024-01-01T12:00:00Z"""
+        tick = int(self.time() / self.resolution)
+        cached_tick, cached_timestamp = self._cached
+        if tick != cached_tick:
+            moment = datetime.fromtimestamp(round(tick * self.resolution, 6), tz=timezone.utc)
+            if self.resolution >= 1:
+                timestamp = moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+            else:
+                timestamp = moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+            # One assignment, so another thread never sees a tick with another tick's string
+            self._cached = (tick, timestamp)
+            return timestamp
+        return cached_timestamp
+
+    def observe_server_time(self, current_time: Optional[str], sent_at: float, received_at: float) -> Optional[float]:
+        """Update the offset from a response's currentTime, given the local time.time() when the
+        request was sent and the response received. Returns the offset in use, None if unparseable"""
+        if not current_time:
+            return None
+        try:
+            server_time = datetime.fromisoformat(current_time.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if server_time.tzinfo is None:
+            server_time = server_time.replace(tzinfo=timezone.utc)
+
+        # Assume the server read its clock halfway through the round trip
+        offset = server_time.timestamp() - (sent_at + received_at) / 2
+        if abs(offset - self.server_offset) > self.resolution / 2:
+            self.set_server_offset(offset)
+        return self.server_offset
+
+
+# Process-wide clock used by the simulators
+clock = Clock()
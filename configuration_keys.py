@@ -1,16 +1,118 @@
 # configuration_keys.py
 """OCPP 1.6 Configuration Keys Management"""
 
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple, Callable, Iterable, Mapping
+from collections import ChainMap
+from types import MappingProxyType
+from ocpp_enums import Measurand
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Subscribing with this key receives changes of every key
+ALL_KEYS = "*"
+
+# Value types of the standard keys; anything not listed is kept as a plain string
+INT_KEYS = {
+    "BlinkRepeat", "ClockAlignedDataInterval", "ConnectionTimeOut", "GetConfigurationMaxKeys",
+    "HeartbeatInterval", "LightIntensity", "MaxEnergyOnInvalidId", "MeterValueSampleInterval",
+    "MinimumStatusDuration", "NumberOfConnectors", "ResetRetries", "TransactionMessageAttempts",
+    "TransactionMessageRetryInterval", "WebSocketPingInterval", "LocalAuthListMaxLength",
+    "SendLocalListMaxLength", "ChargeProfileMaxStackLevel", "ChargingScheduleMaxPeriods",
+    "MaxChargingProfilesInstalled", "MaxChargingPower",
+}
+BOOL_KEYS = {
+    "AllowOfflineTxForUnknownId", "AuthorizationCacheEnabled", "AuthorizeRemoteTxRequests",
+    "LocalAuthorizeOffline", "LocalPreAuthorize", "StopTransactionOnEVSideDisconnect",
+    "StopTransactionOnInvalidId", "UnlockConnectorOnEVSideDisconnect", "LocalAuthListEnabled",
+    "ReserveConnectorZeroSupported", "ConnectorSwitch3to1PhaseSupported",
+}
+CSV_KEYS = {"ConnectorPhaseRotation", "SupportedFeatureProfiles", "ChargingScheduleAllowedChargingRateUnit"}
+MEASURAND_KEYS = {"MeterValuesAlignedData", "MeterValuesSampledData", "StopTxnAlignedData", "StopTxnSampledData"}
+
+MEASURANDS = frozenset(measurand.value for measurand in Measurand)
+
+# Encoded full GetConfiguration payloads, shared by chargers with identical configuration
+_encoded_configurations: Dict[tuple, str] = {}
+_ENCODED_CONFIGURATIONS_MAX = 1024
+
+# Read-only default key tables, shared by every manager built with the same parameters
+_default_tables: Dict[tuple, Mapping[str, "ConfigurationKey"]] = {}
+
+
+def default_value_type(key: str) -> str:
+    """Value type of a configuration key: int, bool, csv, measurands or string"""
+    if key in INT_KEYS:
+        return "int"
+    if key in BOOL_KEYS:
+        return "bool"
+    if key in CSV_KEYS:
+        return "csv"
+    if key in MEASURAND_KEYS:
+        return "measurands"
+    return "string"
+
+
+def parse_value(value_type: str, value: str) -> Any:
+    """Parse and validate the OCPP string form of a value. Raises ValueError if invalid"""
+    if value_type == "int":
+        parsed = int(value)
+        if parsed < 0:
+            raise ValueError(f"negative value {parsed}")
+        return parsed
+    if value_type == "bool":
+        lowered = value.strip().lower()
+        if lowered not in ("true", "false"):
+            raise ValueError(f"not a boolean: {value}")
+        return lowered == "true"
+    if value_type in ("csv", "measurands"):
+        items: Tuple[str, ...] = tuple(dict.fromkeys(item.strip() for item in value.split(",") if item.strip()))
+        if value_type == "measurands":
+            unknown = [item for item in items if item not in MEASURANDS]
+            if unknown:
+                raise ValueError(f"unknown measurands: {', '.join(unknown)}")
+        return items
+    return value
+
+
+async def wait_for_change(wakeup: asyncio.Event, timeout: Optional[float]) -> bool:
+    """Sleep up to timeout seconds (forever if None), or until a subscriber sets wakeup.
+    Returns True if woken by a change"""
+    try:
+        await asyncio.wait_for(wakeup.wait(), None if timeout is None else max(timeout, 0))
+    except asyncio.TimeoutError:
+        return False
+    wakeup.clear()
+    return True
 
 
 class ConfigurationKey:
-    """Class to represent an OCPP configuration key"""
-    def __init__(self, key: str, readonly: bool, value: str, reboot_required: bool = False):
+    """Class to represent an OCPP configuration key
+    
+    `value` is the OCPP string form reported by GetConfiguration; `parsed` holds
+    the typed value (None if the string could not be parsed)."""
+    __slots__ = ("key", "readonly", "reboot_required", "value_type", "value", "parsed")
+    
+    def __init__(self, key: str, readonly: bool, value: str, reboot_required: bool = False,
+                 value_type: Optional[str] = None):
         self.key = key
         self.readonly = readonly
-        self.value = value
         self.reboot_required = reboot_required
+        self.value_type = value_type or default_value_type(key)
+        self.value = value
+        try:
+            self.parsed = parse_value(self.value_type, value)
+        except ValueError:
+            self.parsed = None
+    
+    def copy(self) -> "ConfigurationKey":
+        """Copy of this key that can be changed without affecting the original"""
+        copied = ConfigurationKey.__new__(ConfigurationKey)
+        for attribute in self.__slots__:
+            setattr(copied, attribute, getattr(self, attribute))
+        return copied
 
 
 class ConfigurationManager:
@@ -20,7 +122,27 @@ class ConfigurationManager:
         self.heartbeat_interval = heartbeat_interval
         self.number_of_connectors = number_of_connectors
         self.max_power = max_power
-        self.configuration_keys: Dict[str, ConfigurationKey] = self._initialize_default_config_keys()
+        
+        # Keys changed or customised on this charger, layered over the shared defaults.
+        # Default ConfigurationKey objects are never modified; they are copied into
+        # overrides first (see update_configuration_key).
+        self.overrides: Dict[str, ConfigurationKey] = {}
+        self.configuration_keys: Mapping[str, ConfigurationKey] = ChainMap(self.overrides, self._shared_default_config_keys())
+        
+        # Change observers: key (or ALL_KEYS) -> callbacks taking (key, parsed value)
+        self.subscribers: Dict[str, List[Callable[[str, Any], None]]] = {}
+        
+        # Pre-encoded full GetConfiguration payload, dropped whenever a key changes
+        self.full_configuration_json: Optional[str] = None
+    
+    def _shared_default_config_keys(self) -> Mapping[str, ConfigurationKey]:
+        """Get the read-only default key table for this charger's parameters"""
+        table_key = (self.heartbeat_interval, self.number_of_connectors, self.max_power)
+        table = _default_tables.get(table_key)
+        if table is None:
+            table = MappingProxyType(self._initialize_default_config_keys())
+            _default_tables[table_key] = table
+        return table
     
     def _initialize_default_config_keys(self) -> Dict[str, ConfigurationKey]:
         """Initialize default OCPP 1.6 configuration keys"""
@@ -53,7 +175,7 @@ class ConfigurationManager:
             "TransactionMessageAttempts": ConfigurationKey("TransactionMessageAttempts", False, "3"),
             "TransactionMessageRetryInterval": ConfigurationKey("TransactionMessageRetryInterval", False, "10"),
             "UnlockConnectorOnEVSideDisconnect": ConfigurationKey("UnlockConnectorOnEVSideDisconnect", False, "true"),
-            "WebSocketPingInterval": ConfigurationKey("WebSocketPingInterval", False, "0"),
+            "WebSocketPingInterval": ConfigurationKey("WebSocketPingInterval", False, "20"),
             
             # Local Auth List Management Profile
             "LocalAuthListEnabled": ConfigurationKey("LocalAuthListEnabled", False, "false"),
@@ -81,12 +203,16 @@ class ConfigurationManager:
         for key_data in custom_keys:
             key_name = key_data.get('key')
             if key_name:
-                self.configuration_keys[key_name] = ConfigurationKey(
+                # Attributes not given keep those of the key being overridden
+                existing = self.configuration_keys.get(key_name)
+                self.overrides[key_name] = ConfigurationKey(
                     key_name,
-                    key_data.get('readonly', False),
-                    key_data.get('value', ''),
-                    key_data.get('reboot_required', False)
+                    key_data.get('readonly', existing.readonly if existing else False),
+                    str(key_data.get('value', '')),
+                    key_data.get('reboot_required', existing.reboot_required if existing else False),
+                    key_data.get('type', existing.value_type if existing else None)
                 )
+                self._notify(key_name)
     
     def get_configuration_keys_list(self) -> List[Dict[str, Any]]:
         """Get list of configuration keys for display"""
@@ -110,18 +236,24 @@ class ConfigurationManager:
         if config_key.readonly:
             return "Rejected"
         
-        # Validate specific keys
+        # Validate against the key's type (e.g. HeartbeatInterval must be a non-negative int)
+        try:
+            parsed = parse_value(config_key.value_type, value)
+        except ValueError:
+            return "Rejected"
+        
         if key == "HeartbeatInterval":
-            try:
-                new_interval = int(value)
-                if new_interval < 0:
-                    return "Rejected"
-                self.heartbeat_interval = new_interval
-            except ValueError:
-                return "Rejected"
+            self.heartbeat_interval = parsed
+        
+        # Copy shared defaults before the first change
+        if key not in self.overrides:
+            config_key = config_key.copy()
+            self.overrides[key] = config_key
         
         # Update the value
         config_key.value = value
+        config_key.parsed = parsed
+        self._notify(key)
         
         # Return appropriate status
         if config_key.reboot_required:
@@ -129,15 +261,102 @@ class ConfigurationManager:
         else:
             return "Accepted"
     
+    def subscribe(self, keys: Iterable[str], callback: Callable[[str, Any], None]):
+        """Call callback(key, parsed_value) whenever one of the keys changes. ALL_KEYS matches every key"""
+        for key in keys:
+            callbacks = self.subscribers.setdefault(key, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+    
+    def unsubscribe(self, keys: Iterable[str], callback: Callable[[str, Any], None]):
+        """Stop calling callback for the given keys"""
+        for key in keys:
+            callbacks = self.subscribers.get(key)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.subscribers[key]
+    
+    def _notify(self, key: str):
+        """Drop cached responses and tell subscribers about a changed key"""
+        self.full_configuration_json = None
+        
+        callbacks = self.subscribers.get(key, []) + self.subscribers.get(ALL_KEYS, [])
+        if not callbacks:
+            return
+        
+        parsed = self.configuration_keys[key].parsed
+        for callback in callbacks:
+            try:
+                callback(key, parsed)
+            except Exception:
+                logger.exception(f"Configuration subscriber failed for {key}")
+    
+    def get_full_configuration_json(self) -> str:
+        """Get the GetConfiguration payload for all keys, JSON encoded"""
+        if self.full_configuration_json is None:
+            signature = tuple(
+                (config_key.key, config_key.readonly, config_key.value)
+                for config_key in self.configuration_keys.values()
+            )
+            encoded = _encoded_configurations.get(signature)
+            if encoded is None:
+                encoded = json.dumps({
+                    "configurationKey": [
+                        {"key": key, "readonly": readonly, "value": value}
+                        for key, readonly, value in signature
+                    ]
+                })
+                if len(_encoded_configurations) >= _ENCODED_CONFIGURATIONS_MAX:
+                    _encoded_configurations.clear()
+                _encoded_configurations[signature] = encoded
+            self.full_configuration_json = encoded
+        return self.full_configuration_json
+    
+    def get_default_value(self, key: str) -> Optional[str]:
+        """Get the default value of a standard key (None for custom keys)"""
+        default_key = self.configuration_keys.maps[-1].get(key)
+        return default_key.value if default_key else None
+    
     def get_value(self, key: str, default: str = "") -> str:
         """Get configuration key value"""
         if key in self.configuration_keys:
             return self.configuration_keys[key].value
         return default
     
+    def get_parsed_value(self, key: str, default: Any = None) -> Any:
+        """Get the typed value of a configuration key"""
+        config_key = self.configuration_keys.get(key)
+        if config_key is None or config_key.parsed is None:
+            return default
+        return config_key.parsed
+    
     def get_int_value(self, key: str, default: int = 0) -> int:
         """Get configuration key value as integer"""
+        config_key = self.configuration_keys.get(key)
+        if config_key is None:
+            return default
+        if config_key.value_type == "int":
+            return default if config_key.parsed is None else config_key.parsed
         try:
-            return int(self.get_value(key, str(default)))
+            return int(config_key.value)
         except ValueError:
             return default
+    
+    def get_bool_value(self, key: str, default: bool = False) -> bool:
+        """Get configuration key value as boolean"""
+        config_key = self.configuration_keys.get(key)
+        if config_key is None:
+            return default
+        if config_key.value_type == "bool":
+            return default if config_key.parsed is None else config_key.parsed
+        return config_key.value.strip().lower() == "true"
+    
+    def get_list_value(self, key: str, default: Tuple[str, ...] = ()) -> Tuple[str, ...]:
+        """Get a comma separated configuration key value (CSV or measurand list) as a tuple"""
+        config_key = self.configuration_keys.get(key)
+        if config_key is None:
+            return default
+        if config_key.value_type in ("csv", "measurands"):
+            return default if config_key.parsed is None else config_key.parsed
+        return tuple(item.strip() for item in config_key.value.split(",") if item.strip())
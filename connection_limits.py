@@ -0,0 +1,127 @@
+# connection_limits.py
+"""Per-connection websocket buffer limits and file descriptor budgeting for large fleets
+
+Charger config fields (all optional, library defaults apply when unset):
+    websocket_max_size     Largest incoming frame in bytes
+    websocket_max_queue    Incoming frames buffered before reading pauses
+    websocket_write_limit  Write buffer high-water mark in bytes
+    websocket_read_limit   Read buffer high-water mark in bytes (legacy websockets implementation)
+"""
+
+import inspect
+import logging
+import os
+from typing import Dict, Any, Iterable, Optional
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Charger config field -> websockets.connect argument
+CONNECTION_LIMIT_FIELDS = {
+    "websocket_max_size": "max_size",
+    "websocket_max_queue": "max_queue",
+    "websocket_write_limit": "write_limit",
+    "websocket_read_limit": "read_limit",
+}
+
+# websockets defaults, used to estimate memory when a limit is not set
+LIBRARY_DEFAULTS = {
+    "max_size": 2 ** 20,
+    "max_queue": 32,
+    "write_limit": 2 ** 16,
+    "read_limit": 2 ** 16,
+}
+
+# Descriptors the process needs besides one socket per charger (stdio, state store, log files, ...)
+RESERVED_FILE_DESCRIPTORS = 64
+
+
+def supported_connect_arguments(connect) -> Optional[set]:
+    """Keyword arguments a websockets.connect implementation accepts, or None if unknown"""
+    try:
+        return set(inspect.signature(connect).parameters)
+    except (TypeError, ValueError):
+        return None
+
+
+def connection_limits(config: Dict[str, Any], supported: Optional[set] = None) -> Dict[str, int]:
+    """websockets.connect arguments for the limits set in a charger config.
+    Limits the installed websockets version does not support are left out"""
+    limits = {}
+    for field, argument in CONNECTION_LIMIT_FIELDS.items():
+        value = config.get(field)
+        if value is None:
+            continue
+        if supported is not None and argument not in supported:
+            logger.debug(f"{field} is not supported by this websockets version, ignored")
+            continue
+        limits[argument] = int(value)
+    return limits
+
+
+def connection_memory_bound(config: Dict[str, Any]) -> int:
+    """Worst-case buffer memory of one connection in bytes: a full incoming queue of
+    maximum-size frames plus the read and write buffers"""
+    limits = {**LIBRARY_DEFAULTS, **connection_limits(config)}
+    return limits["max_size"] * limits["max_queue"] + limits["read_limit"] + limits["write_limit"]
+
+
+def ensure_file_descriptors(connections: int) -> bool:
+    """Make sure the process may open a socket per connection, raising the soft limit up to
+    the hard limit if needed. Returns False if the limit is still too low"""
+    if not RESOURCE_AVAILABLE:
+        return True
+
+    needed = connections + RESERVED_FILE_DESCRIPTORS
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return True
+
+    new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        logger.info(f"Raised RLIMIT_NOFILE from {soft} to {new_soft}")
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not raise RLIMIT_NOFILE from {soft}: {e}")
+        new_soft = soft
+
+    if new_soft < needed:
+        logger.error(f"RLIMIT_NOFILE is {new_soft} but {connections} connections need about {needed} "
+                     f"file descriptors; chargers beyond the limit will fail with EMFILE "
+                     f"(raise it with ulimit -n or in /etc/security/limits.conf)")
+        return False
+    return True
+
+
+def preflight(configs: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Check file descriptors and estimate buffer memory for a planned fleet"""
+    chargers = 0
+    memory_bound = 0
+    for config in configs:
+        chargers += 1
+        memory_bound += connection_memory_bound(config)
+
+    file_descriptors_ok = ensure_file_descriptors(chargers)
+    per_connection = memory_bound // chargers if chargers else 0
+    logger.info(f"Fleet preflight: {chargers} chargers, worst-case websocket buffers "
+                f"{per_connection / 1024:,.0f} KiB per connection, {memory_bound / 1024 / 1024:,.1f} MiB in total")
+    return {
+        "chargers": chargers,
+        "file_descriptors_ok": file_descriptors_ok,
+        "memory_bound": memory_bound,
+        "memory_bound_per_connection": per_connection,
+    }
+
+
+def resident_memory() -> Optional[int]:
+    """Current resident set size of this process in bytes, None where it cannot be read"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
@@ -2,21 +2,32 @@
 """OCPP 1.6 EV Charger Simulator Core"""
 
 import asyncio
+import inspect
 import json
 import base64
 import logging
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set
 import websockets
 import urllib.parse
 import ssl
 import platform
+import time
+import zlib
 
 from ocpp_enums import MessageType, OCPPAction, ChargerStatus
-from configuration_keys import ConfigurationManager
+from configuration_keys import ConfigurationManager, wait_for_change
 from meter_values import MeterValuesHandler
 from message_handlers import MessageHandlers
 from charging_profiles import ChargingProfilesManager
+from state_store import get_state_store
+from metrics import registry, log_linear_buckets, LATENCY_BUCKETS, CHARGER_LABEL
+from outbound_queue import OutboundQueue, call_priority, PRIORITY_RESPONSE
+from call_pipeline import CallPipeline, CALL_QUEUE_DELAY_SECONDS, CALL_RESPONSE_SECONDS
+from offline_queue import OfflineMessageQueue
+from connection_limits import connection_limits, supported_connect_arguments
+from clock import clock
+import wire_trace
 
 # Set up logging
 logging.basicConfig(
@@ -25,6 +36,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# SSL contexts shared by every simulator with the same CA file and TLS settings
+_ssl_contexts: Dict[tuple, ssl.SSLContext] = {}
+
+
+def _detect_header_argument() -> Optional[str]:
+    """Keyword websockets.connect takes extra HTTP headers in: additional_headers (websockets 14+),
+    extra_headers (legacy implementation) or None if neither is supported"""
+    try:
+        parameters = inspect.signature(websockets.connect).parameters
+    except (TypeError, ValueError):
+        return None
+    for name in ("additional_headers", "extra_headers"):
+        if name in parameters:
+            return name
+    return None
+
+
+# Detected once at import instead of probing with TypeError on every connection
+WEBSOCKETS_HEADER_ARGUMENT = _detect_header_argument()
+WEBSOCKETS_CONNECT_ARGUMENTS = supported_connect_arguments(websockets.connect)
+
+# Connection method that last succeeded, by Central System URL
+_winning_connection_methods: Dict[str, str] = {}
+
+# What to try when a central system's remembered method fails:
+#   "none"  - only the remembered method (the default)
+#   "reset" - only the remembered method, then forget it so the next attempt tries all methods
+#   "all"   - the remembered method first, then the other methods
+CONNECTION_FALLBACK_POLICIES = ("none", "reset", "all")
+
+CONNECT_ATTEMPTS = registry.counter(
+    "ocpp_connect_attempts_total", "Connection attempts, by method and result")
+CONNECT_HANDSHAKE_SECONDS = registry.histogram(
+    "ocpp_connect_handshake_seconds", "TCP, TLS and WebSocket handshake time of successful connections")
+TLS_HANDSHAKES = registry.counter(
+    "ocpp_tls_handshakes_total", "TLS handshakes, by whether the session was resumed")
+PING_RTT_SECONDS = registry.histogram(
+    "ocpp_websocket_ping_rtt_seconds", "WebSocket ping to pong round-trip time")
+PING_TIMEOUTS = registry.counter(
+    "ocpp_websocket_ping_timeouts_total", "WebSocket pings without a pong in time")
+HEARTBEATS_SUPPRESSED = registry.counter(
+    "ocpp_heartbeats_suppressed_total", "Heartbeats skipped because other messages went out within the interval")
+CALL_TIMEOUTS = registry.counter(
+    "ocpp_call_timeouts_total", "CALLs without a response within the timeout, by action")
+CALL_ERRORS = registry.counter(
+    "ocpp_call_errors_total", "CALLERROR responses to our CALLs, by action and error code")
+MESSAGE_BYTES = registry.counter(
+    "ocpp_message_bytes_total", "OCPP-J frame bytes, by action and direction (in/out)")
+INBOUND_CALLS = registry.counter(
+    "ocpp_inbound_calls_total", "CALLs received from the Central System, by action and result")
+INBOUND_CALL_SECONDS = registry.histogram(
+    "ocpp_inbound_call_seconds", "Time to handle a CALL from the Central System, by action", LATENCY_BUCKETS)
+CONNECTION_LOSSES = registry.counter(
+    "ocpp_connection_losses_total", "Established connections lost, by reason")
+RECONNECT_SECONDS = registry.histogram(
+    "ocpp_reconnect_seconds", "Time from losing a connection until connected again", log_linear_buckets(0.1, 3600))
+
+
+def _charger_phase(charge_point_id: str) -> float:
+    """Deterministic per-charger fraction in [0, 1) used to spread periodic messages over their interval"""
+    return zlib.crc32(charge_point_id.encode()) / 2 ** 32
+
+
+def _seconds_until_slot(now: float, interval: float, phase: float) -> float:
+    """Seconds from now until the next multiple of interval shifted by phase * interval"""
+    return interval - ((now - phase * interval) % interval)
+
 
 class EVChargerSimulator:
     def __init__(self, config: Dict[str, Any] = None, gui_callback=None):
@@ -43,6 +121,9 @@ class EVChargerSimulator:
         self.use_tls = config.get('use_tls', False)
         self.ca_cert_path = config.get('ca_cert_path', None)
         
+        # Frame size cap, queue depth and buffer high-water marks (see connection_limits.py)
+        self.connection_limits = connection_limits(config, WEBSOCKETS_CONNECT_ARGUMENTS)
+        
         # Charger properties
         self.charge_point_vendor = config.get('charge_point_vendor', 'SimulatorVendor')
         self.charge_point_model = config.get('charge_point_model', 'SimulatorModel')
@@ -58,9 +139,30 @@ class EVChargerSimulator:
         self.max_power = config.get('max_power', 11000)  # Default 11kW
         self.max_current = config.get('max_current', 48)  # Default 48A
         
+        # Optional EV model (fleet specs): max_power, initial_soc, name
+        self.ev_model = config.get('ev_model')
+        
         self.websocket = None
+        self.outbound_queue: Optional[OutboundQueue] = None  # Single writer for self.websocket
         self.message_id = 0
         self.pending_requests: Dict[str, asyncio.Future] = {}
+        self.pending_actions: Dict[str, str] = {}  # Our CALLs awaiting a response: message ID -> action
+        self.inbound_actions: Dict[str, str] = {}  # CALLs being handled: message ID -> action
+        
+        # Metrics are aggregated over the fleet; per-charger labels are opt-in (high cardinality)
+        self.metrics_per_charger = config.get('metrics_per_charger', registry.per_charger_labels)
+        self.disconnected_at: Optional[float] = None
+        
+        # OCPP-J allows one outstanding CALL; max_outstanding_calls > 1 (or 0 = unlimited) relaxes this for stress tests
+        self.call_pipeline = CallPipeline(config.get('max_outstanding_calls', 1))
+        
+        # Incoming CALLs run in their own tasks so the reader keeps resolving responses;
+        # at most max_concurrent_handlers run at once per connection, up to max_queued_handlers
+        # more wait for a slot and CALLs beyond that are rejected with a CALLERROR
+        self.max_concurrent_handlers = config.get('max_concurrent_handlers', 8)
+        self.max_queued_handlers = config.get('max_queued_handlers', 32)
+        self.handler_slots: Optional[asyncio.Semaphore] = None
+        self.handler_tasks: Set[asyncio.Task] = set()
         self.is_connected = False
         self.boot_notification_accepted = False
         
@@ -68,18 +170,46 @@ class EVChargerSimulator:
         self.connector_transactions: Dict[int, Optional[int]] = {}
         self.connector_status: Dict[int, ChargerStatus] = {}
         
+        # Reverse index: transaction ID -> connector ID (kept in sync by _set_connector_transaction)
+        self.transaction_connectors: Dict[int, int] = {}
+        
         # Initialize connectors
         for i in range(1, self.number_of_connectors + 1):
             self.connector_status[i] = ChargerStatus.AVAILABLE
             self.connector_transactions[i] = None
         
         self.max_reconnect_attempts = 5
+        self.connection_fallback = config.get('connection_fallback', 'none')
+        if self.connection_fallback not in CONNECTION_FALLBACK_POLICIES:
+            self.log(f"Unknown connection_fallback '{self.connection_fallback}', using 'none'", "WARNING")
+            self.connection_fallback = 'none'
         self.reconnect_attempts = 0
         
         # Initialize components
         self.log("Initializing configuration manager...")
         self.config_manager = ConfigurationManager(self.heartbeat_interval, self.number_of_connectors)
         
+        # Heartbeat and keepalive follow their configuration keys as they change.
+        # Keepalive pings are sent by keepalive_loop (not the websockets library) at a per-charger
+        # phase within the interval, so a fleet connected at the same time does not ping in bursts.
+        self.websocket_ping_interval = self.config_manager.get_int_value("WebSocketPingInterval", 0)
+        self.websocket_ping_timeout = config.get('websocket_ping_timeout', 10)
+        self.keepalive_phase = _charger_phase(self.charge_point_id)
+        
+        # Heartbeats fall on a per-charger phase of HeartbeatInterval. With heartbeat_when_idle they are
+        # only sent if nothing else went out within the last interval.
+        self.heartbeat_phase = _charger_phase(f"{self.charge_point_id}/heartbeat")
+        self.heartbeat_when_idle = config.get('heartbeat_when_idle', False)
+        self.last_outbound_at = 0.0  # Loop time of the last frame sent other than a Heartbeat
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.heartbeat_wakeup: Optional[asyncio.Event] = None
+        self.keepalive_task: Optional[asyncio.Task] = None
+        self.keepalive_wakeup: Optional[asyncio.Event] = None
+        # Connector 0 (grid) meter values are opt-in; when enabled the loop is restarted on every boot
+        self.grid_meter_values = config.get('grid_meter_values', False)
+        self.grid_meter_task: Optional[asyncio.Task] = None
+        self.config_manager.subscribe(("HeartbeatInterval", "WebSocketPingInterval"), self._on_configuration_changed)
+        
         self.log("Initializing meter values handler...")
         self.meter_handler = MeterValuesHandler(self)
         
@@ -97,6 +227,20 @@ class EVChargerSimulator:
         # Load custom configuration keys from config if provided
         if 'configuration_keys' in config:
             self.config_manager.load_custom_config_keys(config['configuration_keys'])
+        
+        # Optional on-disk snapshot of profiles, configuration and transactions.
+        # State is restored lazily on the first connect, not here.
+        state_store_path = config.get('state_store_path')
+        self.state_store = get_state_store(state_store_path) if state_store_path else None
+        self.state_restored = False
+        
+        # Transaction messages produced while offline, replayed after the next accepted BootNotification
+        self.offline_queue = OfflineMessageQueue(
+            self,
+            config.get('offline_queue_max_messages', 1000),
+            config.get('offline_flush_rate', 2.0),
+            config.get('offline_flush_jitter', 5.0)
+        )
     
     def log(self, message: str, level: str = "INFO"):
         """Log message and update GUI if callback is available"""
@@ -140,9 +284,14 @@ class EVChargerSimulator:
         return f"Basic {encoded_credentials}"
     
     def _create_ssl_context(self) -> Optional[ssl.SSLContext]:
-        """Create SSL context for TLS connection"""
+        """Get the shared SSL context for this charger's TLS settings, creating it on first use"""
         if not self.use_tls:
             return None
+        
+        context_key = (self.ca_cert_path, ssl.TLSVersion.TLSv1_2)
+        context = _ssl_contexts.get(context_key)
+        if context is not None:
+            return context
             
         context = ssl.create_default_context()
         context.minimum_version = ssl.TLSVersion.TLSv1_2
@@ -152,25 +301,91 @@ class EVChargerSimulator:
                 context.load_verify_locations(self.ca_cert_path)
                 self.log(f"Loaded CA certificate: {self.ca_cert_path}")
             except Exception as e:
+                # Not cached, so a fixed CA file is picked up on the next attempt
                 self.log(f"Failed to load CA certificate: {e}", "ERROR")
+                return context
         
+        _ssl_contexts[context_key] = context
         return context
     
+    def _record_handshake(self, seconds: float):
+        """Report connection handshake time and whether TLS resumed a session"""
+        CONNECT_HANDSHAKE_SECONDS.observe(seconds)
+        
+        transport = getattr(self.websocket, 'transport', None)
+        ssl_object = transport.get_extra_info('ssl_object') if transport else None
+        if ssl_object is not None:
+            TLS_HANDSHAKES.inc(labels={"resumed": "true" if ssl_object.session_reused else "false"})
+    
+    def _load_saved_state(self):
+        """Read this charger's saved state and offline messages; blocking, run in an executor"""
+        return (self.state_store.load_charger(self.charge_point_id),
+                self.state_store.load_offline_messages(self.charge_point_id))
+    
+    async def restore_state(self):
+        """Restore profiles, configuration and transactions saved before the last restart"""
+        if self.state_store is None or self.state_restored:
+            return
+        
+        # Reads wait for the store's queued writes, which must not stall the event loop
+        state, offline_messages = await asyncio.get_running_loop().run_in_executor(None, self._load_saved_state)
+        if self.state_restored:
+            return
+        
+        for key, value in state["configuration"].items():
+            self.config_manager.update_configuration_key(key, value)
+        
+        for connector_id, transaction_id in state["transactions"].items():
+            if connector_id in self.connector_transactions:
+                self._set_connector_transaction(connector_id, transaction_id)
+        
+        engines = self._charging_profile_engines()
+        if engines:
+            for connector_id, profiles in state["charging_profiles"].items():
+                for profile_data in profiles:
+                    engines[0].handle_set_charging_profile(connector_id, profile_data)
+        
+        self.state_restored = True
+        self.offline_queue.restore(offline_messages)
+        self.log(f"Restored saved state: {len(state['configuration'])} configuration keys, "
+                 f"{len(state['transactions'])} transactions, "
+                 f"{sum(len(p) for p in state['charging_profiles'].values())} charging profiles, "
+                 f"{len(offline_messages)} offline messages")
+    
+    def persist_configuration_key(self, key: str, value: str):
+        """Save a changed configuration key to the state store"""
+        if self.state_store is not None and self.state_restored:
+            self.state_store.save_configuration_key(self.charge_point_id, key, value)
+    
+    def persist_charging_profiles(self):
+        """Save the installed charging profiles to the state store"""
+        engines = self._charging_profile_engines()
+        if self.state_store is not None and self.state_restored and engines:
+            self.state_store.save_charging_profiles(self.charge_point_id, engines[0].get_profiles_snapshot())
+    
     async def connect(self):
         """Connect to the Central System"""
-        connection_methods = [
-            self._connect_with_headers,
-            self._connect_with_embedded_auth,
-            self._connect_basic
-        ]
+        await self.restore_state()
+        
+        connection_methods = self._connection_methods()
         
         for i, method in enumerate(connection_methods):
             try:
-                self.log(f"Trying connection method {i + 1}/3...")
+                self.log(f"Trying connection method {i + 1}/{len(connection_methods)} ({method.__name__})...")
+                started = time.perf_counter()
                 await method()
                 if self.is_connected:
+                    self._record_handshake(time.perf_counter() - started)
+                    CONNECT_ATTEMPTS.inc(labels={"method": method.__name__, "result": "connected"})
+                    _winning_connection_methods[self.central_system_url] = method.__name__
                     self.log("Successfully connected to Central System")
                     self.reconnect_attempts = 0
+                    if self.disconnected_at is not None:
+                        RECONNECT_SECONDS.observe(time.perf_counter() - self.disconnected_at, labels=self._metric_labels())
+                        self.disconnected_at = None
+                    self._start_outbound_queue()
+                    self.handler_slots = asyncio.Semaphore(max(1, self.max_concurrent_handlers))
+                    self._start_keepalive()
                     
                     await asyncio.gather(
                         self.message_handler(),
@@ -180,6 +395,7 @@ class EVChargerSimulator:
                     return
                     
             except websockets.exceptions.InvalidStatus as e:
+                CONNECT_ATTEMPTS.inc(labels={"method": method.__name__, "result": str(e.response.status_code)})
                 if e.response.status_code == 401:
                     self.log("Authentication failed! Check your charge point ID and password.", "ERROR")
                     self.log(f"Charge Point ID: {self.charge_point_id}")
@@ -189,64 +405,78 @@ class EVChargerSimulator:
                     self.log(f"Method {i + 1} failed with status {e.response.status_code}", "WARNING")
                     
             except Exception as e:
+                CONNECT_ATTEMPTS.inc(labels={"method": method.__name__, "result": "error"})
                 self.log(f"Connection method {i + 1} failed: {e}", "WARNING")
         
+        if self.connection_fallback == "reset":
+            _winning_connection_methods.pop(self.central_system_url, None)
+        
         self.log("All connection methods failed", "ERROR")
         await self.handle_connection_failure()
     
+    def _connection_methods(self) -> List[Any]:
+        """Connection methods to try, in order, honouring the remembered method and fallback policy"""
+        connection_methods = [
+            self._connect_with_headers,
+            self._connect_with_embedded_auth,
+            self._connect_basic
+        ]
+        if WEBSOCKETS_HEADER_ARGUMENT is None:
+            connection_methods.remove(self._connect_with_headers)
+        
+        winner = _winning_connection_methods.get(self.central_system_url)
+        for method in connection_methods:
+            if method.__name__ == winner:
+                if self.connection_fallback == "all":
+                    return [method] + [other for other in connection_methods if other is not method]
+                return [method]
+        return connection_methods
+    
+    def _connect_options(self) -> Dict[str, Any]:
+        """websockets.connect arguments shared by every connection method"""
+        return {
+            "ssl": self._create_ssl_context(),
+            "subprotocols": ['ocpp1.6'],
+            # Keepalive is driven by WebSocketPingInterval in keepalive_loop
+            "ping_interval": None,
+            "ping_timeout": None,
+            **self.connection_limits,
+        }
+    
     async def _connect_with_headers(self):
-        """Try connection with headers (newer websockets versions)"""
+        """Try connection with an Authorization header"""
         uri = f"{self.central_system_url}/{self.charge_point_id}"
         headers = {"Authorization": self.create_auth_header()}
-        ssl_context = self._create_ssl_context()
         
         self.log(f"Connecting with headers to: {uri}")
         
-        try:
-            self.websocket = await websockets.connect(
-                uri,
-                ssl=ssl_context,
-                subprotocols=['ocpp1.6'],
-                additional_headers=headers,
-                ping_interval=20,
-                ping_timeout=10
-            )
-        except TypeError:
-            try:
-                self.websocket = await websockets.connect(
-                    uri,
-                    ssl=ssl_context,
-                    subprotocols=['ocpp1.6'],
-                    extra_headers=headers
-                )
-            except TypeError:
-                raise Exception("Headers not supported in this websockets version")
+        self.websocket = await websockets.connect(
+            uri,
+            **self._connect_options(),
+            **{WEBSOCKETS_HEADER_ARGUMENT: headers}
+        )
         
         self.is_connected = True
     
     async def _connect_with_embedded_auth(self):
         """Try connection with embedded auth in URI"""
         auth_uri = self.create_auth_uri()
-        ssl_context = self._create_ssl_context()
         self.log(f"Connecting with embedded auth to: {auth_uri}")
         
         self.websocket = await websockets.connect(
             auth_uri,
-            ssl=ssl_context,
-            subprotocols=['ocpp1.6']
+            **self._connect_options()
         )
         self.is_connected = True
     
     async def _connect_basic(self):
         """Try basic connection without auth (some servers allow this)"""
         uri = f"{self.central_system_url}/{self.charge_point_id}"
-        ssl_context = self._create_ssl_context()
         self.log(f"Connecting without auth to: {uri}")
         
         self.websocket = await websockets.connect(
             uri,
-            ssl=ssl_context,
-            subprotocols=['ocpp1.6']
+            **self._connect_options()
         )
         self.is_connected = True
     
@@ -267,26 +497,98 @@ class EVChargerSimulator:
         try:
             async for message in self.websocket:
                 await self.handle_message(message)
+            # A clean close ends the iteration without ConnectionClosed; disconnect() clears is_connected first
+            if self.is_connected:
+                self.log("Connection closed by server", "WARNING")
+                self._on_connection_lost("closed")
+                await self.handle_connection_failure()
         except websockets.exceptions.ConnectionClosed:
             self.log("Connection closed by server", "WARNING")
-            self.is_connected = False
-            self.boot_notification_accepted = False
+            self._on_connection_lost("closed")
             await self.handle_connection_failure()
         except Exception as e:
             self.log(f"Message handler error: {e}", "ERROR")
-            self.is_connected = False
+            self._on_connection_lost("error")
             await self.handle_connection_failure()
     
+    def _on_connection_lost(self, reason: str):
+        """Tear down per-connection state after the websocket failed"""
+        self.is_connected = False
+        self.boot_notification_accepted = False
+        self._close_outbound_queue()
+        self._fail_pending_requests()
+        self._cancel_call_handlers()
+        CONNECTION_LOSSES.inc(labels=self._metric_labels(reason=reason))
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+    
+    def _metric_labels(self, **labels: str) -> Dict[str, str]:
+        """Metric labels, plus the charger's ID when per-charger metrics are enabled"""
+        if self.metrics_per_charger:
+            labels[CHARGER_LABEL] = self.charge_point_id
+        return labels
+    
+    def _inbound_action_label(self, action: Any) -> str:
+        """Metric label for an incoming CALL's action; actions without a handler share "unknown"
+        so a misbehaving Central System cannot create unbounded label values"""
+        if isinstance(action, str) and action in self.message_handlers.get_handlers():
+            return action
+        return "unknown"
+    
+    @staticmethod
+    def _frame_size(frame: str) -> int:
+        return len(frame) if frame.isascii() else len(frame.encode("utf-8"))
+    
+    def _start_outbound_queue(self):
+        """Route all frames for the new websocket through one writer task"""
+        self._close_outbound_queue()
+        self.outbound_queue = OutboundQueue(self.websocket, self.charge_point_id)
+        self.outbound_queue.start()
+    
+    def _close_outbound_queue(self):
+        if self.outbound_queue is not None:
+            self.outbound_queue.close()
+            self.outbound_queue = None
+    
+    def _fail_pending_requests(self):
+        """Fail CALLs still waiting for a response on a connection that is gone"""
+        for future in self.pending_requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection lost before the response arrived"))
+        self.pending_requests.clear()
+        self.pending_actions.clear()
+    
+    async def _send_frame(self, frame: str, priority: int, is_heartbeat: bool = False):
+        """Send a frame through the outbound queue (directly if there is none)"""
+        if self.outbound_queue is not None:
+            await self.outbound_queue.send(frame, priority)
+        else:
+            await self.websocket.send(frame)
+        trace = wire_trace.recorder
+        if trace is not None:
+            trace.record(self.charge_point_id, wire_trace.DIRECTION_OUT, frame)
+        if not is_heartbeat:
+            self.last_outbound_at = asyncio.get_running_loop().time()
+    
     async def handle_message(self, raw_message: str):
         """Process incoming OCPP message"""
+        trace = wire_trace.recorder
+        if trace is not None:
+            trace.record(self.charge_point_id, wire_trace.DIRECTION_IN, raw_message)
+        
         try:
             message = json.loads(raw_message)
             self.log(f"Received: {message}")
             
             message_type = message[0]
+            if message_type == MessageType.CALL.value:
+                action = self._inbound_action_label(message[2])
+            else:
+                action = self.pending_actions.get(message[1], "")
+            MESSAGE_BYTES.inc(self._frame_size(raw_message), labels=self._metric_labels(action=action, direction="in"))
             
             if message_type == MessageType.CALL.value:
-                await self.handle_call(message)
+                await self._dispatch_call(message)
             elif message_type == MessageType.CALL_RESULT.value:
                 await self.handle_call_result(message)
             elif message_type == MessageType.CALL_ERROR.value:
@@ -295,6 +597,37 @@ class EVChargerSimulator:
         except Exception as e:
             self.log(f"Error handling message: {e}", "ERROR")
     
+    async def _dispatch_call(self, message: list):
+        """Handle an incoming CALL in its own task; the reader goes straight on to the next frame"""
+        if len(self.handler_tasks) >= max(1, self.max_concurrent_handlers) + self.max_queued_handlers:
+            INBOUND_CALLS.inc(labels=self._metric_labels(action=self._inbound_action_label(message[2]), result="rejected"))
+            self.log(f"{len(self.handler_tasks)} CALLs in progress, rejecting {message[2]}", "WARNING")
+            await self.send_call_error(message[1], "InternalError", "Charge point busy, retry later")
+            return
+        
+        task = asyncio.create_task(self._run_call_handler(message), name=f"handler:{self.charge_point_id}:{message[2]}")
+        self.handler_tasks.add(task)
+        task.add_done_callback(self.handler_tasks.discard)
+    
+    async def _run_call_handler(self, message: list):
+        """Run one CALL handler within the connection's concurrency limit and log its failures"""
+        slots = self.handler_slots
+        try:
+            if slots is None:
+                await self.handle_call(message)
+            else:
+                async with slots:
+                    await self.handle_call(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log(f"Error handling {message[2]}: {e}", "ERROR")
+    
+    def _cancel_call_handlers(self):
+        for task in list(self.handler_tasks):
+            task.cancel()
+        self.handler_tasks.clear()
+    
     async def handle_call(self, message: list):
         """Handle incoming request from Central System"""
         _, message_id, action, payload = message
@@ -305,19 +638,33 @@ class EVChargerSimulator:
         self.log(f"Available handlers: {list(handlers.keys())}")
         
         handler = handlers.get(action)
+        label = action if handler else "unknown"
         
-        if handler:
-            self.log(f"Found handler for {action}")
-            await handler(message_id, payload)
-        else:
-            self.log(f"No handler found for action: {action}", "WARNING")
-            await self.send_call_error(message_id, "NotImplemented", f"Action {action} not implemented")
+        self.inbound_actions[message_id] = label
+        started = time.perf_counter()
+        result = "handled"
+        try:
+            if handler:
+                self.log(f"Found handler for {action}")
+                await handler(message_id, payload)
+            else:
+                result = "not_implemented"
+                self.log(f"No handler found for action: {action}", "WARNING")
+                await self.send_call_error(message_id, "NotImplemented", f"Action {action} not implemented")
+        except Exception:
+            result = "error"
+            raise
+        finally:
+            self.inbound_actions.pop(message_id, None)
+            INBOUND_CALL_SECONDS.observe(time.perf_counter() - started, labels=self._metric_labels(action=label))
+            INBOUND_CALLS.inc(labels=self._metric_labels(action=label, result=result))
     
     async def handle_call_result(self, message: list):
         """Handle response to our request"""
         _, message_id, payload = message
         
         if message_id in self.pending_requests:
+            self.pending_actions.pop(message_id, None)
             future = self.pending_requests.pop(message_id)
             future.set_result(payload)
     
@@ -326,44 +673,105 @@ class EVChargerSimulator:
         _, message_id, error_code, error_description, error_details = message
         
         if message_id in self.pending_requests:
+            action = self.pending_actions.pop(message_id, "")
+            CALL_ERRORS.inc(labels=self._metric_labels(action=action, error_code=error_code))
             future = self.pending_requests.pop(message_id)
             future.set_exception(Exception(f"{error_code}: {error_description}"))
     
     async def send_call(self, action: str, payload: dict) -> dict:
         """Send request to Central System and wait for response"""
+        priority = call_priority(action)
+        
+        # Wait for the call slot; queueing delay is measured apart from CSMS latency
+        queued_at = time.perf_counter()
+        await self.call_pipeline.acquire(priority)
+        CALL_QUEUE_DELAY_SECONDS.observe(time.perf_counter() - queued_at, labels=self._metric_labels(action=action))
+        try:
+            return await self._send_call_and_wait(action, payload, priority)
+        finally:
+            self.call_pipeline.release()
+    
+    async def _send_call_and_wait(self, action: str, payload: dict, priority: int) -> dict:
+        """Send a CALL holding the call slot and wait for its response"""
         message_id = self.get_next_message_id()
         message = [MessageType.CALL.value, message_id, action, payload]
         
         # Create future for response
         future = asyncio.Future()
         self.pending_requests[message_id] = future
+        self.pending_actions[message_id] = action
         
         # Send message
-        await self.websocket.send(json.dumps(message))
+        frame = json.dumps(message)
+        try:
+            await self._send_frame(frame, priority, action == OCPPAction.HEARTBEAT.value)
+        except Exception:
+            self.pending_requests.pop(message_id, None)
+            self.pending_actions.pop(message_id, None)
+            raise
         self.log(f"Sent: {message}")
+        sent_at = time.perf_counter()
+        MESSAGE_BYTES.inc(self._frame_size(frame), labels=self._metric_labels(action=action, direction="out"))
         
         # Wait for response with timeout
         try:
             response = await asyncio.wait_for(future, timeout=30.0)
+            CALL_RESPONSE_SECONDS.observe(time.perf_counter() - sent_at, labels=self._metric_labels(action=action))
             return response
         except asyncio.TimeoutError:
             self.pending_requests.pop(message_id, None)
+            self.pending_actions.pop(message_id, None)
+            CALL_TIMEOUTS.inc(labels=self._metric_labels(action=action))
             raise Exception(f"Timeout waiting for response to {action}")
     
+    def _transaction_calls_offline(self) -> bool:
+        """Whether transaction CALLs must be queued: while offline, and behind a backlog still being replayed"""
+        return not (self.is_connected and self.boot_notification_accepted) or len(self.offline_queue) > 0
+    
+    async def send_transaction_call(self, action: str, payload: dict, starts_transaction: bool = False) -> Optional[dict]:
+        """Send a transaction CALL, or queue it for replay after reconnecting. Returns None if it was queued;
+        a queued StartTransaction gets a placeholder transaction ID (see OfflineMessageQueue.placeholder_of)"""
+        if not self._transaction_calls_offline():
+            try:
+                return await self.send_call(action, payload)
+            except Exception:
+                if self.is_connected:
+                    raise
+                self.log(f"Connection lost while sending {action}, queueing it", "WARNING")
+        
+        placeholder = self.offline_queue.next_placeholder_transaction_id() if starts_transaction else None
+        self.offline_queue.enqueue(action, payload, placeholder)
+        return None
+    
     async def send_call_result(self, message_id: str, payload: dict):
         """Send response to Central System request"""
         message = [MessageType.CALL_RESULT.value, message_id, payload]
-        await self.websocket.send(json.dumps(message))
+        frame = json.dumps(message)
+        await self._send_frame(frame, PRIORITY_RESPONSE)
+        self._count_response_bytes(message_id, frame)
         self.log(f"Sent: {message}")
     
+    async def send_call_result_raw(self, message_id: str, payload_json: str):
+        """Send a response whose payload is already JSON encoded"""
+        message = f'[{MessageType.CALL_RESULT.value},{json.dumps(message_id)},{payload_json}]'
+        await self._send_frame(message, PRIORITY_RESPONSE)
+        self._count_response_bytes(message_id, message)
+        self.log(f"Sent: CALLRESULT {message_id} ({len(message)} bytes, pre-encoded)")
+    
     async def send_call_error(self, message_id: str, error_code: str, error_description: str, error_details: dict = None):
         """Send error response to Central System request"""
         if error_details is None:
             error_details = {}
         message = [MessageType.CALL_ERROR.value, message_id, error_code, error_description, error_details]
-        await self.websocket.send(json.dumps(message))
+        frame = json.dumps(message)
+        await self._send_frame(frame, PRIORITY_RESPONSE)
+        self._count_response_bytes(message_id, frame)
         self.log(f"Sent: {message}")
     
+    def _count_response_bytes(self, message_id: str, frame: str):
+        action = self.inbound_actions.get(message_id, "")
+        MESSAGE_BYTES.inc(self._frame_size(frame), labels=self._metric_labels(action=action, direction="out"))
+    
     async def send_boot_notification(self):
         """Send BootNotification to Central System"""
         payload = {
@@ -376,7 +784,9 @@ class EVChargerSimulator:
         }
         
         try:
+            sent_at = time.time()
             response = await self.send_call(OCPPAction.BOOT_NOTIFICATION.value, payload)
+            self._sync_server_time(response, sent_at)
             
             if response.get("status") == "Accepted":
                 self.boot_notification_accepted = True
@@ -388,11 +798,19 @@ class EVChargerSimulator:
                     self.heartbeat_interval = interval
                     self.log(f"Heartbeat interval set to {interval}s")
                 
-                # Start heartbeat
-                asyncio.create_task(self.heartbeat_loop())
+                # Start heartbeat (replacing the loop of an earlier boot)
+                if self.heartbeat_task and not self.heartbeat_task.done():
+                    self.heartbeat_task.cancel()
+                self.heartbeat_task = asyncio.create_task(self.heartbeat_loop(), name=f"heartbeat:{self.charge_point_id}")
+                
+                # Replay transaction messages queued while offline
+                self.offline_queue.start_flush()
                 
-                # Start meter values
-                asyncio.create_task(self.meter_handler.start_meter_values())
+                # Grid meter values (connector 0); transaction meter values run per transaction
+                if self.grid_meter_values:
+                    self._cancel_grid_meter_values()
+                    self.grid_meter_task = asyncio.create_task(self.meter_handler.send_grid_meter_values_loop(),
+                                                               name=f"meter:{self.charge_point_id}")
                 
             elif response.get("status") == "Rejected":
                 self.log("BootNotification rejected", "ERROR")
@@ -402,29 +820,102 @@ class EVChargerSimulator:
         except Exception as e:
             self.log(f"Error sending BootNotification: {e}", "ERROR")
     
+    def _cancel_grid_meter_values(self):
+        if self.grid_meter_task and not self.grid_meter_task.done():
+            self.grid_meter_task.cancel()
+        self.grid_meter_task = None
+    
     async def heartbeat_loop(self):
         """Send periodic heartbeats"""
+        self.heartbeat_wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
         while self.is_connected and self.boot_notification_accepted:
             try:
-                await asyncio.sleep(self.heartbeat_interval)
+                # A HeartbeatInterval change restarts the wait with the new interval; 0 pauses heartbeats
+                interval = self.heartbeat_interval
+                delay = _seconds_until_slot(loop.time(), interval, self.heartbeat_phase) if interval > 0 else None
+                if await wait_for_change(self.heartbeat_wakeup, delay):
+                    continue
+                if self.heartbeat_when_idle and loop.time() - self.last_outbound_at < interval:
+                    HEARTBEATS_SUPPRESSED.inc()
+                    continue
                 if self.is_connected:
-                    await self.send_call(OCPPAction.HEARTBEAT.value, {})
+                    sent_at = time.time()
+                    response = await self.send_call(OCPPAction.HEARTBEAT.value, {})
+                    self._sync_server_time(response, sent_at)
             except Exception as e:
                 self.log(f"Heartbeat error: {e}", "ERROR")
                 break
     
+    def _sync_server_time(self, response: dict, sent_at: float):
+        """Align the shared timestamp clock with the Central System's currentTime"""
+        offset = clock.observe_server_time(response.get("currentTime"), sent_at, time.time())
+        if offset is not None and abs(offset) >= 1:
+            self.log(f"Central System clock offset: {offset:+.2f}s")
+    
+    def _start_keepalive(self):
+        """Start the WebSocket keepalive loop if WebSocketPingInterval is set"""
+        if self.keepalive_task and not self.keepalive_task.done():
+            self.keepalive_task.cancel()
+        self.keepalive_task = None
+        if self.websocket_ping_interval > 0:
+            self.keepalive_task = asyncio.create_task(self.keepalive_loop(), name=f"keepalive:{self.charge_point_id}")
+    
+    async def keepalive_loop(self):
+        """Ping the Central System every WebSocketPingInterval seconds, at this charger's phase of the interval"""
+        self.keepalive_wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while self.is_connected and self.websocket_ping_interval > 0:
+            # A WebSocketPingInterval change restarts the wait at the new interval's slot
+            delay = _seconds_until_slot(loop.time(), self.websocket_ping_interval, self.keepalive_phase)
+            if await wait_for_change(self.keepalive_wakeup, delay):
+                continue
+            try:
+                sent_at = time.perf_counter()
+                pong_waiter = await self.websocket.ping()
+                await asyncio.wait_for(pong_waiter, self.websocket_ping_timeout)
+                PING_RTT_SECONDS.observe(time.perf_counter() - sent_at)
+            except asyncio.TimeoutError:
+                PING_TIMEOUTS.inc()
+                self.log(f"No pong within {self.websocket_ping_timeout}s, closing connection", "WARNING")
+                # 1011: the peer is unresponsive, so the reader ends and the connection is re-established
+                await self.websocket.close(code=1011, reason="Keepalive ping timeout")
+                break
+            except Exception as e:
+                self.log(f"WebSocket ping failed: {e}", "WARNING")
+                break
+    
+    def _on_configuration_changed(self, key: str, value: Any):
+        """Apply HeartbeatInterval and WebSocketPingInterval changes to the running loops"""
+        if key == "HeartbeatInterval" and value is not None:
+            self.heartbeat_interval = value
+            if self.heartbeat_wakeup:
+                self.heartbeat_wakeup.set()
+        elif key == "WebSocketPingInterval":
+            previous_interval = self.websocket_ping_interval
+            self.websocket_ping_interval = value if value is not None else 0
+            if self.keepalive_task and not self.keepalive_task.done():
+                self.keepalive_wakeup.set()
+            elif self.is_connected and previous_interval <= 0:
+                self._start_keepalive()
+    
     async def send_status_notification(self, connector_id: int, status: ChargerStatus, error_code: str = "NoError"):
         """Send StatusNotification to Central System"""
         payload = {
             "connectorId": connector_id,
             "status": status.value,
             "errorCode": error_code,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": clock.timestamp()
         }
         
+        # The local status changes even if the Central System cannot be told right now
+        self.connector_status[connector_id] = status
+        if not self.is_connected:
+            self.log(f"Offline, status notification for connector {connector_id} not sent: {status.value}")
+            return
+        
         try:
             await self.send_call(OCPPAction.STATUS_NOTIFICATION.value, payload)
-            self.connector_status[connector_id] = status
             self.log(f"Status notification sent for connector {connector_id}: {status.value}")
         except Exception as e:
             self.log(f"Error sending status notification: {e}", "ERROR")
@@ -439,15 +930,21 @@ class EVChargerSimulator:
             "connectorId": connector_id,
             "idTag": id_tag,
             "meterStart": 0,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": clock.timestamp()
         }
         
         try:
-            response = await self.send_call(OCPPAction.START_TRANSACTION.value, payload)
+            response = await self.send_transaction_call(OCPPAction.START_TRANSACTION.value, payload, starts_transaction=True)
             
-            if response.get("idTagInfo", {}).get("status") == "Accepted":
+            if response is None:
+                placeholder = self.offline_queue.placeholder_of(payload)
+                # Queued: charge under the placeholder ID until StartTransaction is delivered
+                self._set_connector_transaction(connector_id, placeholder)
+                await self.send_status_notification(connector_id, ChargerStatus.CHARGING)
+                self.log(f"Transaction started offline on connector {connector_id} (placeholder ID {placeholder})")
+            elif response.get("idTagInfo", {}).get("status") == "Accepted":
                 transaction_id = response.get("transactionId")
-                self.connector_transactions[connector_id] = transaction_id
+                self._set_connector_transaction(connector_id, transaction_id)
                 await self.send_status_notification(connector_id, ChargerStatus.CHARGING)
                 self.log(f"Transaction {transaction_id} started on connector {connector_id}")
             else:
@@ -465,11 +962,7 @@ class EVChargerSimulator:
                 return
         elif transaction_id:
             # Find connector by transaction ID
-            connector_id = None
-            for conn_id, trans_id in self.connector_transactions.items():
-                if trans_id == transaction_id:
-                    connector_id = conn_id
-                    break
+            connector_id = self.transaction_connectors.get(transaction_id)
             if not connector_id:
                 self.log(f"Transaction {transaction_id} not found", "WARNING")
                 return
@@ -480,23 +973,85 @@ class EVChargerSimulator:
         payload = {
             "transactionId": transaction_id,
             "meterStop": 1000,  # Example value
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": clock.timestamp()
         }
         
         try:
-            response = await self.send_call(OCPPAction.STOP_TRANSACTION.value, payload)
-            self.log(f"Transaction stopped on connector {connector_id}: {response}")
+            response = await self.send_transaction_call(OCPPAction.STOP_TRANSACTION.value, payload)
+            if response is None:
+                self.log(f"Transaction stopped offline on connector {connector_id}, StopTransaction queued")
+            else:
+                self.log(f"Transaction stopped on connector {connector_id}: {response}")
             
             if connector_id:
-                self.connector_transactions[connector_id] = None
+                self._set_connector_transaction(connector_id, None)
                 await self.send_status_notification(connector_id, ChargerStatus.AVAILABLE)
             
         except Exception as e:
             self.log(f"Error stopping transaction: {e}", "ERROR")
     
+    def _set_connector_transaction(self, connector_id: int, transaction_id: Optional[int]):
+        """Record the transaction on a connector and keep the reverse index in sync"""
+        previous_transaction_id = self.connector_transactions.get(connector_id)
+        if previous_transaction_id is not None:
+            self.transaction_connectors.pop(previous_transaction_id, None)
+        
+        self.connector_transactions[connector_id] = transaction_id
+        if transaction_id is not None:
+            self.transaction_connectors[transaction_id] = connector_id
+        
+        if self.state_store is not None and self.state_restored:
+            self.state_store.save_transaction(self.charge_point_id, connector_id, transaction_id)
+        
+        # TxProfiles only live as long as their transaction
+        for engine in self._charging_profile_engines():
+            engine.invalidate_composite_cache()
+            if previous_transaction_id is not None:
+                engine.purge_transaction_profiles(connector_id, previous_transaction_id)
+        if previous_transaction_id is not None:
+            self.persist_charging_profiles()
+    
+    def replace_transaction_id(self, placeholder_id: int, transaction_id: int):
+        """Switch a transaction started offline to the ID assigned by the Central System"""
+        connector_id = self.transaction_connectors.pop(placeholder_id, None)
+        if connector_id is None:
+            return  # Already stopped; its StopTransaction was rewritten in the queue
+        
+        # Same transaction under a new ID, so its TxProfiles are kept
+        self.connector_transactions[connector_id] = transaction_id
+        self.transaction_connectors[transaction_id] = connector_id
+        if self.state_store is not None and self.state_restored:
+            self.state_store.save_transaction(self.charge_point_id, connector_id, transaction_id)
+        for engine in self._charging_profile_engines():
+            engine.invalidate_composite_cache()
+        self.log(f"Offline transaction on connector {connector_id} is now transaction {transaction_id}")
+    
+    def abandon_transaction(self, placeholder_id: int):
+        """Clear a transaction started offline whose StartTransaction never got a transaction ID"""
+        connector_id = self.transaction_connectors.get(placeholder_id)
+        if connector_id is None:
+            return
+        
+        self._set_connector_transaction(connector_id, None)
+        self.log(f"Offline transaction on connector {connector_id} was not accepted by the Central System, cleared", "WARNING")
+    
+    def _charging_profile_engines(self) -> List[Any]:
+        """Get the charging profile engines attached to this simulator"""
+        engines = []
+        for attribute in ('charging_profiles_manager', 'charging_profile_handler'):
+            engine = getattr(self, attribute, None)
+            if engine is not None:
+                engines.append(engine)
+        return engines
+    
     async def disconnect(self):
         """Disconnect from Central System"""
         self.is_connected = False
+        self.boot_notification_accepted = False
+        self._close_outbound_queue()
+        self._fail_pending_requests()
+        self._cancel_call_handlers()
+        self._cancel_grid_meter_values()
         if self.websocket:
             await self.websocket.close()
         self.log("Disconnected from Central System")
@@ -519,4 +1074,7 @@ class EVChargerSimulator:
     
     def update_configuration_key(self, key: str, value: str) -> str:
         """Update a configuration key value"""
-        return self.config_manager.update_configuration_key(key, value)
\ No newline at end of file
+        status = self.config_manager.update_configuration_key(key, value)
+        if status in ("Accepted", "RebootRequired"):
+            self.persist_configuration_key(key, value)
+        return status
\ No newline at end of file
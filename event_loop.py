@@ -0,0 +1,62 @@
+# event_loop.py
+"""Event loop selection: the stock asyncio loop or uvloop
+
+uvloop is optional (pip install uvloop). It is not available on Windows; asking
+for it where it is not installed falls back to the stock loop with a warning.
+"""
+
+import asyncio
+import logging
+import platform
+from typing import Any, Coroutine
+
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# "auto" picks uvloop when it is installed
+LOOP_CHOICES = ("asyncio", "uvloop", "auto")
+
+
+def resolve_loop_name(name: str = "asyncio") -> str:
+    """The loop implementation that will actually be used for a requested name"""
+    if name not in LOOP_CHOICES:
+        raise ValueError(f"Unknown event loop '{name}', expected one of {', '.join(LOOP_CHOICES)}")
+    if name == "asyncio":
+        return "asyncio"
+
+    if UVLOOP_AVAILABLE and platform.system() != "Windows":
+        return "uvloop"
+    if name == "uvloop":
+        logger.warning("uvloop is not installed (pip install uvloop), using the asyncio event loop")
+    return "asyncio"
+
+
+def new_event_loop(name: str = "asyncio") -> asyncio.AbstractEventLoop:
+    """Create a new event loop of the requested kind"""
+    if resolve_loop_name(name) == "uvloop":
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run(coroutine: Coroutine[Any, Any, Any], name: str = "asyncio") -> Any:
+    """asyncio.run() on an event loop of the requested kind"""
+    if hasattr(asyncio, "Runner"):
+        with asyncio.Runner(loop_factory=lambda: new_event_loop(name)) as runner:
+            return runner.run(coroutine)
+
+    # Python < 3.11
+    loop = new_event_loop(name)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,310 @@
+# fleet_runner.py
+"""Headless runner for a fleet of simulated chargers defined by a fleet spec"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import event_loop
+from clock import clock
+from connection_limits import preflight, resident_memory
+from loop_monitor import LoopMonitor
+from metrics import registry
+from metrics_server import start_metrics_server
+import wire_trace
+from ev_charger_simulator import EVChargerSimulator
+from fleet_spec import FleetSpec, load_fleet_spec
+
+logger = logging.getLogger(__name__)
+
+
+def _configuration_key_values(config: Dict[str, Any]) -> Dict[str, str]:
+    """Configuration key overrides of a charger config as key -> value"""
+    return {key_data["key"]: key_data.get("value", "") for key_data in config.get("configuration_keys", [])}
+
+
+def _without_configuration_keys(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: value for field, value in config.items() if field != "configuration_keys"}
+
+
+class FleetRunner:
+    """Starts the chargers of a fleet spec at a controlled rate and keeps them running.
+
+    With watch_interval set, the spec file (and its identity CSV) is polled for
+    changes; SIGHUP triggers a reload as well. A reload is applied as a diff:
+    new chargers are started, removed ones retired, changed configuration keys
+    are set in place, and chargers whose other settings changed are restarted.
+    Chargers without changes are left alone.
+    """
+
+    def __init__(self, spec_path: str, start_rate: float = 10.0, watch_interval: float = 0,
+                 lag_threshold: float = 0.1):
+        self.spec_path = spec_path
+        self.start_rate = start_rate  # Chargers started or retired per second, 0 = no pacing
+        self.watch_interval = watch_interval  # Seconds between spec file checks, 0 = no watching
+        self.simulators: Dict[str, EVChargerSimulator] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.configs: Dict[str, Dict[str, Any]] = {}  # Config each running charger was started with
+        self.stopped: Optional[asyncio.Event] = None
+        self.reload_lock: Optional[asyncio.Lock] = None
+        self.spec_paths: List[str] = [spec_path]  # Files the last loaded spec was read from
+        self.spec_mtimes: Tuple[float, ...] = ()
+        self.loop_monitor = LoopMonitor(lag_threshold=lag_threshold)
+
+    async def run(self):
+        """Start every charger in the spec, then run until stop() is called"""
+        self.stopped = asyncio.Event()
+        self.reload_lock = asyncio.Lock()
+        self.loop_monitor.start()
+        lag_task = asyncio.create_task(self.warn_on_loop_lag())
+        spec = self._load_spec()
+        self.spec_mtimes = self._read_spec_mtimes()
+        memory_before = resident_memory()
+
+        # The preflight reads every identity row, so it runs in a thread while the first chargers start
+        preflight_task = asyncio.get_running_loop().run_in_executor(None, preflight, spec.iter_connection_configs())
+
+        # Changes made while the fleet is still starting are applied once it has started
+        async with self.reload_lock:
+            watch_task = asyncio.create_task(self.watch_spec()) if self.watch_interval > 0 else None
+            self._install_reload_signal()
+
+            # Chargers start while the spec is still being read
+            await self.start_chargers(spec.iter_configs())
+        try:
+            await preflight_task
+        except Exception as e:
+            logger.warning(f"Fleet preflight failed: {e}")
+        logger.info(f"Fleet started: {len(self.simulators)} chargers")
+        self.report_memory(memory_before)
+
+        await self.stopped.wait()
+        if watch_task:
+            watch_task.cancel()
+        lag_task.cancel()
+        await self.stop_all()
+        self.loop_monitor.stop()
+
+    async def start_chargers(self, configs: Iterable[Dict[str, Any]]):
+        """Start chargers from an iterable of config dicts, paced by start_rate"""
+        for config in configs:
+            if self.stopped is not None and self.stopped.is_set():
+                return
+            if config["charge_point_id"] in self.simulators:
+                logger.warning(f"Duplicate charge point ID {config['charge_point_id']} in fleet spec, skipped")
+                continue
+
+            self.start_charger(config)
+            await self._pace()
+
+    def start_charger(self, config: Dict[str, Any]) -> EVChargerSimulator:
+        """Create a simulator for one charger and start connecting it"""
+        charge_point_id = config["charge_point_id"]
+        simulator = EVChargerSimulator(config)
+        self.simulators[charge_point_id] = simulator
+        self.configs[charge_point_id] = config
+        self.tasks[charge_point_id] = asyncio.create_task(simulator.connect(), name=f"charger:{charge_point_id}")
+        return simulator
+
+    async def stop_charger(self, charge_point_id: str):
+        """Disconnect one charger and forget it"""
+        simulator = self.simulators.pop(charge_point_id, None)
+        task = self.tasks.pop(charge_point_id, None)
+        self.configs.pop(charge_point_id, None)
+        if simulator is None:
+            return
+
+        try:
+            await simulator.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting {charge_point_id}: {e}")
+        if task and not task.done():
+            task.cancel()
+
+    async def stop_all(self):
+        """Disconnect every charger"""
+        for charge_point_id in list(self.simulators):
+            await self.stop_charger(charge_point_id)
+
+    async def warn_on_loop_lag(self, period: float = 30.0):
+        """Warn when the simulator itself was too busy, so CSMS latency from that period is suspect"""
+        while True:
+            self.loop_monitor.reset()
+            await asyncio.sleep(period)
+            if not self.loop_monitor.valid():
+                logger.warning(f"Event loop overloaded in the last {period:.0f}s ({self.loop_monitor.summary()}); "
+                               f"latencies measured in this period include local scheduling delay")
+
+    def report_memory(self, memory_before: Optional[int]):
+        """Log resident memory growth per connected charger, for sizing hosts"""
+        memory_after = resident_memory()
+        connected = sum(1 for simulator in self.simulators.values() if simulator.is_connected)
+        if memory_before is None or memory_after is None or connected == 0:
+            return
+        per_charger = (memory_after - memory_before) / connected
+        logger.info(f"Resident memory: {memory_after / 1024 / 1024:,.1f} MiB, "
+                    f"about {per_charger / 1024:,.0f} KiB per connected charger ({connected} connected)")
+
+    def stop(self):
+        """Ask run() to disconnect the fleet and return"""
+        if self.stopped is not None:
+            self.stopped.set()
+
+    async def _pace(self):
+        """Wait between starting or retiring chargers so the CSMS sees a controlled rate"""
+        if self.start_rate > 0:
+            await asyncio.sleep(1.0 / self.start_rate)
+        else:
+            await asyncio.sleep(0)  # Still let connections and heartbeats run between chargers
+
+    def _load_spec(self) -> FleetSpec:
+        """Load the spec and remember which files it was read from"""
+        spec = load_fleet_spec(self.spec_path)
+        paths = [self.spec_path]
+        if spec.identities_path:
+            paths.append(os.path.join(spec.base_dir, spec.identities_path))
+        self.spec_paths = paths
+        return spec
+
+    def _read_spec_mtimes(self) -> Tuple[float, ...]:
+        """Modification times of the files the spec was last loaded from"""
+        mtimes = []
+        for path in self.spec_paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(0.0)
+        return tuple(mtimes)
+
+    async def watch_spec(self):
+        """Reload the fleet spec whenever its files change"""
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            mtimes = self._read_spec_mtimes()
+            if mtimes != self.spec_mtimes:
+                self.spec_mtimes = mtimes
+                paths = self.spec_paths
+                await self.reload()
+                if self.spec_paths != paths:
+                    self.spec_mtimes = self._read_spec_mtimes()  # Now watching another identity file
+
+    def _install_reload_signal(self):
+        """Reload on SIGHUP where the platform supports it"""
+        if not hasattr(signal, "SIGHUP"):
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.reload()))
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    async def reload(self):
+        """Re-read the spec and apply the differences to the running fleet"""
+        async with self.reload_lock:
+            try:
+                desired = {config["charge_point_id"]: config for config in self._load_spec().iter_configs()}
+            except Exception as e:
+                logger.error(f"Fleet spec reload failed, keeping the running fleet: {e}")
+                return
+
+            removed = [charge_point_id for charge_point_id in self.configs if charge_point_id not in desired]
+            added = [config for charge_point_id, config in desired.items() if charge_point_id not in self.configs]
+            reconfigured: List[str] = []
+            restarted: List[str] = []
+
+            for charge_point_id, config in desired.items():
+                running_config = self.configs.get(charge_point_id)
+                if running_config is None or running_config == config:
+                    continue
+                if (_without_configuration_keys(running_config) == _without_configuration_keys(config) and
+                        self._apply_configuration_keys(charge_point_id, config)):
+                    reconfigured.append(charge_point_id)
+                else:
+                    restarted.append(charge_point_id)
+
+            logger.info(f"Fleet spec reloaded: {len(added)} added, {len(removed)} retired, "
+                        f"{len(reconfigured)} reconfigured, {len(restarted)} restarted")
+
+            for charge_point_id in removed:
+                await self.stop_charger(charge_point_id)
+                await self._pace()
+            for charge_point_id in restarted:
+                await self.stop_charger(charge_point_id)
+                self.start_charger(desired[charge_point_id])
+                await self._pace()
+            await self.start_chargers(added)
+
+    def _apply_configuration_keys(self, charge_point_id: str, config: Dict[str, Any]) -> bool:
+        """Apply changed configuration keys to a running charger.
+        Returns False if a change cannot be made in place (e.g. a readonly key)"""
+        simulator = self.simulators[charge_point_id]
+        running_values = _configuration_key_values(self.configs[charge_point_id])
+        desired_values = _configuration_key_values(config)
+
+        changes = {key: value for key, value in desired_values.items() if running_values.get(key) != value}
+        for key in running_values:
+            if key not in desired_values:
+                # Dropped from the spec: back to the standard default, custom keys keep their value
+                default_value = simulator.config_manager.get_default_value(key)
+                if default_value is not None:
+                    changes[key] = default_value
+
+        for key, value in changes.items():
+            status = simulator.update_configuration_key(key, value)
+            if status not in ("Accepted", "RebootRequired"):
+                logger.info(f"{charge_point_id}: {key} cannot be changed in place ({status}), restarting charger")
+                return False
+
+        self.configs[charge_point_id] = config
+        return True
+
+
+def main(argv=None):
+    """Command line entry point: run a fleet spec headless"""
+    parser = argparse.ArgumentParser(description="Run a fleet of simulated chargers")
+    parser.add_argument("spec", help="Fleet spec file (JSON, YAML or CSV)")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="Chargers started or retired per second (0 = no pacing)")
+    parser.add_argument("--watch", type=float, default=0,
+                        help="Check the spec for changes every N seconds and apply them (0 = off)")
+    parser.add_argument("--loop", choices=event_loop.LOOP_CHOICES, default="asyncio",
+                        help="Event loop implementation (uvloop needs pip install uvloop)")
+    parser.add_argument("--timestamp-resolution", type=float, default=1.0,
+                        help="Resolution of OCPP timestamps in seconds, shared by all chargers (e.g. 1 or 0.1)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics on this local port (0 = off)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint listens on")
+    parser.add_argument("--lag-threshold", type=float, default=0.1,
+                        help="Event loop lag in seconds above which the fleet is reported as overloaded")
+    parser.add_argument("--metrics-per-charger", action="store_true",
+                        help="Also record metrics per charger (served with /metrics?per_charger=1)")
+    parser.add_argument("--wire-trace", metavar="DIRECTORY",
+                        help="Record every OCPP frame into compressed trace files in DIRECTORY")
+    parser.add_argument("--wire-trace-file-mb", type=int, default=64,
+                        help="Uncompressed megabytes per trace file before rotating")
+    parser.add_argument("--wire-trace-files", type=int, default=20,
+                        help="Trace files kept; older ones are deleted (0 = keep all)")
+    args = parser.parse_args(argv)
+    clock.set_resolution(args.timestamp_resolution)
+    registry.per_charger_labels = args.metrics_per_charger
+    metrics_server = start_metrics_server(args.metrics_port, args.metrics_host) if args.metrics_port else None
+    if args.wire_trace:
+        wire_trace.start_recording(args.wire_trace, max_file_bytes=args.wire_trace_file_mb * 2 ** 20,
+                                   max_files=args.wire_trace_files)
+
+    runner = FleetRunner(args.spec, args.rate, args.watch, args.lag_threshold)
+    logger.info(f"Using the {event_loop.resolve_loop_name(args.loop)} event loop")
+    try:
+        event_loop.run(runner.run(), args.loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server:
+            metrics_server.shutdown()
+        wire_trace.stop_recording()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# fleet_spec.py
+"""Fleet definitions: charger templates plus per-charger identity rows
+
+A fleet spec is a JSON or YAML file (YAML needs PyYAML):
+
+    {
+        "defaults": {"central_system_url": "wss://csms.example.com/ocpp"},
+        "templates": {
+            "ac22": {
+                "charge_point_vendor": "Vendor", "charge_point_model": "AC22",
+                "number_of_connectors": 2, "max_power": 22000,
+                "configuration_keys": {"MeterValueSampleInterval": "30"},
+                "ev_model": {"name": "Compact", "max_power": 11000, "initial_soc": 20}
+            },
+            "ac22-fast-meter": {"extends": "ac22", "configuration_keys": {"MeterValueSampleInterval": "5"}}
+        },
+        "chargers": [{"template": "ac22", "charge_point_id": "CP0001", "password": "secret"}],
+        "identities": "identities.csv"
+    }
+
+"chargers" lists rows inline; "identities" names a CSV file (relative to the
+spec) with one row per charger and a header such as
+template,charge_point_id,password. CSV rows are read lazily, so large identity
+files are streamed rather than loaded up front. A plain CSV file can also be
+used as the whole spec, with no templates.
+
+Each row is merged over its template (templates may extend other templates),
+which is merged over "defaults", and the result is an EVChargerSimulator
+config dict.
+"""
+
+import copy
+import csv
+import json
+import os
+from typing import Dict, Any, Iterator, List, Optional
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+# Config fields whose CSV cells are converted from text
+FIELD_TYPES = {
+    "heartbeat_interval": int,
+    "number_of_connectors": int,
+    "max_power": float,
+    "max_current": float,
+    "use_tls": _parse_bool,
+    "heartbeat_when_idle": _parse_bool,
+    "metrics_per_charger": _parse_bool,
+    "grid_meter_values": _parse_bool,
+    "websocket_max_size": int,
+    "websocket_max_queue": int,
+    "websocket_write_limit": int,
+    "websocket_read_limit": int,
+}
+
+# Template fields merged key by key instead of replaced
+MERGED_FIELDS = ("configuration_keys", "ev_model")
+
+
+class FleetSpecError(Exception):
+    """Raised for an invalid fleet spec"""
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge override over base; configuration_keys and ev_model are merged key by key"""
+    merged = dict(base)
+    for field, value in override.items():
+        if field in MERGED_FIELDS and isinstance(value, dict) and isinstance(merged.get(field), dict):
+            merged[field] = {**merged[field], **value}
+        else:
+            merged[field] = value
+    return merged
+
+
+def configuration_keys_list(configuration_keys: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert spec configuration key overrides to the simulator's configuration_keys list.
+
+    A value is either the OCPP string value or a dict with value/readonly/reboot_required/type.
+    """
+    keys = []
+    for key, value in configuration_keys.items():
+        if isinstance(value, dict):
+            key_data = dict(value)
+            key_data["key"] = key
+            key_data["value"] = str(key_data.get("value", ""))
+        else:
+            key_data = {"key": key, "value": str(value).lower() if isinstance(value, bool) else str(value)}
+        keys.append(key_data)
+    return keys
+
+
+class FleetSpec:
+    """A parsed fleet spec that yields one simulator config dict per charger"""
+
+    def __init__(self, spec: Dict[str, Any], base_dir: str = "."):
+        self.base_dir = base_dir
+        self.defaults: Dict[str, Any] = spec.get("defaults", {})
+        self.raw_templates: Dict[str, Dict[str, Any]] = spec.get("templates", {})
+        self.inline_rows: List[Dict[str, Any]] = spec.get("chargers", [])
+        self.identities_path: Optional[str] = spec.get("identities")
+        self.templates: Dict[str, Dict[str, Any]] = {}
+
+        for name in self.raw_templates:
+            self.resolve_template(name)
+
+    def resolve_template(self, name: str, chain: tuple = ()) -> Dict[str, Any]:
+        """Get a template with everything it extends merged in"""
+        if name in self.templates:
+            return self.templates[name]
+        if name not in self.raw_templates:
+            raise FleetSpecError(f"Unknown template '{name}'")
+        if name in chain:
+            raise FleetSpecError(f"Template inheritance cycle: {' -> '.join(chain + (name,))}")
+
+        template = self.raw_templates[name]
+        parent = template.get("extends")
+        base = self.resolve_template(parent, chain + (name,)) if parent else self.defaults
+        resolved = _merge(base, {field: value for field, value in template.items() if field != "extends"})
+
+        self.templates[name] = resolved
+        return resolved
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        """Yield raw charger rows: inline rows first, then the identity CSV, read lazily"""
+        yield from self.inline_rows
+
+        if self.identities_path:
+            path = os.path.join(self.base_dir, self.identities_path)
+            yield from iter_csv_rows(path)
+
+    def build_config(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a simulator config dict from one charger row"""
+        template_name = row.get("template")
+        base = self.resolve_template(template_name) if template_name else self.defaults
+        config = copy.deepcopy(_merge(base, {field: value for field, value in row.items() if field != "template"}))
+
+        if not config.get("charge_point_id"):
+            raise FleetSpecError(f"Charger row without charge_point_id: {row}")
+        config.setdefault("meter_serial_number", f"METER{config['charge_point_id']}")
+        if isinstance(config.get("configuration_keys"), dict):
+            config["configuration_keys"] = configuration_keys_list(config["configuration_keys"])
+        return config
+
+    def iter_connection_configs(self) -> Iterator[Dict[str, Any]]:
+        """Yield each charger's row merged shallowly over its template: enough for connection
+        limits and counting, without the copies made for full configs"""
+        for row in self.iter_rows():
+            template_name = row.get("template")
+            base = self.resolve_template(template_name) if template_name else self.defaults
+            yield {**base, **row}
+
+    def iter_configs(self) -> Iterator[Dict[str, Any]]:
+        """Yield one simulator config dict per charger, in spec order"""
+        for row in self.iter_rows():
+            yield self.build_config(row)
+
+
+def iter_csv_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield identity rows from a CSV file, converting typed columns and skipping empty cells"""
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        for row_number, row in enumerate(csv.DictReader(csv_file), start=1):
+            parsed = {}
+            for field, value in row.items():
+                if field is None or value is None or value == "":
+                    continue
+                try:
+                    parsed[field] = FIELD_TYPES[field](value) if field in FIELD_TYPES else value
+                except ValueError:
+                    raise FleetSpecError(f"{path} row {row_number}: bad {field} {value!r}") from None
+            yield parsed
+
+
+def load_fleet_spec(path: str) -> FleetSpec:
+    """Load a fleet spec from a JSON, YAML or CSV file"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".csv":
+        return FleetSpec({"identities": os.path.basename(path)}, base_dir)
+
+    with open(path, encoding="utf-8") as spec_file:
+        if extension in (".yaml", ".yml"):
+            if not YAML_AVAILABLE:
+                raise FleetSpecError("YAML fleet specs need PyYAML (pip install pyyaml)")
+            spec = yaml.safe_load(spec_file) or {}
+        else:
+            spec = json.load(spec_file)
+
+    if not isinstance(spec, dict):
+        raise FleetSpecError(f"Fleet spec {path} must contain a mapping")
+    return FleetSpec(spec, base_dir)
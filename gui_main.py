@@ -9,13 +9,14 @@ import platform
 import sys
 
 # Import from other modules
+import event_loop
 from ev_charger_simulator import EVChargerSimulator
 from gui_dialogs import ConfigurationDialog
 from ocpp_enums import OCPPAction, ChargerStatus
 
 
 class EVChargerSimulatorGUI:
-    def __init__(self, root):
+    def __init__(self, root, loop_name: str = "asyncio"):
         self.root = root
         self.root.title("EV Charger Simulator with OCPP 1.6")
         self.root.geometry("1000x700")
@@ -23,6 +24,7 @@ class EVChargerSimulatorGUI:
         self.simulator = None
         self.asyncio_thread = None
         self.loop = None
+        self.loop_name = loop_name  # asyncio, uvloop or auto (see event_loop.py)
         self.config_keys = []
         
         self.setup_ui()
@@ -412,7 +414,7 @@ class EVChargerSimulatorGUI:
     def run_asyncio_loop(self):
         """Run asyncio loop in separate thread"""
         try:
-            self.loop = asyncio.new_event_loop()
+            self.loop = event_loop.new_event_loop(self.loop_name)
             asyncio.set_event_loop(self.loop)
             
             # Set event loop policy for Windows
@@ -636,12 +638,29 @@ class EVChargerSimulatorGUI:
             self.profiles_text.delete(1.0, tk.END)
             self.profiles_text.insert(tk.END, "Simulator not connected or charging profiles not initialized")
             self.profiles_text.config(state=tk.DISABLED)
+            self._profiles_display_key = None
             return
         
+        profiles_manager = self.simulator.charging_profiles_manager
+        
+        # Skip the rebuild if neither the profile store nor the displayed values changed
+        display_key = (
+            id(profiles_manager),
+            profiles_manager.profile_store_version,
+            tuple(tuple(limits.values()) for limits in profiles_manager.current_limits.values()),
+            tuple(
+                (vals.get("Power.Active.Import"), vals.get("Current.Import"))
+                for vals in getattr(getattr(self.simulator, 'meter_handler', None), 'meter_values', {}).values()
+            )
+        )
+        if display_key == getattr(self, '_profiles_display_key', None):
+            self._update_profiles_timestamp()
+            return
+        self._profiles_display_key = display_key
+        
         self.profiles_text.config(state=tk.NORMAL)
         self.profiles_text.delete(1.0, tk.END)
         
-        profiles_manager = self.simulator.charging_profiles_manager
         any_profiles = False
         
         # Display active profiles for each connector
@@ -699,11 +718,18 @@ class EVChargerSimulatorGUI:
             self.profiles_text.insert(tk.END, "The simulator is ready to receive SetChargingProfile requests from the server.\n")
             self.profiles_text.insert(tk.END, "When profiles are received, they will be displayed here and meter values will be adjusted automatically.")
         
-        # Add timestamp
+        self.profiles_text.insert(tk.END, "\n\n")
+        self.profiles_text.config(state=tk.DISABLED)
+        self._update_profiles_timestamp()
+    
+    def _update_profiles_timestamp(self):
+        """Rewrite the 'Last updated' line at the end of the profiles display"""
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.profiles_text.insert(tk.END, f"\n\n⏰ Last updated: {timestamp}")
         
+        self.profiles_text.config(state=tk.NORMAL)
+        self.profiles_text.delete("end-1c linestart", tk.END)
+        self.profiles_text.insert(tk.END, f"⏰ Last updated: {timestamp}")
         self.profiles_text.config(state=tk.DISABLED)
 
     def wait_window(self, window):
@@ -0,0 +1,121 @@
+# loop_monitor.py
+"""Event loop health: scheduling lag, ready-queue length, live tasks by kind and GC pauses
+
+Lag is how late a sleep of `interval` seconds wakes up. When it is high, the
+process itself is the bottleneck and CSMS latency measured in the same period
+includes local scheduling delay. Tasks are counted by the part of their name
+before the first ':' (charger, handler, heartbeat, keepalive, meter, outbound,
+offline-flush); unnamed tasks count as "other".
+"""
+
+import asyncio
+import gc
+import logging
+import time
+from collections import Counter as TallyCounter
+from typing import Dict, Optional
+
+from metrics import registry, log_linear_buckets
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "ocpp_event_loop_lag_seconds", "How late the event loop woke up from a timed sleep",
+    log_linear_buckets(0.0001, 10.0))
+LOOP_READY_QUEUE = registry.gauge(
+    "ocpp_event_loop_ready_callbacks", "Callbacks ready to run in the event loop (stock asyncio loop only)")
+LIVE_TASKS = registry.gauge(
+    "ocpp_event_loop_tasks", "Live asyncio tasks, by kind")
+GC_PAUSE_SECONDS = registry.histogram(
+    "ocpp_gc_pause_seconds", "Garbage collector pauses, by generation", log_linear_buckets(0.00001, 10.0))
+
+
+def task_kind(task: asyncio.Task) -> str:
+    """Kind of a task from its name prefix, e.g. handler:CP1:Reset -> handler"""
+    name = task.get_name()
+    return name.split(":", 1)[0] if ":" in name else "other"
+
+
+class LoopMonitor:
+    """Samples the running event loop every interval seconds.
+
+    max_lag and lagged_samples cover the period since the last reset(), so a
+    benchmark can reset before its scenario and check valid() afterwards.
+    """
+
+    def __init__(self, interval: float = 0.5, lag_threshold: float = 0.1, task_interval: float = 5.0):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.task_interval = task_interval  # Counting tasks walks all of them, so it runs less often
+        self.task: Optional[asyncio.Task] = None
+        self.task_counts: Dict[str, int] = {}
+        self.max_lag = 0.0
+        self.lagged_samples = 0
+        self.samples = 0
+        self.gc_started: Optional[float] = None
+
+    def start(self):
+        """Start sampling the running loop and timing GC pauses"""
+        if self.task is None:
+            gc.callbacks.append(self._on_gc)
+            self.task = asyncio.create_task(self._sample(), name="loop-monitor")
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    def reset(self):
+        """Start a new measurement period"""
+        self.max_lag = 0.0
+        self.lagged_samples = 0
+        self.samples = 0
+
+    def valid(self) -> bool:
+        """Whether local lag stayed under the threshold during the period"""
+        return self.max_lag <= self.lag_threshold
+
+    def summary(self) -> str:
+        return (f"max loop lag {self.max_lag * 1000:.1f} ms, "
+                f"{self.lagged_samples}/{self.samples} samples over {self.lag_threshold * 1000:.0f} ms")
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        next_task_count = loop.time()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(0.0, now - expected)
+
+            LOOP_LAG_SECONDS.observe(lag)
+            self.samples += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > self.lag_threshold:
+                self.lagged_samples += 1
+
+            # Private attribute of the stock loop; uvloop has no equivalent
+            ready = getattr(loop, "_ready", None)
+            if ready is not None:
+                LOOP_READY_QUEUE.set(len(ready))
+
+            if now >= next_task_count:
+                next_task_count = now + self.task_interval
+                self._count_tasks(loop)
+
+    def _count_tasks(self, loop: asyncio.AbstractEventLoop):
+        counts = TallyCounter(task_kind(task) for task in asyncio.all_tasks(loop))
+        for kind in set(self.task_counts) | set(counts):
+            LIVE_TASKS.set(counts.get(kind, 0), labels={"kind": kind})
+        self.task_counts = dict(counts)
+
+    def _on_gc(self, phase: str, info: Dict[str, int]):
+        if phase == "start":
+            self.gc_started = time.perf_counter()
+        elif self.gc_started is not None:
+            GC_PAUSE_SECONDS.observe(time.perf_counter() - self.gc_started,
+                                     labels={"generation": str(info.get("generation", ""))})
+            self.gc_started = None
@@ -2,8 +2,6 @@
 """Main entry point for EV Charger Simulator"""
 
 import sys
-import tkinter as tk
-from gui_main import EVChargerSimulatorGUI
 
 
 def main():
@@ -13,11 +11,27 @@ def main():
         # CLI mode
         print("CLI mode not implemented yet. Please run without arguments for GUI mode.")
         sys.exit(1)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--fleet":
+        # Headless fleet mode: python main.py --fleet fleet.yaml [--rate N]
+        from fleet_runner import main as fleet_main
+        fleet_main(sys.argv[2:])
     else:
-        # GUI mode (default) to new
+        # GUI mode (default) to new: python main.py [--loop asyncio|uvloop|auto]
+        from event_loop import LOOP_CHOICES
+        
+        loop_name = "asyncio"
+        if "--loop" in sys.argv[1:]:
+            loop_index = sys.argv.index("--loop") + 1
+            loop_name = sys.argv[loop_index] if loop_index < len(sys.argv) else ""
+            if loop_name not in LOOP_CHOICES:
+                print(f"--loop must be one of: {', '.join(LOOP_CHOICES)}")
+                sys.exit(2)
+        
+        import tkinter as tk
+        from gui_main import EVChargerSimulatorGUI
     
         root = tk.Tk()
-        app = EVChargerSimulatorGUI(root)
+        app = EVChargerSimulatorGUI(root, loop_name)
         root.mainloop()
 
 
@@ -50,30 +50,35 @@ class MessageHandlers:
         self.simulator.log(f"GetConfiguration received: {payload}")
         
         requested_keys = payload.get("key", [])
+        config_manager = self.simulator.config_manager
+        
+        # GetConfigurationMaxKeys caps how many keys one request may ask for
+        max_keys = config_manager.get_int_value("GetConfigurationMaxKeys", 0)
+        if max_keys and len(requested_keys) > max_keys:
+            await self.simulator.send_call_error(message_id, "OccurenceConstraintViolation",
+                                                 f"At most {max_keys} keys may be requested")
+            return
+        
+        if not requested_keys:
+            # Return all keys, reusing the pre-encoded response until a key changes
+            await self.simulator.send_call_result_raw(message_id, config_manager.get_full_configuration_json())
+            self.simulator.log(f"Sent {len(config_manager.configuration_keys)} configuration keys")
+            return
         
         configuration_keys = []
         unknown_keys = []
         
-        if not requested_keys:
-            # Return all keys
-            for config_key in self.simulator.config_manager.configuration_keys.values():
+        # Return only requested keys
+        for key_name in requested_keys:
+            if key_name in config_manager.configuration_keys:
+                config_key = config_manager.configuration_keys[key_name]
                 configuration_keys.append({
                     "key": config_key.key,
                     "readonly": config_key.readonly,
                     "value": config_key.value
                 })
-        else:
-            # Return only requested keys
-            for key_name in requested_keys:
-                if key_name in self.simulator.config_manager.configuration_keys:
-                    config_key = self.simulator.config_manager.configuration_keys[key_name]
-                    configuration_keys.append({
-                        "key": config_key.key,
-                        "readonly": config_key.readonly,
-                        "value": config_key.value
-                    })
-                else:
-                    unknown_keys.append(key_name)
+            else:
+                unknown_keys.append(key_name)
         
         response = {
             "configurationKey": configuration_keys
@@ -97,7 +102,7 @@ class MessageHandlers:
             return
         
         # Update configuration
-        status = self.simulator.config_manager.update_configuration_key(key, value)
+        status = self.simulator.update_configuration_key(key, value)
         await self.simulator.send_call_result(message_id, {"status": status})
     
     async def handle_clear_cache(self, message_id: str, payload: dict):
@@ -140,6 +145,8 @@ class MessageHandlers:
             status = self.simulator.charging_profiles_manager.handle_set_charging_profile(
                 connector_id, cs_charging_profiles
             )
+            if status == "Accepted":
+                self.simulator.persist_charging_profiles()
         else:
             status = "NotSupported"
             self.simulator.log("Charging profiles manager not initialized", "ERROR")
@@ -152,6 +159,8 @@ class MessageHandlers:
         
         if hasattr(self.simulator, 'charging_profiles_manager'):
             status = self.simulator.charging_profiles_manager.handle_clear_charging_profile(payload)
+            if status == "Accepted":
+                self.simulator.persist_charging_profiles()
         else:
             status = "Unknown"
             self.simulator.log("Charging profiles manager not initialized", "ERROR")
@@ -1,10 +1,11 @@
 # meter_values.py
 """OCPP 1.6 Meter Values Handling"""
 
-from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set
 import asyncio
 from ocpp_enums import OCPPAction, ChargerStatus
+from configuration_keys import wait_for_change
+from clock import clock
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,19 +18,42 @@ class MeterValuesHandler:
         self.simulator = simulator
         self.meter_values: Dict[int, Dict[str, float]] = {}
         
+        # Sampling configuration, kept current by a configuration subscription
+        config_manager = self.simulator.config_manager
+        self.sample_interval = config_manager.get_int_value("MeterValueSampleInterval", 60)
+        self.sampled_measurands = config_manager.get_list_value("MeterValuesSampledData", ("Energy.Active.Import.Register",))
+        
+        # One event per running loop, set when a sampling key changes
+        self.config_wakeups: Set[asyncio.Event] = set()
+        config_manager.subscribe(("MeterValueSampleInterval", "MeterValuesSampledData"), self._on_sampling_config_changed)
+    
+    def _on_sampling_config_changed(self, key: str, value: Any):
+        """Pick up a changed sampling key and wake the running loops"""
+        if key == "MeterValueSampleInterval":
+            self.sample_interval = value if value is not None else 60
+        else:
+            self.sampled_measurands = value or ()
+        
+        for wakeup in self.config_wakeups:
+            wakeup.set()
+        
     def initialize_connector(self, connector_id: int):
         """Initialize meter values for a connector"""
         # Get max power from simulator or default to 22kW
         max_power = getattr(self.simulator, 'max_power', 22000)
         max_current = max_power / 230.0  # Assuming single phase 230V
         
+        # The EV model from a fleet spec, if any, caps the power drawn and sets the starting SoC
+        ev_model = getattr(self.simulator, 'ev_model', None) or {}
+        drawn_power = min(max_power, ev_model.get('max_power', max_power))
+        
         self.meter_values[connector_id] = {
             "Energy.Active.Import.Register": 0,
-            "Power.Active.Import": max_power,  # Use charger's max power
-            "Current.Import": max_current,  # Calculate from max power
+            "Power.Active.Import": drawn_power,  # Charger's max power, limited by the EV
+            "Current.Import": drawn_power / 230.0,  # Calculate from drawn power
             "Voltage": 230.0,  # Default 230V
             "Temperature": 25.0,  # Default 25°C
-            "SoC": 50,  # Default 50% State of Charge
+            "SoC": ev_model.get('initial_soc', 50),  # Default 50% State of Charge
             "Power.Offered": max_power,  # Maximum power offered
             "Current.Offered": max_current,  # Maximum current offered
             "Energy.Reactive.Import.Register": 0,
@@ -46,7 +70,7 @@ class MeterValuesHandler:
     async def send_meter_values_loop(self, connector_id: int, transaction_id: int):
         """Send periodic meter values during charging"""
         # Get the meter value sample interval from configuration
-        sample_interval = self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60)
+        sample_interval = self.sample_interval
         
         # If interval is 0, don't send any meter values
         if sample_interval == 0:
@@ -54,8 +78,7 @@ class MeterValuesHandler:
             return
         
         # Get the measurands to sample from configuration
-        sampled_data_config = self.simulator.config_manager.get_value("MeterValuesSampledData", "Energy.Active.Import.Register")
-        measurands = [m.strip() for m in sampled_data_config.split(",") if m.strip()]
+        measurands = self.sampled_measurands
         
         self.simulator.log(f"Starting meter values loop for connector {connector_id} with interval {sample_interval}s, measurands: {measurands}")
         
@@ -63,64 +86,72 @@ class MeterValuesHandler:
         if connector_id not in self.meter_values:
             self.initialize_connector(connector_id)
         
-        while (self.simulator.connector_transactions.get(connector_id) == transaction_id and 
-               self.simulator.connector_status.get(connector_id) == ChargerStatus.CHARGING):
-            await asyncio.sleep(sample_interval)
-            
-            # Check if still charging after sleep
-            if (self.simulator.connector_transactions.get(connector_id) != transaction_id or
-                self.simulator.connector_status.get(connector_id) != ChargerStatus.CHARGING):
-                break
-            
-            # Check if interval changed
-            new_interval = self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60)
-            if new_interval != sample_interval:
-                self.simulator.log(f"MeterValueSampleInterval changed from {sample_interval} to {new_interval}")
-                sample_interval = new_interval
-                if sample_interval == 0:
-                    self.simulator.log(f"MeterValueSampleInterval is 0, stopping meter values for connector {connector_id}")
-                    return
-            
-            # Get current measurands (may have changed)
-            sampled_data_config = self.simulator.config_manager.get_value("MeterValuesSampledData", "Energy.Active.Import.Register")
-            measurands = [m.strip() for m in sampled_data_config.split(",") if m.strip()]
-            
-            # Prepare sampled values
-            sampled_values = self._generate_sampled_values(connector_id, measurands, "Sample.Periodic")
-            
-            # Only send if we have values to send
-            if sampled_values:
-                payload = {
-                    "connectorId": connector_id,
-                    "transactionId": transaction_id,
-                    "meterValue": [{
-                        "timestamp": datetime.utcnow().isoformat() + "Z",
-                        "sampledValue": sampled_values
-                    }]
-                }
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.config_wakeups.add(wakeup)
+        next_sample = loop.time() + sample_interval
+        try:
+            while (self.simulator.connector_transactions.get(connector_id) == transaction_id and 
+                   self.simulator.connector_status.get(connector_id) == ChargerStatus.CHARGING):
+                if await wait_for_change(wakeup, next_sample - loop.time()):
+                    # Interval changed: apply it right away instead of at the next sample
+                    if self.sample_interval != sample_interval:
+                        self.simulator.log(f"MeterValueSampleInterval changed from {sample_interval} to {self.sample_interval}")
+                        sample_interval = self.sample_interval
+                        if sample_interval == 0:
+                            self.simulator.log(f"MeterValueSampleInterval is 0, stopping meter values for connector {connector_id}")
+                            break
+                        next_sample = loop.time() + sample_interval
+                    continue
+                
+                # A transaction started offline keeps sampling once it gets its real ID
+                current_transaction_id = self.simulator.connector_transactions.get(connector_id)
+                if transaction_id < 0 and current_transaction_id is not None and current_transaction_id > 0:
+                    transaction_id = current_transaction_id
                 
-                try:
-                    await self.simulator.send_call(OCPPAction.METER_VALUES.value, payload)
-                    self.simulator.log(f"Meter values sent for connector {connector_id}: {len(sampled_values)} measurands")
-                except Exception as e:
-                    self.simulator.log(f"Error sending meter values: {e}", "ERROR")
+                # Check if still charging after sleep
+                if (current_transaction_id != transaction_id or
+                    self.simulator.connector_status.get(connector_id) != ChargerStatus.CHARGING):
                     break
+                
+                # Prepare sampled values (measurands may have changed)
+                sampled_values = self._generate_sampled_values(connector_id, self.sampled_measurands, "Sample.Periodic")
+                next_sample = loop.time() + sample_interval
+                
+                # Only send if we have values to send
+                if sampled_values:
+                    payload = {
+                        "connectorId": connector_id,
+                        "transactionId": transaction_id,
+                        "meterValue": [{
+                            "timestamp": clock.timestamp(),
+                            "sampledValue": sampled_values
+                        }]
+                    }
+                    
+                    try:
+                        # Queued instead of lost while the charger is offline
+                        await self.simulator.send_transaction_call(OCPPAction.METER_VALUES.value, payload)
+                        self.simulator.log(f"Meter values sent for connector {connector_id}: {len(sampled_values)} measurands")
+                    except Exception as e:
+                        self.simulator.log(f"Error sending meter values: {e}", "ERROR")
+                        break
+        finally:
+            self.config_wakeups.discard(wakeup)
     
     async def send_grid_meter_values_loop(self):
         """Send periodic meter values for connector 0 (grid connection) if configured"""
         # Get the meter value sample interval from configuration
-        sample_interval = self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60)
+        sample_interval = self.sample_interval
         
         # If interval is 0, don't send any meter values
         if sample_interval == 0:
             return
         
         # Get the measurands to sample from configuration
-        sampled_data_config = self.simulator.config_manager.get_value("MeterValuesSampledData", "")
-        if not sampled_data_config:
+        measurands = self.sampled_measurands
+        if not measurands:
             return
-            
-        measurands = [m.strip() for m in sampled_data_config.split(",") if m.strip()]
         
         # Check if any measurands should be reported on the Inlet (grid connection)
         inlet_measurands = []
@@ -135,50 +166,58 @@ class MeterValuesHandler:
         
         self.simulator.log(f"Starting grid meter values loop (connector 0) with interval {sample_interval}s, measurands: {inlet_measurands}")
         
-        while self.simulator.is_connected and self.simulator.boot_notification_accepted:
-            await asyncio.sleep(sample_interval)
-            
-            if not self.simulator.is_connected:
-                break
-            
-            # Check if interval changed
-            new_interval = self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60)
-            if new_interval != sample_interval:
-                sample_interval = new_interval
-                if sample_interval == 0:
-                    return
-            
-            # Re-check measurands in case configuration changed
-            sampled_data_config = self.simulator.config_manager.get_value("MeterValuesSampledData", "")
-            if sampled_data_config:
-                measurands = [m.strip() for m in sampled_data_config.split(",") if m.strip()]
-                inlet_measurands = [m for m in measurands if m in ["Power.Active.Import", "Current.Import", "Voltage", 
-                                                                   "Power.Factor", "Frequency", "Power.Reactive.Import", 
-                                                                   "Energy.Active.Import.Register", "Energy.Reactive.Import.Register"]]
-            
-            # Prepare sampled values for grid connection
-            sampled_values = self._generate_grid_sampled_values(inlet_measurands)
-            
-            # Only send if we have values to send
-            if sampled_values:
-                payload = {
-                    "connectorId": 0,  # Connector 0 represents the grid connection
-                    "meterValue": [{
-                        "timestamp": datetime.utcnow().isoformat() + "Z",
-                        "sampledValue": sampled_values
-                    }]
-                }
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.config_wakeups.add(wakeup)
+        next_sample = loop.time() + sample_interval
+        try:
+            while self.simulator.is_connected and self.simulator.boot_notification_accepted:
+                if await wait_for_change(wakeup, next_sample - loop.time()):
+                    # Interval changed: apply it right away instead of at the next sample
+                    if self.sample_interval != sample_interval:
+                        sample_interval = self.sample_interval
+                        if sample_interval == 0:
+                            break
+                        next_sample = loop.time() + sample_interval
+                    continue
+                
+                if not self.simulator.is_connected:
+                    break
+                next_sample = loop.time() + sample_interval
+                
+                # Re-check measurands in case configuration changed
+                measurands = self.sampled_measurands
+                if measurands:
+                    inlet_measurands = [m for m in measurands if m in ["Power.Active.Import", "Current.Import", "Voltage", 
+                                                                       "Power.Factor", "Frequency", "Power.Reactive.Import", 
+                                                                       "Energy.Active.Import.Register", "Energy.Reactive.Import.Register"]]
+                
+                # Prepare sampled values for grid connection
+                sampled_values = self._generate_grid_sampled_values(inlet_measurands)
                 
-                try:
-                    await self.simulator.send_call(OCPPAction.METER_VALUES.value, payload)
-                    self.simulator.log(f"Grid meter values sent (connector 0): {len(sampled_values)} measurands")
-                except Exception as e:
-                    self.simulator.log(f"Error sending grid meter values: {e}", "ERROR")
+                # Only send if we have values to send
+                if sampled_values:
+                    payload = {
+                        "connectorId": 0,  # Connector 0 represents the grid connection
+                        "meterValue": [{
+                            "timestamp": clock.timestamp(),
+                            "sampledValue": sampled_values
+                        }]
+                    }
+                    
+                    try:
+                        await self.simulator.send_call(OCPPAction.METER_VALUES.value, payload)
+                        self.simulator.log(f"Grid meter values sent (connector 0): {len(sampled_values)} measurands")
+                    except Exception as e:
+                        self.simulator.log(f"Error sending grid meter values: {e}", "ERROR")
+        finally:
+            self.config_wakeups.discard(wakeup)
     
     def _generate_sampled_values(self, connector_id: int, measurands: List[str], context: str) -> List[Dict[str, Any]]:
         """Generate sampled values for given measurands"""
         sampled_values = []
         meter_vals = self.meter_values.get(connector_id, {})
+        sample_interval = self.sample_interval
         
         # Get current limits from charging profile handler if available
         current_limits = {"power": None, "current": None}
@@ -193,7 +232,6 @@ class MeterValuesHandler:
                     actual_power = min(actual_power, current_limits["power"])
                 
                 # Energy increment based on actual power and sample interval
-                sample_interval = self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60)
                 energy_increment = (actual_power * sample_interval) / 3600  # Convert to Wh
                 
                 meter_vals[measurand] = meter_vals.get(measurand, 0) + energy_increment
@@ -230,7 +268,7 @@ class MeterValuesHandler:
                 # Simulate State of Charge increasing during charging
                 current_soc = meter_vals.get("SoC", 50)
                 # Increase SoC gradually (0.1% per minute at 60s interval)
-                if sample_interval := self.simulator.config_manager.get_int_value("MeterValueSampleInterval", 60):
+                if sample_interval:
                     soc_increment = 0.1 * (sample_interval / 60)
                     new_soc = min(100, current_soc + soc_increment)
                     meter_vals["SoC"] = new_soc
@@ -444,8 +482,7 @@ class MeterValuesHandler:
     def get_stop_transaction_values(self, connector_id: int) -> List[Dict[str, Any]]:
         """Get meter values for stop transaction"""
         # Get the measurands to include in stop transaction
-        stop_txn_data_config = self.simulator.config_manager.get_value("StopTxnSampledData", "Energy.Active.Import.Register")
-        measurands = [m.strip() for m in stop_txn_data_config.split(",") if m.strip()]
+        measurands = list(self.simulator.config_manager.get_list_value("StopTxnSampledData", ("Energy.Active.Import.Register",)))
         
         # Generate sampled values with Transaction.End context
         return self._generate_sampled_values(connector_id, measurands, "Transaction.End")
@@ -0,0 +1,250 @@
+# metrics.py
+"""In-process metrics shared by every simulator in the process"""
+
+import bisect
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Default histogram buckets in seconds (upper bounds)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+# Label that splits a metric by charger; dropped when series are aggregated over the fleet
+CHARGER_LABEL = "charge_point"
+
+
+def log_linear_buckets(lowest: float, highest: float, steps_per_decade: int = 10) -> Tuple[float, ...]:
+    """Exponential bucket bounds with a fixed relative precision (HDR-style), rounded to 3 significant digits"""
+    buckets = []
+    step = 0
+    while True:
+        bound = lowest * 10 ** (step / steps_per_decade)
+        bound = round(bound, 2 - int(math.floor(math.log10(bound))))
+        if not buckets or bound > buckets[-1]:
+            buckets.append(bound)
+        if bound >= highest:
+            return tuple(buckets)
+        step += 1
+
+
+# Request/response latency: 0.5 ms to 60 s at about 26% relative precision
+LATENCY_BUCKETS = log_linear_buckets(0.0005, 60.0)
+
+
+def _label_values(labels: Optional[Dict[str, str]]) -> LabelValues:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class HistogramSeries:
+    """Bucket counts, sum and count of one histogram label set"""
+    __slots__ = ("bucket_counts", "count", "sum", "max")
+
+    def __init__(self, bucket_count: int):
+        self.bucket_counts = [0] * (bucket_count + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def copy(self) -> "HistogramSeries":
+        series = HistogramSeries(len(self.bucket_counts) - 1)
+        series.merge(self)
+        return series
+
+    def merge(self, other: "HistogramSeries"):
+        """Add another series with the same buckets into this one"""
+        for index, bucket_count in enumerate(other.bucket_counts):
+            self.bucket_counts[index] += bucket_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+
+
+class Histogram:
+    """Histogram with fixed buckets, optionally split by labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[LabelValues, HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None):
+        """Record one observation"""
+        label_values = _label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = HistogramSeries(len(self.buckets))
+            series.bucket_counts[index] += 1
+            series.count += 1
+            series.sum += value
+            if value > series.max:
+                series.max = value
+
+    def snapshot(self) -> Dict[LabelValues, HistogramSeries]:
+        """Consistent copy of every series, safe to read from another thread"""
+        with self._lock:
+            return {label_values: series.copy() for label_values, series in self.series.items()}
+
+    def quantile(self, q: float, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        """Estimate a quantile (0..1) as the upper bound of the bucket that contains it"""
+        series = self.series.get(_label_values(labels))
+        if series is None or series.count == 0:
+            return None
+
+        rank = q * series.count
+        seen = 0
+        for index, bucket_count in enumerate(series.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else series.max
+        return series.max
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: Optional[Dict[str, str]] = None):
+        """Add amount to the counter"""
+        label_values = _label_values(labels)
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        return self.values.get(_label_values(labels), 0)
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self.values)
+
+
+class Gauge:
+    """Value that goes up and down, optionally split by labels"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, labels: Optional[Dict[str, str]] = None):
+        with self._lock:
+            self.values[_label_values(labels)] = value
+
+    def inc(self, amount: float = 1, labels: Optional[Dict[str, str]] = None):
+        label_values = _label_values(labels)
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, amount: float = 1, labels: Optional[Dict[str, str]] = None):
+        self.inc(-amount, labels)
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        return self.values.get(_label_values(labels), 0)
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self.values)
+
+
+class MetricsRegistry:
+    """Named metrics; asking for an existing name returns the same metric"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.per_charger_labels = False  # Simulators add a charge_point label to their observations
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help_text, buckets)
+            return self.metrics[name]
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, help_text)
+            return self.metrics[name]
+
+    def gauge(self, name: str, help_text: str = "") -> Gauge:
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Gauge(name, help_text)
+            return self.metrics[name]
+
+    def all_metrics(self) -> List[object]:
+        with self._lock:
+            return list(self.metrics.values())
+
+
+def _without_charger_label(label_values: LabelValues) -> LabelValues:
+    return tuple((name, value) for name, value in label_values if name != CHARGER_LABEL)
+
+
+def _format_labels(label_values: LabelValues, extra: str = "") -> str:
+    parts = []
+    for name, value in label_values:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_prometheus(metrics_registry: "MetricsRegistry", per_charger: bool = False) -> str:
+    """All metrics in the Prometheus text exposition format. Unless per_charger is set,
+    series that differ only in their charge_point label are merged into one fleet series"""
+    lines = []
+    for metric in metrics_registry.all_metrics():
+        snapshot = metric.snapshot()
+        if not per_charger:
+            merged: Dict[LabelValues, object] = {}
+            for label_values, value in snapshot.items():
+                fleet_label_values = _without_charger_label(label_values)
+                if isinstance(metric, Histogram):
+                    if fleet_label_values in merged:
+                        merged[fleet_label_values].merge(value)
+                    else:
+                        merged[fleet_label_values] = value
+                else:
+                    merged[fleet_label_values] = merged.get(fleet_label_values, 0) + value
+            snapshot = merged
+
+        metric_type = "histogram" if isinstance(metric, Histogram) else "counter" if isinstance(metric, Counter) else "gauge"
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric_type}")
+        for label_values in sorted(snapshot):
+            value = snapshot[label_values]
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (math.inf,), value.bucket_counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_number(bound)}"'
+                    lines.append(f"{metric.name}_bucket{_format_labels(label_values, le)} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(label_values)} {_format_number(value.sum)}")
+                lines.append(f"{metric.name}_count{_format_labels(label_values)} {value.count}")
+            else:
+                lines.append(f"{metric.name}{_format_labels(label_values)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the simulators
+registry = MetricsRegistry()
@@ -0,0 +1,50 @@
+# metrics_server.py
+"""Local HTTP endpoint serving the metrics registry in Prometheus text format
+
+GET /metrics                 fleet-wide series (charge_point label merged away)
+GET /metrics?per_charger=1   series split by charger, if simulators record the label
+"""
+
+import logging
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import registry, render_prometheus
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves /metrics; anything else is 404"""
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/metrics":
+            self.send_error(404)
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        per_charger = query.get("per_charger", ["0"])[0].lower() in ("1", "true", "yes")
+        body = render_prometheus(registry, per_charger).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve metrics from a daemon thread; call shutdown() on the result to stop"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,163 @@
+# offline_queue.py
+"""Transaction messages held while the charger is offline and replayed after reconnecting"""
+
+import asyncio
+import random
+from collections import deque
+from typing import Deque, Dict, Any, Optional
+
+# CALLs that must reach the Central System even if they were produced offline
+TRANSACTION_ACTIONS = ("StartTransaction", "StopTransaction", "MeterValues")
+
+
+class OfflineMessageQueue:
+    """Ordered queue of transaction CALLs for one charger.
+
+    Messages are replayed oldest first after BootNotification is accepted,
+    paced to flush_rate messages per second after a random start delay of up to
+    flush_jitter seconds, so a reconnecting fleet does not send its whole
+    backlog at once. A message the Central System rejects (CALLERROR or
+    timeout) is retried up to TransactionMessageAttempts times, waiting
+    TransactionMessageRetryInterval * attempt seconds in between.
+
+    At most max_messages are held. When the queue is full, new MeterValues are
+    dropped; a StartTransaction or StopTransaction takes the place of the
+    oldest queued MeterValues, or is kept over the limit (with a warning) if
+    there is none, since losing it would break the transaction.
+
+    A transaction started offline gets a negative placeholder ID. Once its
+    StartTransaction is delivered, queued messages and the connector are
+    switched to the real transaction ID. If it is given up instead, the queued
+    messages of that transaction are dropped and the connector is cleared.
+    """
+
+    def __init__(self, simulator, max_messages: int = 1000, flush_rate: float = 2.0, flush_jitter: float = 5.0):
+        self.simulator = simulator
+        self.max_messages = max_messages
+        self.flush_rate = flush_rate
+        self.flush_jitter = flush_jitter
+        self.messages: Deque[Dict[str, Any]] = deque()
+        self.next_sequence = 1
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def _persist(self, message: Dict[str, Any]):
+        if self.simulator.state_store is not None and self.simulator.state_restored:
+            self.simulator.state_store.save_offline_message(self.simulator.charge_point_id, message)
+
+    def _forget(self, message: Dict[str, Any]):
+        if self.simulator.state_store is not None and self.simulator.state_restored:
+            self.simulator.state_store.delete_offline_message(self.simulator.charge_point_id, message["sequence"])
+
+    def restore(self, saved_messages):
+        """Put messages saved before a restart ahead of anything queued since"""
+        queued_since = list(self.messages)
+        self.messages = deque(saved_messages)
+        self.next_sequence = max([0] + [message["sequence"] for message in saved_messages]) + 1
+        for message in queued_since:
+            message["sequence"] = self.next_sequence
+            self.next_sequence += 1
+            self.messages.append(message)
+            self._persist(message)
+
+    def next_placeholder_transaction_id(self) -> int:
+        """A negative transaction ID not used by any queued message or running transaction"""
+        used = [message["placeholder"] for message in self.messages if message.get("placeholder")]
+        used += list(self.simulator.transaction_connectors)
+        return min([0] + used) - 1
+
+    def placeholder_of(self, payload: Dict[str, Any]) -> Optional[int]:
+        """Placeholder transaction ID of the queued StartTransaction with this payload"""
+        for message in reversed(self.messages):
+            if message["payload"] is payload:
+                return message.get("placeholder")
+        return None
+
+    def enqueue(self, action: str, payload: Dict[str, Any], placeholder: Optional[int] = None) -> bool:
+        """Queue a CALL for later delivery. Returns False if it had to be dropped"""
+        if len(self.messages) >= self.max_messages:
+            if action == "MeterValues":
+                self.simulator.log(f"Offline queue full ({self.max_messages} messages), dropping MeterValues", "WARNING")
+                return False
+            oldest_meter_values = next((message for message in self.messages if message["action"] == "MeterValues"), None)
+            if oldest_meter_values is not None:
+                self.messages.remove(oldest_meter_values)
+                self._forget(oldest_meter_values)
+                self.simulator.log(f"Offline queue full ({self.max_messages} messages), "
+                                   f"dropped the oldest MeterValues to keep {action}", "WARNING")
+            else:
+                self.simulator.log(f"Offline queue over its limit of {self.max_messages} messages, "
+                                   f"keeping {action} ({len(self.messages) + 1} messages)", "WARNING")
+
+        message = {"sequence": self.next_sequence, "action": action, "payload": payload, "placeholder": placeholder}
+        self.next_sequence += 1
+        self.messages.append(message)
+        self._persist(message)
+        self.simulator.log(f"{action} queued offline ({len(self.messages)} messages waiting)")
+        return True
+
+    def start_flush(self):
+        """Start replaying queued messages unless a replay is already running"""
+        if self.messages and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush(), name=f"offline-flush:{self.simulator.charge_point_id}")
+
+    async def flush(self):
+        """Replay queued messages in order until the queue is empty or the connection drops"""
+        config_manager = self.simulator.config_manager
+        await asyncio.sleep(random.uniform(0, self.flush_jitter))
+        self.simulator.log(f"Replaying {len(self.messages)} offline messages")
+
+        while self.messages and self.simulator.is_connected:
+            message = self.messages[0]
+            max_attempts = max(1, config_manager.get_int_value("TransactionMessageAttempts", 3))
+            retry_interval = config_manager.get_int_value("TransactionMessageRetryInterval", 10)
+
+            response = None
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    response = await self.simulator.send_call(message["action"], message["payload"])
+                    break
+                except Exception as e:
+                    if not self.simulator.is_connected:
+                        self.simulator.log("Connection lost while replaying offline messages", "WARNING")
+                        return
+                    if attempt == max_attempts:
+                        self.simulator.log(f"Giving up on offline {message['action']} after {attempt} attempts: {e}", "ERROR")
+                    else:
+                        await asyncio.sleep(retry_interval * attempt)
+
+            # Usually still first; a full queue may have dropped it to make room meanwhile
+            if self.messages and self.messages[0] is message:
+                self.messages.popleft()
+                self._forget(message)
+            if message.get("placeholder"):
+                transaction_id = response.get("transactionId") if response is not None else None
+                if transaction_id is None:
+                    self._drop_transaction(message["placeholder"])
+                else:
+                    self._assign_transaction_id(message["placeholder"], transaction_id)
+
+            if self.flush_rate > 0:
+                await asyncio.sleep(1.0 / self.flush_rate)
+
+    def _assign_transaction_id(self, placeholder: int, transaction_id: int):
+        """Switch queued messages and the connector from a placeholder to the real transaction ID"""
+        for message in self.messages:
+            if message["payload"].get("transactionId") == placeholder:
+                message["payload"]["transactionId"] = transaction_id
+                self._persist(message)
+
+        self.simulator.replace_transaction_id(placeholder, transaction_id)
+
+    def _drop_transaction(self, placeholder: int):
+        """Discard queued messages of a transaction whose StartTransaction was given up"""
+        dropped = [message for message in self.messages if message["payload"].get("transactionId") == placeholder]
+        for message in dropped:
+            self.messages.remove(message)
+            self._forget(message)
+        if dropped:
+            self.simulator.log(f"Dropped {len(dropped)} offline messages of transaction {placeholder}", "WARNING")
+
+        self.simulator.abandon_transaction(placeholder)
@@ -0,0 +1,109 @@
+# outbound_queue.py
+"""Per-connection outbound frame queue with priority classes"""
+
+import asyncio
+import itertools
+import time
+from typing import Optional
+
+from metrics import registry
+
+# Priority classes, lowest number is written first
+PRIORITY_RESPONSE = 0      # CALLRESULT / CALLERROR
+PRIORITY_TRANSACTION = 1   # Transaction flow CALLs
+PRIORITY_STATUS = 2        # StatusNotification and anything not listed
+PRIORITY_BULK = 3          # MeterValues, Heartbeat
+
+PRIORITY_NAMES = {
+    PRIORITY_RESPONSE: "response",
+    PRIORITY_TRANSACTION: "transaction",
+    PRIORITY_STATUS: "status",
+    PRIORITY_BULK: "bulk",
+}
+
+ACTION_PRIORITIES = {
+    "BootNotification": PRIORITY_TRANSACTION,
+    "Authorize": PRIORITY_TRANSACTION,
+    "StartTransaction": PRIORITY_TRANSACTION,
+    "StopTransaction": PRIORITY_TRANSACTION,
+    "StatusNotification": PRIORITY_STATUS,
+    "MeterValues": PRIORITY_BULK,
+    "Heartbeat": PRIORITY_BULK,
+}
+
+QUEUE_DEPTH = registry.gauge(
+    "ocpp_outbound_queue_depth", "Frames waiting to be written, by priority class")
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "ocpp_outbound_queue_wait_seconds", "Time frames waited in the outbound queue, by priority class")
+
+
+def call_priority(action: str) -> int:
+    """Priority class of an outgoing CALL"""
+    return ACTION_PRIORITIES.get(action, PRIORITY_STATUS)
+
+
+class OutboundQueue:
+    """Frames for one websocket, written in priority order by a single writer task.
+
+    Within a priority class frames keep the order they were queued in. send()
+    returns once its frame has been written, and raises if writing failed, so
+    callers see the same errors as with a direct websocket.send().
+    """
+
+    def __init__(self, websocket, name: str = ""):
+        self.websocket = websocket
+        self.name = name
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        """Start the writer task"""
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._writer(), name=f"outbound:{self.name}")
+
+    async def send(self, frame: str, priority: int = PRIORITY_STATUS):
+        """Queue a frame and wait until it has been written"""
+        if self.closed or self.writer_task is None:
+            raise ConnectionError("Outbound queue is closed")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.sequence), time.perf_counter(), frame, future))
+        QUEUE_DEPTH.inc(labels={"priority": PRIORITY_NAMES[priority]})
+        await future
+
+    async def _writer(self):
+        """Write queued frames one at a time"""
+        while True:
+            priority, _, queued_at, frame, future = await self.queue.get()
+            priority_name = PRIORITY_NAMES[priority]
+            QUEUE_DEPTH.dec(labels={"priority": priority_name})
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, labels={"priority": priority_name})
+
+            if future.done():
+                continue  # Sender was cancelled while waiting
+            try:
+                await self.websocket.send(frame)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed while the frame was being sent"))
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():  # Sender may have been cancelled during the send
+                    future.set_result(None)
+
+    def close(self):
+        """Stop the writer and fail frames still waiting"""
+        self.closed = True
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+
+        while not self.queue.empty():
+            priority, _, _, _, future = self.queue.get_nowait()
+            QUEUE_DEPTH.dec(labels={"priority": PRIORITY_NAMES[priority]})
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed before the frame was sent"))
@@ -39,6 +39,9 @@ class EVChargerSimulator:
         self.connector_transactions: Dict[int, Optional[int]] = {}
         self.connector_status: Dict[int, ChargerStatus] = {}
         
+        # Reverse index: transaction ID -> connector ID (kept in sync by _set_connector_transaction)
+        self.transaction_connectors: Dict[int, int] = {}
+        
         # Initialize connectors
         for i in range(1, self.number_of_connectors + 1):
             self.connector_status[i] = ChargerStatus.AVAILABLE
@@ -70,8 +73,7 @@ class EVChargerSimulator:
 
     def get_server_time(self) -> datetime:
         """Get current time synchronized with server"""
-        local_time = datetime.utcnow().replace(tzinfo=timezone.utc)
-        return local_time + self.server_time_offset
+        return clock.now()
 
     # Enhanced heartbeat_loop method with time synchronization
     async def heartbeat_loop(self):
@@ -100,6 +102,7 @@ class EVChargerSimulator:
                             adjusted_local_time = local_time_before.replace(tzinfo=timezone.utc) + network_delay
                             
                             self.server_time_offset = server_time - adjusted_local_time
+                            clock.set_server_offset(self.server_time_offset.total_seconds())
                             self.last_server_time = server_time
                             self.last_local_time = adjusted_local_time
                             
@@ -143,13 +146,13 @@ class EVChargerSimulator:
             "connectorId": connector_id,
             "idTag": id_tag,
             "meterStart": 0,
-            "timestamp": self.get_server_time().isoformat() + "Z"
+            "timestamp": clock.timestamp()
         }
         
         try:
             response = await self.send_call(OCPPAction.START_TRANSACTION.value, payload)
             transaction_id = response.get("transactionId")
-            self.connector_transactions[connector_id] = transaction_id
+            self._set_connector_transaction(connector_id, transaction_id)
             self.log(f"Transaction {transaction_id} started on connector {connector_id}")
             
             # Update status to Charging
@@ -162,11 +165,13 @@ class EVChargerSimulator:
                     self.log(f"Applying charging profile limits to transaction {transaction_id}", "INFO")
             
             # Start sending meter values with profile limits applied
-            asyncio.create_task(self.meter_handler.send_meter_values_loop(connector_id, transaction_id))
+            asyncio.create_task(self.meter_handler.send_meter_values_loop(connector_id, transaction_id),
+                                name=f"meter:{self.charge_point_id}:{connector_id}")
             
         except Exception as e:
             self.log(f"Error starting transaction: {e}", "ERROR")
             await self.send_status_notification(connector_id, ChargerStatus.AVAILABLE)
 
 # Add these imports at the top of the file
-from datetime import datetime, timedelta, timezone
\ No newline at end of file
+from datetime import datetime, timedelta, timezone
+from clock import clock
@@ -0,0 +1,226 @@
+# state_store.py
+"""Persistent charger state (charging profiles, configuration, transactions, offline messages)"""
+
+import json
+import queue
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Statements of one logical write: (sql, parameters) pairs applied together
+WriteOperation = List[Tuple[str, tuple]]
+
+# Queued writes committed in one transaction at most
+WRITE_BATCH = 500
+
+
+class StateStore:
+    """SQLite-backed snapshot of per-charger state for fast warm restarts.
+
+    One store (and one database connection) is shared by every simulator that
+    points at the same file. Rows are keyed by charge point ID and only the
+    rows of a single charger are read when that charger restores its state.
+
+    Writes never block the event loop: save_* methods queue their statements
+    and a writer thread commits everything queued so far in one transaction.
+    Reads first wait for queued writes, so they always see them; they block,
+    so simulators run them in an executor. Once closed, writes are ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self._writes: queue.Queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_queued, name="state-store", daemon=True)
+        self._writer.start()
+
+    def _submit(self, operation: WriteOperation):
+        if self._closed:
+            logger.warning(f"State store {self.path} is closed, write ignored")
+            return
+        self._writes.put(operation)
+
+    def _write_queued(self):
+        """Writer thread: commit queued operations in batches until close()"""
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with self._lock, self._connection:
+                    for operation in batch:
+                        for sql, parameters in operation or ():
+                            self._connection.execute(sql, parameters)
+            except Exception as e:
+                logger.error(f"State store write failed, {len(batch)} queued writes lost: {e}")
+
+            for _ in batch:
+                self._writes.task_done()
+            if None in batch:
+                return
+
+    def flush(self):
+        """Wait until every queued write is committed"""
+        if not self._closed:
+            self._writes.join()
+
+    def _create_tables(self):
+        """Create the snapshot tables if they do not exist yet"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS configuration ("
+                "charge_point_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (charge_point_id, key))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS charging_profiles ("
+                "charge_point_id TEXT NOT NULL, connector_id INTEGER NOT NULL, "
+                "position INTEGER NOT NULL, profile TEXT NOT NULL, "
+                "PRIMARY KEY (charge_point_id, connector_id, position))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS transactions ("
+                "charge_point_id TEXT NOT NULL, connector_id INTEGER NOT NULL, transaction_id INTEGER NOT NULL, "
+                "PRIMARY KEY (charge_point_id, connector_id))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS offline_messages ("
+                "charge_point_id TEXT NOT NULL, sequence INTEGER NOT NULL, action TEXT NOT NULL, "
+                "payload TEXT NOT NULL, placeholder INTEGER, PRIMARY KEY (charge_point_id, sequence))"
+            )
+
+    def load_charger(self, charge_point_id: str) -> Dict[str, Any]:
+        """Load the saved state of one charger"""
+        self.flush()
+        with self._lock:
+            configuration = dict(self._connection.execute(
+                "SELECT key, value FROM configuration WHERE charge_point_id = ?",
+                (charge_point_id,)
+            ).fetchall())
+
+            charging_profiles: Dict[int, List[Dict[str, Any]]] = {}
+            for connector_id, profile in self._connection.execute(
+                "SELECT connector_id, profile FROM charging_profiles WHERE charge_point_id = ? "
+                "ORDER BY connector_id, position",
+                (charge_point_id,)
+            ):
+                charging_profiles.setdefault(connector_id, []).append(json.loads(profile))
+
+            transactions = dict(self._connection.execute(
+                "SELECT connector_id, transaction_id FROM transactions WHERE charge_point_id = ?",
+                (charge_point_id,)
+            ).fetchall())
+
+        return {
+            "configuration": configuration,
+            "charging_profiles": charging_profiles,
+            "transactions": transactions
+        }
+
+    def save_configuration_key(self, charge_point_id: str, key: str, value: str):
+        """Save a changed configuration key value"""
+        self._submit([(
+            "INSERT OR REPLACE INTO configuration (charge_point_id, key, value) VALUES (?, ?, ?)",
+            (charge_point_id, key, value)
+        )])
+
+    def save_charging_profiles(self, charge_point_id: str, charging_profiles: Dict[int, List[Dict[str, Any]]]):
+        """Replace the saved charging profiles of a charger"""
+        operation: WriteOperation = [("DELETE FROM charging_profiles WHERE charge_point_id = ?", (charge_point_id,))]
+        operation += [
+            ("INSERT INTO charging_profiles (charge_point_id, connector_id, position, profile) VALUES (?, ?, ?, ?)",
+             (charge_point_id, connector_id, position, json.dumps(profile)))
+            for connector_id, profiles in charging_profiles.items()
+            for position, profile in enumerate(profiles)
+        ]
+        self._submit(operation)
+
+    def save_transaction(self, charge_point_id: str, connector_id: int, transaction_id: Optional[int]):
+        """Save (or clear, when transaction_id is None) the transaction on a connector"""
+        if transaction_id is None:
+            self._submit([(
+                "DELETE FROM transactions WHERE charge_point_id = ? AND connector_id = ?",
+                (charge_point_id, connector_id)
+            )])
+        else:
+            self._submit([(
+                "INSERT OR REPLACE INTO transactions (charge_point_id, connector_id, transaction_id) VALUES (?, ?, ?)",
+                (charge_point_id, connector_id, transaction_id)
+            )])
+
+    def load_offline_messages(self, charge_point_id: str) -> List[Dict[str, Any]]:
+        """Load the queued offline messages of a charger, oldest first"""
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT sequence, action, payload, placeholder FROM offline_messages "
+                "WHERE charge_point_id = ? ORDER BY sequence",
+                (charge_point_id,)
+            ).fetchall()
+        return [{"sequence": sequence, "action": action, "payload": json.loads(payload), "placeholder": placeholder}
+                for sequence, action, payload, placeholder in rows]
+
+    def save_offline_message(self, charge_point_id: str, message: Dict[str, Any]):
+        """Save (or update) a queued offline message (sequence, action, payload, placeholder)"""
+        self._submit([(
+            "INSERT OR REPLACE INTO offline_messages (charge_point_id, sequence, action, payload, placeholder) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (charge_point_id, message["sequence"], message["action"], json.dumps(message["payload"]),
+             message.get("placeholder"))
+        )])
+
+    def delete_offline_message(self, charge_point_id: str, sequence: int):
+        """Remove a queued offline message once it has been delivered or given up on"""
+        self._submit([(
+            "DELETE FROM offline_messages WHERE charge_point_id = ? AND sequence = ?",
+            (charge_point_id, sequence)
+        )])
+
+    def forget_charger(self, charge_point_id: str):
+        """Remove all saved state of a charger"""
+        self._submit([
+            (f"DELETE FROM {table} WHERE charge_point_id = ?", (charge_point_id,))
+            for table in ("configuration", "charging_profiles", "transactions", "offline_messages")
+        ])
+
+    def compact(self):
+        """Reclaim space left behind by deleted rows"""
+        self.flush()
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._connection.execute("VACUUM")
+
+    def close(self):
+        """Commit queued writes and close the database connection"""
+        if self._closed:
+            return
+        self._closed = True
+        self._writes.put(None)
+        self._writer.join()
+        with self._lock:
+            self._connection.close()
+
+
+_stores: Dict[str, StateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(path: str) -> StateStore:
+    """Get the shared state store for a database file"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = StateStore(path)
+            logger.info(f"Opened charger state store: {path}")
+        return _stores[path]
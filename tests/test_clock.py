@@ -0,0 +1,76 @@
+# tests/test_clock.py
+"""Shared timestamp clock: per-tick caching and server offset tracking"""
+
+import unittest
+from datetime import datetime, timezone
+
+from clock import Clock
+
+# 2024-01-01T12:00:00Z
+NOON = datetime(2024, 1, 1, 12, tzinfo=timezone.utc).timestamp()
+
+
+class FixedClock(Clock):
+    """Clock reading a settable local time instead of time.time()"""
+
+    def __init__(self, resolution: float = 1.0):
+        super().__init__(resolution)
+        self.local_time = NOON
+
+    def time(self) -> float:
+        return self.local_time + self.server_offset
+
+
+class TimestampTest(unittest.TestCase):
+    def test_string_is_reused_within_a_tick(self):
+        clock = FixedClock()
+        first = clock.timestamp()
+        clock.local_time += 0.999
+        self.assertIs(clock.timestamp(), first)
+        self.assertEqual(first, "2024-01-01T12:00:00Z")
+
+    def test_rolls_over_to_the_next_tick(self):
+        clock = FixedClock()
+        clock.local_time += 0.5
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:00:00Z")
+        clock.local_time += 0.5
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:00:01Z")
+        clock.local_time += 59
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:01:00Z")
+
+    def test_sub_second_resolution_has_milliseconds(self):
+        clock = FixedClock(resolution=0.1)
+        clock.local_time += 0.25
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:00:00.200Z")
+        clock.local_time += 0.1
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:00:00.300Z")
+
+    def test_rejects_non_positive_resolution(self):
+        with self.assertRaises(ValueError):
+            Clock().set_resolution(0)
+
+
+class ServerOffsetTest(unittest.TestCase):
+    def test_offset_from_round_trip_midpoint(self):
+        clock = FixedClock()
+        offset = clock.observe_server_time("2024-01-01T12:00:10Z", NOON - 1, NOON + 1)
+        self.assertAlmostEqual(offset, 10.0)
+        self.assertEqual(clock.timestamp(), "2024-01-01T12:00:10Z")
+
+    def test_jitter_within_half_a_tick_is_ignored(self):
+        clock = FixedClock()
+        clock.observe_server_time("2024-01-01T12:00:10Z", NOON, NOON)
+        cached = clock.timestamp()
+        self.assertAlmostEqual(clock.observe_server_time("2024-01-01T12:00:10.400Z", NOON, NOON), 10.0)
+        self.assertIs(clock.timestamp(), cached)
+        self.assertAlmostEqual(clock.observe_server_time("2024-01-01T12:00:11Z", NOON, NOON), 11.0)
+
+    def test_unparseable_current_time(self):
+        clock = FixedClock()
+        self.assertIsNone(clock.observe_server_time(None, NOON, NOON))
+        self.assertIsNone(clock.observe_server_time("yesterday", NOON, NOON))
+        self.assertEqual(clock.server_offset, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+# tests/test_fleet_spec.py
+"""Identity CSV parsing of fleet specs"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fleet_spec import FleetSpecError, load_fleet_spec
+
+
+class IdentityCsvTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def write_csv(self, text: str) -> str:
+        path = os.path.join(self.directory, "identities.csv")
+        with open(path, "w", encoding="utf-8") as csv_file:
+            csv_file.write(text)
+        return path
+
+    def test_typed_columns(self):
+        path = self.write_csv("charge_point_id,max_power,use_tls,metrics_per_charger\nCP1,11000,yes,false\n")
+        config, = load_fleet_spec(path).iter_configs()
+        self.assertEqual(config["max_power"], 11000.0)
+        self.assertIs(config["use_tls"], True)
+        self.assertIs(config["metrics_per_charger"], False)
+
+    def test_bad_cell_names_file_row_and_field(self):
+        path = self.write_csv("charge_point_id,number_of_connectors\nCP1,2\nCP2,abc\n")
+        configs = load_fleet_spec(path).iter_configs()
+        self.assertEqual(next(configs)["number_of_connectors"], 2)
+        with self.assertRaisesRegex(FleetSpecError, r"identities\.csv row 2: bad number_of_connectors 'abc'"):
+            next(configs)
+
+
+if __name__ == "__main__":
+    unittest.main()
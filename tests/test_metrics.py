@@ -0,0 +1,57 @@
+# tests/test_metrics.py
+"""Prometheus rendering of the metrics registry, fleet-wide and per charger"""
+
+import unittest
+
+from metrics import CHARGER_LABEL, MetricsRegistry, render_prometheus
+
+
+def sample_lines(text: str, name: str):
+    """Non-comment lines of one metric family"""
+    return [line for line in text.splitlines() if line.startswith(name) and not line.startswith("#")]
+
+
+class RenderPrometheusTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.calls = self.registry.counter("ocpp_test_calls_total", "Test calls")
+        self.latency = self.registry.histogram("ocpp_test_seconds", "Test latency", (0.1, 1.0))
+        for charge_point_id, seconds in (("CP1", 0.05), ("CP2", 0.5), ("CP2", 5.0)):
+            labels = {"action": "Heartbeat", CHARGER_LABEL: charge_point_id}
+            self.calls.inc(labels=labels)
+            self.latency.observe(seconds, labels=labels)
+
+    def test_fleet_view_merges_chargers(self):
+        text = render_prometheus(self.registry)
+        self.assertEqual(sample_lines(text, "ocpp_test_calls_total"), ['ocpp_test_calls_total{action="Heartbeat"} 3'])
+        self.assertEqual(sample_lines(text, "ocpp_test_seconds"), [
+            'ocpp_test_seconds_bucket{action="Heartbeat",le="0.1"} 1',
+            'ocpp_test_seconds_bucket{action="Heartbeat",le="1"} 2',
+            'ocpp_test_seconds_bucket{action="Heartbeat",le="+Inf"} 3',
+            'ocpp_test_seconds_sum{action="Heartbeat"} 5.55',
+            'ocpp_test_seconds_count{action="Heartbeat"} 3',
+        ])
+        self.assertNotIn(CHARGER_LABEL, text)
+
+    def test_per_charger_view_keeps_series_apart(self):
+        text = render_prometheus(self.registry, per_charger=True)
+        self.assertEqual(sample_lines(text, "ocpp_test_calls_total"), [
+            'ocpp_test_calls_total{action="Heartbeat",charge_point="CP1"} 1',
+            'ocpp_test_calls_total{action="Heartbeat",charge_point="CP2"} 2',
+        ])
+        self.assertIn('ocpp_test_seconds_count{action="Heartbeat",charge_point="CP2"} 2', text)
+
+    def test_rendering_does_not_change_the_registry(self):
+        render_prometheus(self.registry)
+        series = self.latency.snapshot()
+        self.assertEqual(sorted(value.count for value in series.values()), [1, 2])
+
+    def test_type_and_help_lines(self):
+        text = render_prometheus(self.registry)
+        self.assertIn("# TYPE ocpp_test_calls_total counter", text)
+        self.assertIn("# HELP ocpp_test_seconds Test latency", text)
+        self.assertIn("# TYPE ocpp_test_seconds histogram", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# tests/test_offline_queue.py
+"""Offline transaction replay: placeholder transaction IDs and given-up transactions"""
+
+import asyncio
+import unittest
+
+from offline_queue import OfflineMessageQueue
+
+
+class FakeConfigManager:
+    def __init__(self, values):
+        self.values = values
+
+    def get_int_value(self, key, default):
+        return self.values.get(key, default)
+
+
+class FakeSimulator:
+    """The parts of EVChargerSimulator the offline queue uses"""
+
+    def __init__(self, responses):
+        self.charge_point_id = "CP1"
+        self.state_store = None
+        self.state_restored = False
+        self.is_connected = True
+        self.config_manager = FakeConfigManager({"TransactionMessageAttempts": 2, "TransactionMessageRetryInterval": 0})
+        self.transaction_connectors = {}
+        self.connector_transactions = {}
+        self.responses = responses  # action -> response dict, or an exception to raise
+        self.sent = []
+
+    def log(self, message, level="INFO"):
+        pass
+
+    async def send_call(self, action, payload):
+        self.sent.append((action, dict(payload)))
+        response = self.responses.get(action, {})
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def replace_transaction_id(self, placeholder_id, transaction_id):
+        connector_id = self.transaction_connectors.pop(placeholder_id)
+        self.transaction_connectors[transaction_id] = connector_id
+        self.connector_transactions[connector_id] = transaction_id
+
+    def abandon_transaction(self, placeholder_id):
+        connector_id = self.transaction_connectors.pop(placeholder_id)
+        self.connector_transactions[connector_id] = None
+
+
+def queue_offline_transaction(queue):
+    """Queue a StartTransaction, MeterValues and StopTransaction started offline on connector 1"""
+    placeholder = queue.next_placeholder_transaction_id()
+    queue.simulator.transaction_connectors[placeholder] = 1
+    queue.simulator.connector_transactions[1] = placeholder
+    queue.enqueue("StartTransaction", {"connectorId": 1, "idTag": "TAG", "meterStart": 0}, placeholder)
+    queue.enqueue("MeterValues", {"connectorId": 1, "transactionId": placeholder, "meterValue": []})
+    queue.enqueue("StopTransaction", {"transactionId": placeholder, "meterStop": 1000})
+    return placeholder
+
+
+class OfflineMessageQueueTest(unittest.TestCase):
+    def test_placeholder_ids_are_negative_and_unique(self):
+        queue = OfflineMessageQueue(FakeSimulator({}))
+        first = queue_offline_transaction(queue)
+        second = queue.next_placeholder_transaction_id()
+        self.assertLess(first, 0)
+        self.assertLess(second, first)
+
+    def test_delivered_start_rewrites_queued_messages(self):
+        simulator = FakeSimulator({"StartTransaction": {"transactionId": 42, "idTagInfo": {"status": "Accepted"}}})
+        queue = OfflineMessageQueue(simulator, flush_rate=0, flush_jitter=0)
+        placeholder = queue_offline_transaction(queue)
+
+        asyncio.run(queue.flush())
+
+        self.assertEqual([action for action, _ in simulator.sent], ["StartTransaction", "MeterValues", "StopTransaction"])
+        self.assertEqual(simulator.sent[1][1]["transactionId"], 42)
+        self.assertEqual(simulator.sent[2][1]["transactionId"], 42)
+        self.assertEqual(simulator.connector_transactions[1], 42)
+        self.assertNotIn(placeholder, simulator.transaction_connectors)
+        self.assertEqual(len(queue), 0)
+
+    def test_given_up_start_drops_its_messages_and_clears_connector(self):
+        simulator = FakeSimulator({"StartTransaction": ConnectionError("CALLERROR")})
+        queue = OfflineMessageQueue(simulator, flush_rate=0, flush_jitter=0)
+        placeholder = queue_offline_transaction(queue)
+        queue.enqueue("MeterValues", {"connectorId": 0, "meterValue": []})
+
+        asyncio.run(queue.flush())
+
+        self.assertEqual([action for action, _ in simulator.sent], ["StartTransaction", "StartTransaction", "MeterValues"])
+        self.assertEqual(simulator.sent[2][1]["connectorId"], 0)
+        self.assertIsNone(simulator.connector_transactions[1])
+        self.assertNotIn(placeholder, simulator.transaction_connectors)
+        self.assertEqual(len(queue), 0)
+
+    def test_full_queue_drops_meter_values_first(self):
+        queue = OfflineMessageQueue(FakeSimulator({}), max_messages=3)
+        for sequence in range(3):
+            self.assertTrue(queue.enqueue("MeterValues", {"connectorId": 0, "sequence": sequence}))
+        self.assertFalse(queue.enqueue("MeterValues", {"connectorId": 0, "sequence": 3}))
+
+        self.assertTrue(queue.enqueue("StopTransaction", {"transactionId": 7}))
+        self.assertEqual([message["action"] for message in queue.messages], ["MeterValues", "MeterValues", "StopTransaction"])
+        self.assertEqual(queue.messages[0]["payload"]["sequence"], 1)
+
+    def test_transaction_messages_kept_over_the_limit(self):
+        queue = OfflineMessageQueue(FakeSimulator({}), max_messages=1)
+        queue.enqueue("StopTransaction", {"transactionId": 7})
+        self.assertTrue(queue.enqueue("StopTransaction", {"transactionId": 8}))
+        self.assertEqual(len(queue), 2)
+
+    def test_placeholder_of_queued_start(self):
+        queue = OfflineMessageQueue(FakeSimulator({}))
+        payload = {"connectorId": 1, "idTag": "TAG", "meterStart": 0}
+        queue.enqueue("StartTransaction", payload, -3)
+        self.assertEqual(queue.placeholder_of(payload), -3)
+        self.assertIsNone(queue.placeholder_of(dict(payload)))
+
+
+if __name__ == "__main__":
+    unittest.main()
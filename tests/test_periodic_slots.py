@@ -0,0 +1,55 @@
+# tests/test_periodic_slots.py
+"""Per-charger phase spreading of heartbeats, keepalive pings and meter values"""
+
+import unittest
+
+try:
+    from ev_charger_simulator import _charger_phase, _seconds_until_slot
+except ImportError as e:  # websockets not installed
+    raise unittest.SkipTest(f"ev_charger_simulator not importable: {e}")
+
+
+class ChargerPhaseTest(unittest.TestCase):
+    def test_phase_is_deterministic_and_in_range(self):
+        for charge_point_id in ("CP1", "CP2", "BENCH00042", ""):
+            phase = _charger_phase(charge_point_id)
+            self.assertGreaterEqual(phase, 0.0)
+            self.assertLess(phase, 1.0)
+            self.assertEqual(phase, _charger_phase(charge_point_id))
+
+    def test_phases_spread_over_the_interval(self):
+        phases = [_charger_phase(f"CP{number:05d}") for number in range(1000)]
+        buckets = [0] * 10
+        for phase in phases:
+            buckets[int(phase * 10)] += 1
+        # Uniform would be 100 per tenth of the interval
+        self.assertGreater(min(buckets), 60)
+        self.assertLess(max(buckets), 140)
+
+
+class SecondsUntilSlotTest(unittest.TestCase):
+    def test_waits_until_the_phase_offset_of_the_interval(self):
+        self.assertAlmostEqual(_seconds_until_slot(100.0, 60.0, 0.5), 50.0)
+        self.assertAlmostEqual(_seconds_until_slot(125.0, 60.0, 0.5), 25.0)
+        self.assertAlmostEqual(_seconds_until_slot(151.0, 60.0, 0.5), 59.0)
+
+    def test_at_a_slot_waits_a_full_interval(self):
+        self.assertAlmostEqual(_seconds_until_slot(120.0, 60.0, 0.0), 60.0)
+        self.assertAlmostEqual(_seconds_until_slot(150.0, 60.0, 0.5), 60.0)
+
+    def test_always_within_one_interval(self):
+        for now in (0.0, 0.25, 17.5, 59.999, 1e6 + 0.1):
+            for phase in (0.0, 0.3, 0.999):
+                delay = _seconds_until_slot(now, 30.0, phase)
+                self.assertGreater(delay, 0.0)
+                self.assertLessEqual(delay, 30.0)
+
+    def test_consecutive_slots_are_one_interval_apart(self):
+        now = 1234.5
+        first = now + _seconds_until_slot(now, 300.0, 0.42)
+        second = first + _seconds_until_slot(first, 300.0, 0.42)
+        self.assertAlmostEqual(second - first, 300.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
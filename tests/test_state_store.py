@@ -0,0 +1,50 @@
+# tests/test_state_store.py
+"""State store: queued writes are visible to reads, and a closed store never hangs"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from state_store import StateStore
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "state.db")
+
+    def test_reads_see_queued_writes(self):
+        store = StateStore(self.path)
+        self.addCleanup(store.close)
+        store.save_configuration_key("CP1", "HeartbeatInterval", "60")
+        store.save_transaction("CP1", 1, 42)
+        store.save_offline_message("CP1", {"sequence": 1, "action": "StopTransaction",
+                                           "payload": {"transactionId": 42}, "placeholder": None})
+
+        state = store.load_charger("CP1")
+        self.assertEqual(state["configuration"], {"HeartbeatInterval": "60"})
+        self.assertEqual(state["transactions"], {1: 42})
+        self.assertEqual([message["action"] for message in store.load_offline_messages("CP1")], ["StopTransaction"])
+        self.assertEqual(store.load_charger("CP2")["configuration"], {})
+
+    def test_writes_survive_close(self):
+        store = StateStore(self.path)
+        store.save_configuration_key("CP1", "HeartbeatInterval", "60")
+        store.close()
+
+        reopened = StateStore(self.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.load_charger("CP1")["configuration"], {"HeartbeatInterval": "60"})
+
+    def test_closed_store_ignores_writes(self):
+        store = StateStore(self.path)
+        store.close()
+        store.save_configuration_key("CP1", "HeartbeatInterval", "60")
+        store.flush()  # Returns instead of waiting for a writer that has exited
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# tests/test_wire_trace.py
+"""Wire trace recording: write, rotate and read back, and a writer that dies"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import wire_trace
+from wire_trace import DIRECTION_IN, DIRECTION_OUT, WireTraceRecorder, read_trace
+
+
+class WireTraceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def read_all(self, recorder):
+        frames = []
+        for path in recorder.files:
+            frames.extend(read_trace(path))
+        return frames
+
+    def test_round_trip(self):
+        recorder = WireTraceRecorder(self.directory, compression="gzip")
+        recorder.start()
+        recorder.record("CP1", DIRECTION_OUT, '[2,"1","Heartbeat",{}]')
+        recorder.record("CP1", DIRECTION_IN, b'[3,"1",{"currentTime":"2024-01-01T00:00:00Z"}]')
+        recorder.record("CPé", DIRECTION_OUT, '[2,"2","DataTransfer",{"data":"é"}]')
+        recorder.stop()
+
+        frames = self.read_all(recorder)
+        self.assertEqual([(direction, charge_point_id, frame) for _, direction, charge_point_id, frame in frames], [
+            ("out", "CP1", b'[2,"1","Heartbeat",{}]'),
+            ("in", "CP1", b'[3,"1",{"currentTime":"2024-01-01T00:00:00Z"}]'),
+            ("out", "CPé", '[2,"2","DataTransfer",{"data":"é"}]'.encode("utf-8")),
+        ])
+        timestamps = [monotonic_ns for monotonic_ns, _, _, _ in frames]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_rotates_and_keeps_max_files(self):
+        recorder = WireTraceRecorder(self.directory, max_file_bytes=200, max_files=3, compression="gzip")
+        with mock.patch.object(wire_trace, "WRITE_BATCH", 5):  # Every batch fills a file
+            recorder.start()
+            for sequence in range(200):
+                recorder.record("CP1", DIRECTION_OUT, f'[2,"{sequence}","Heartbeat",{{}}]')
+            recorder.stop()
+
+        self.assertEqual(len(recorder.files), 3)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(os.path.basename(path) for path in recorder.files))
+        self.assertGreater(recorder.file_sequence, 3)
+
+        # The newest files hold the last frames, in order
+        sequences = [int(frame.split(b'"')[1]) for _, _, _, frame in self.read_all(recorder)]
+        self.assertEqual(sequences, list(range(sequences[0], 200)))
+
+    def test_truncated_file_reads_up_to_the_cut(self):
+        recorder = WireTraceRecorder(self.directory, compression="gzip")
+        recorder.start()
+        recorder.record("CP1", DIRECTION_OUT, "x" * 100)
+        recorder.record("CP1", DIRECTION_OUT, "y" * 100)
+        recorder.stop()
+
+        path = recorder.files[0]
+        with gzip.open(path, "rb") as trace_file:
+            data = trace_file.read()
+        with gzip.open(path, "wb") as trace_file:
+            trace_file.write(data[:-50])
+        self.assertEqual([frame for _, _, _, frame in read_trace(path)], [b"x" * 100])
+
+    def test_dead_writer_clears_recorder_and_stop_returns(self):
+        with mock.patch.object(WireTraceRecorder, "_open_file", side_effect=OSError("disk full")):
+            recorder = wire_trace.start_recording(self.directory, max_queued_frames=2, compression="gzip")
+            recorder.thread.join(5)
+        self.addCleanup(wire_trace.stop_recording)
+
+        self.assertIsNone(wire_trace.recorder)
+        for _ in range(5):
+            recorder.record("CP1", DIRECTION_OUT, "[]")  # Queue fills up; frames are dropped, not blocking
+        started = time.monotonic()
+        recorder.stop(timeout=1)
+        self.assertLess(time.monotonic() - started, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
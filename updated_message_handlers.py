@@ -43,6 +43,8 @@ class MessageHandlers:
                 connector_id, charging_profile
             )
             self.simulator.log(f"Charging profile status: {profile_status}", "INFO")
+            if profile_status == "Accepted":
+                self.simulator.persist_charging_profiles()
         
         # Start transaction
         await self.simulator.start_transaction(
@@ -63,30 +65,35 @@ class MessageHandlers:
         self.simulator.log(f"GetConfiguration received: {payload}")
         
         requested_keys = payload.get("key", [])
+        config_manager = self.simulator.config_manager
+        
+        # GetConfigurationMaxKeys caps how many keys one request may ask for
+        max_keys = config_manager.get_int_value("GetConfigurationMaxKeys", 0)
+        if max_keys and len(requested_keys) > max_keys:
+            await self.simulator.send_call_error(message_id, "OccurenceConstraintViolation",
+                                                 f"At most {max_keys} keys may be requested")
+            return
+        
+        if not requested_keys:
+            # Return all keys, reusing the pre-encoded response until a key changes
+            await self.simulator.send_call_result_raw(message_id, config_manager.get_full_configuration_json())
+            self.simulator.log(f"Sent {len(config_manager.configuration_keys)} configuration keys")
+            return
         
         configuration_keys = []
         unknown_keys = []
         
-        if not requested_keys:
-            # Return all keys
-            for config_key in self.simulator.config_manager.configuration_keys.values():
+        # Return only requested keys
+        for key_name in requested_keys:
+            if key_name in config_manager.configuration_keys:
+                config_key = config_manager.configuration_keys[key_name]
                 configuration_keys.append({
                     "key": config_key.key,
                     "readonly": config_key.readonly,
                     "value": config_key.value
                 })
-        else:
-            # Return only requested keys
-            for key_name in requested_keys:
-                if key_name in self.simulator.config_manager.configuration_keys:
-                    config_key = self.simulator.config_manager.configuration_keys[key_name]
-                    configuration_keys.append({
-                        "key": config_key.key,
-                        "readonly": config_key.readonly,
-                        "value": config_key.value
-                    })
-                else:
-                    unknown_keys.append(key_name)
+            else:
+                unknown_keys.append(key_name)
         
         response = {
             "configurationKey": configuration_keys
@@ -109,7 +116,7 @@ class MessageHandlers:
             await self.simulator.send_call_result(message_id, {"status": "Rejected"})
             return
         
-        status = self.simulator.config_manager.update_configuration_key(key, value)
+        status = self.simulator.update_configuration_key(key, value)
         
         await self.simulator.send_call_result(message_id, {"status": status})
         
@@ -181,6 +188,7 @@ class MessageHandlers:
                 await self.simulator.send_call_result(message_id, {"status": status})
                 
                 if status == "Accepted":
+                    self.simulator.persist_charging_profiles()
                     self.simulator.log(f"Charging profile {cs_charging_profiles.get('chargingProfileId', 'unknown')} applied successfully", "INFO")
                     
                     # Show current effective limits
@@ -212,6 +220,7 @@ class MessageHandlers:
                 await self.simulator.send_call_result(message_id, {"status": status})
                 
                 if status == "Accepted":
+                    self.simulator.persist_charging_profiles()
                     self.simulator.log(f"Charging profile(s) cleared successfully", "INFO")
                 else:
                     self.simulator.log(f"No matching charging profiles found to clear", "INFO")
@@ -233,34 +242,9 @@ class MessageHandlers:
         
         if hasattr(self.simulator, 'charging_profile_handler'):
             try:
-                # Get active profiles for the connector
-                profiles_info = self.simulator.charging_profile_handler.get_active_profiles_info()
-                connector_profiles = profiles_info.get(connector_id, [])
-                
-                if connector_profiles:
-                    # Build composite schedule from active profiles
-                    # For simplicity, use the highest priority profile
-                    highest_priority = max(connector_profiles, key=lambda p: p["stack_level"])
-                    
-                    response = {
-                        "status": "Accepted",
-                        "connectorId": connector_id,
-                        "scheduleStart": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
-                        "chargingSchedule": {
-                            "duration": duration,
-                            "chargingRateUnit": charging_rate_unit or highest_priority["rate_unit"],
-                            "chargingSchedulePeriod": [
-                                {
-                                    "startPeriod": period["start"],
-                                    "limit": period["limit"],
-                                    "numberPhases": period.get("phases")
-                                }
-                                for period in highest_priority["periods"]
-                            ]
-                        }
-                    }
-                else:
-                    response = {"status": "Accepted"}
+                response = self.simulator.charging_profile_handler.get_composite_schedule(
+                    connector_id, duration, charging_rate_unit
+                )
                 
                 await self.simulator.send_call_result(message_id, response)
                 
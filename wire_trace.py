@@ -0,0 +1,244 @@
+# wire_trace.py
+"""Opt-in recorder of every OCPP-J frame sent or received, as raw bytes
+
+Frames are handed to a bounded queue on the event loop and written by a
+background thread into rotating compressed files (zstd if the zstandard
+package is installed, gzip otherwise). When the queue is full, frames are
+dropped and counted instead of growing memory. With no recorder started the
+simulators only check a module attribute per frame.
+
+File layout: MAGIC, then one record per frame:
+    <Q monotonic ns> <B direction> <H charger id length> <I frame length> <charger id> <frame>
+
+Usage:
+    python wire_trace.py dump trace-20240101-120000-0001.bin.gz
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"OCPPTRC1"
+RECORD_HEADER = struct.Struct("<QBHI")
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+DIRECTION_NAMES = {DIRECTION_IN: "in", DIRECTION_OUT: "out"}
+
+# Frames written per compressor call at most
+WRITE_BATCH = 1000
+
+# Seconds stop() waits for the writer to take the stop marker and to finish
+STOP_TIMEOUT = 10.0
+
+FRAMES_DROPPED = registry.counter(
+    "ocpp_wire_trace_dropped_total", "Frames not traced because the trace queue was full")
+
+# The active recorder, None when tracing is off
+recorder: Optional["WireTraceRecorder"] = None
+
+Frame = Union[str, bytes]
+
+
+class WireTraceRecorder:
+    """Queues frames from the event loop and writes them from a background thread"""
+
+    def __init__(self, directory: str, max_file_bytes: int = 64 * 2 ** 20, max_files: int = 20,
+                 max_queued_frames: int = 100000, compression: str = "auto"):
+        if compression == "auto":
+            compression = "zstd" if ZSTD_AVAILABLE else "gzip"
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            raise ValueError("zstd wire traces need the zstandard package (pip install zstandard)")
+        if compression not in ("zstd", "gzip"):
+            raise ValueError(f"Unknown wire trace compression '{compression}'")
+
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes  # Uncompressed bytes per file before rotating
+        self.max_files = max_files            # Oldest files are deleted beyond this, 0 = keep all
+        self.compression = compression
+        self.queue: queue.Queue = queue.Queue(max_queued_frames)
+        self.thread: Optional[threading.Thread] = None
+        self.files: List[str] = []
+        self.file_sequence = 0
+
+    def record(self, charge_point_id: str, direction: int, frame: Frame):
+        """Queue one frame; never blocks the event loop"""
+        try:
+            self.queue.put_nowait((time.monotonic_ns(), direction, charge_point_id, frame))
+        except queue.Full:
+            FRAMES_DROPPED.inc()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._write_frames, name="wire-trace", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = STOP_TIMEOUT):
+        """Write the frames still queued and close the current file"""
+        if self.thread is None:
+            return
+        # A dead writer never drains a full queue, so the stop marker must not wait for space forever
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("Wire trace writer is not draining its queue, queued frames are lost")
+            else:
+                self.thread.join(timeout)
+        self.thread = None
+
+    def _open_file(self):
+        self.file_sequence += 1
+        extension = "zst" if self.compression == "zstd" else "gz"
+        name = f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{self.file_sequence:04d}.bin.{extension}"
+        path = os.path.join(self.directory, name)
+
+        if self.compression == "zstd":
+            raw_file = open(path, "wb")
+            trace_file = zstandard.ZstdCompressor().stream_writer(raw_file, closefd=True)
+        else:
+            trace_file = gzip.open(path, "wb", compresslevel=6)
+        trace_file.write(MAGIC)
+
+        self.files.append(path)
+        while self.max_files and len(self.files) > self.max_files:
+            oldest = self.files.pop(0)
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                logger.warning(f"Could not remove old wire trace {oldest}: {e}")
+        return trace_file
+
+    def _write_frames(self):
+        global recorder
+        trace_file = None
+        written = 0
+        try:
+            trace_file = self._open_file()
+            while True:
+                # Take everything queued so far and write it with one compressor call
+                items = [self.queue.get()]
+                while len(items) < WRITE_BATCH:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                batch = bytearray()
+                for item in items:
+                    if item is None:
+                        trace_file.write(batch)
+                        return
+                    monotonic_ns, direction, charge_point_id, frame = item
+                    frame_bytes = frame.encode("utf-8") if isinstance(frame, str) else frame
+                    id_bytes = charge_point_id.encode("utf-8")
+                    batch += RECORD_HEADER.pack(monotonic_ns, direction, len(id_bytes), len(frame_bytes))
+                    batch += id_bytes
+                    batch += frame_bytes
+                trace_file.write(batch)
+
+                written += len(batch)
+                if written >= self.max_file_bytes:
+                    trace_file.close()
+                    trace_file = self._open_file()
+                    written = 0
+        except Exception as e:
+            logger.error(f"Wire trace writer stopped: {e}")
+            # Simulators stop queueing frames nobody will write
+            if recorder is self:
+                recorder = None
+        finally:
+            if trace_file is not None:
+                trace_file.close()
+
+
+def start_recording(directory: str, **options) -> WireTraceRecorder:
+    """Start tracing every simulator in the process into directory"""
+    global recorder
+    stop_recording()
+    new_recorder = WireTraceRecorder(directory, **options)
+    recorder = new_recorder  # Before the writer starts, so a writer failing at once can clear it
+    try:
+        new_recorder.start()
+    except Exception:
+        recorder = None
+        raise
+    logger.info(f"Recording OCPP frames to {directory} ({new_recorder.compression})")
+    return new_recorder
+
+
+def stop_recording():
+    """Stop tracing and flush what is queued"""
+    global recorder
+    active, recorder = recorder, None
+    if active is not None:
+        active.stop()
+
+
+def _open_for_reading(path: str):
+    if path.endswith(".zst"):
+        if not ZSTD_AVAILABLE:
+            raise ValueError("Reading zstd wire traces needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return gzip.open(path, "rb")
+
+
+def _read_exactly(trace_file, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = trace_file.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_trace(path: str) -> Iterator[Tuple[int, str, str, bytes]]:
+    """Yield (monotonic ns, direction, charger id, frame bytes) from a trace file"""
+    with _open_for_reading(path) as trace_file:
+        if _read_exactly(trace_file, len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a wire trace")
+        while True:
+            header = _read_exactly(trace_file, RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return  # End of file, or a file cut short by a crash
+            monotonic_ns, direction, id_length, frame_length = RECORD_HEADER.unpack(header)
+            body = _read_exactly(trace_file, id_length + frame_length)
+            if len(body) < id_length + frame_length:
+                return
+            yield monotonic_ns, DIRECTION_NAMES.get(direction, "?"), body[:id_length].decode("utf-8"), body[id_length:]
+
+
+def main(argv=None):
+    """Print trace files as text, one frame per line"""
+    parser = argparse.ArgumentParser(description="Inspect OCPP wire traces")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump", help="Print frames as text")
+    dump_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        for path in args.paths:
+            for monotonic_ns, direction, charge_point_id, frame in read_trace(path):
+                sys.stdout.write(f"{monotonic_ns / 1e9:.6f} {charge_point_id} {direction:<3} "
+                                 f"{frame.decode('utf-8', errors='replace')}\n")
+
+
+if __name__ == "__main__":
+    main()